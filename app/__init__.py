@@ -1,4 +1,12 @@
-from app.api import API_V1
+import time
+from app import startup
+
+# Measure the import of the API (and its dependencies), see GET /startup
+startup.IMPORT_STARTED = time.perf_counter()
+with startup.IMPORT_TIMER:
+    from app.api import API_V1
+startup.IMPORT_SECONDS = time.perf_counter() - startup.IMPORT_STARTED
+
 from fastapi.middleware.cors import CORSMiddleware
 
 # We might swap out complete api major version implementation, based on setting in the future.
@@ -0,0 +1,134 @@
+import asyncio, logging, math, os, time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+from fastapi.exceptions import HTTPException
+
+from app.timing import METRICS, timed
+
+log = logging.getLogger(__name__)
+
+
+class Lane(object):
+    """
+    A lane of admitted work: at most `concurrency` requests run at the same time,
+    the others wait in the lane's queue as long as their total cost stays within `max_queued_cost`.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queued_cost: int) -> None:
+        super().__init__()
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queued_cost = max_queued_cost
+
+        self.queued_cost = 0
+        self.in_flight_cost = 0
+        self.in_flight = 0
+        # Observed processing time per unit of cost (moving average), to estimate Retry-After
+        self.seconds_per_cost = 0.0001
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily, so it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def retry_after(self) -> int:
+        """
+        Estimated seconds until the queued and running work of this lane is done
+        """
+        pending = self.queued_cost + self.in_flight_cost
+        return max(1, math.ceil(pending * self.seconds_per_cost / self.concurrency))
+
+    def observe(self, cost: int, seconds: float) -> None:
+        if cost > 0:
+            self.seconds_per_cost = 0.8 * self.seconds_per_cost + 0.2 * (seconds / cost)
+
+
+class AdmissionController(object):
+    """
+    Admission control for the CPU heavy (NLP) endpoints.
+
+    The cost of a request is estimated from its text length. Short texts and long documents
+    go into separate lanes, so interactive requests don't wait behind batch-sized ones.
+    When a lane's queue is over budget, requests are rejected with 429 and a Retry-After header.
+
+    Configured by environment variables:
+
+    - **ADMISSION_SHORT_TEXT_LIMIT** Texts up to this length (chars) use the short lane (default: 20000)
+    - **ADMISSION_SHORT_CONCURRENCY**, **ADMISSION_LONG_CONCURRENCY** Requests running at the same time per lane (default: 2, 1)
+    - **ADMISSION_SHORT_QUEUE**, **ADMISSION_LONG_QUEUE** Maximum cost (chars) waiting per lane (default: 200000, 2000000)
+    """
+
+    def __init__(self, short_text_limit: int, short: Lane, long: Lane) -> None:
+        super().__init__()
+        self.short_text_limit = short_text_limit
+        self.short = short
+        self.long = long
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            short_text_limit=int(os.getenv("ADMISSION_SHORT_TEXT_LIMIT", 20000)),
+            short=Lane(
+                "short",
+                concurrency=int(os.getenv("ADMISSION_SHORT_CONCURRENCY", 2)),
+                max_queued_cost=int(os.getenv("ADMISSION_SHORT_QUEUE", 200000)),
+            ),
+            long=Lane(
+                "long",
+                concurrency=int(os.getenv("ADMISSION_LONG_CONCURRENCY", 1)),
+                max_queued_cost=int(os.getenv("ADMISSION_LONG_QUEUE", 2000000)),
+            ),
+        )
+
+    @property
+    def lanes(self) -> List[Lane]:
+        return [self.short, self.long]
+
+    def lane(self, cost: int) -> Lane:
+        return self.short if cost <= self.short_text_limit else self.long
+
+    @asynccontextmanager
+    async def admit(self, cost: int, reject: bool = True) -> AsyncIterator[Lane]:
+        """
+        Waits until the work (of estimated `cost`) may run, or rejects it with 429.
+        Background work (reject=False) always waits.
+        """
+        lane = self.lane(cost)
+
+        # A request is always admitted into an empty queue, even if it exceeds the budget on its own
+        if reject and lane.queued_cost and lane.queued_cost + cost > lane.max_queued_cost:
+            METRICS.increment("summed_admission_rejected_total", lane=lane.name)
+            retry_after = lane.retry_after()
+            log.warning(
+                f"Rejecting request (cost {cost}) in {lane.name} lane, retry after {retry_after}s"
+            )
+            raise HTTPException(
+                429,
+                f"Too many requests, please retry after {retry_after} seconds",
+                headers={"Retry-After": str(retry_after)},
+            )
+
+        lane.queued_cost += cost
+        try:
+            with timed("admission_wait", lane=lane.name):
+                await lane.semaphore.acquire()
+        finally:
+            lane.queued_cost -= cost
+
+        lane.in_flight += 1
+        lane.in_flight_cost += cost
+        started = time.perf_counter()
+        try:
+            yield lane
+        finally:
+            lane.observe(cost, time.perf_counter() - started)
+            lane.in_flight -= 1
+            lane.in_flight_cost -= cost
+            lane.semaphore.release()
+
+
+ADMISSION = AdmissionController.from_env()
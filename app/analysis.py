@@ -0,0 +1,305 @@
+import hashlib, logging, os, re
+from typing import List, Optional, Tuple
+
+from app.api_models import (
+    AnalyzeRequest,
+    AnalyzeResponse,
+    ExtractResponse,
+    Lemma,
+    NamedEntity,
+    NounChunk,
+    Sentence,
+)
+from app.cache import ANALYZE_CACHE, PARAGRAPH_CACHE
+from app.keywords import rank_keywords, search_query
+from app.profiling import profiled
+from app.sessions import SESSIONS
+from app.textanalyzer import HEALTH_ENTITY_SOURCES, TextAnalyzer
+from app.timing import timed
+
+log = logging.getLogger(__name__)
+
+# Analyze incrementally (paragraph by paragraph, reusing the results of unchanged ones) by default,
+# otherwise only when requested (AnalyzeRequest.incremental)
+INCREMENTAL_ANALYSIS = os.getenv("INCREMENTAL_ANALYSIS", "false").lower() in ("1", "true", "yes")
+
+# Paragraphs are separated by blank lines
+PARAGRAPH_SEPARATOR = re.compile(r"\n[ \t\r\f\v]*\n\s*")
+
+
+def analyze_cache_key(request: AnalyzeRequest) -> str:
+    """
+    Key for the ANALYZE_CACHE: a hash over all request fields that influence the analysis result
+    """
+    h = hashlib.sha256()
+    for value in (
+        request.language,
+        request.model,
+        request.num_sentences,
+        request.summarizer,
+        request.incremental,
+    ):
+        h.update(f"{value}\x00".encode("utf-8"))
+    h.update(request.text.encode("utf-8"))
+    return h.hexdigest()
+
+
+def document_request(
+    text: Optional[str] = None,
+    language: Optional[str] = None,
+    model: Optional[str] = None,
+    num_sentences: Optional[int] = None,
+    extracted: Optional[ExtractResponse] = None,
+) -> AnalyzeRequest:
+    """
+    The AnalyzeRequest for a document, its text given or extracted (then in the detected language, unless given).
+    The pipeline, jobs and the prefetcher all build theirs here, so the same document gets the same
+    ANALYZE_CACHE key, whichever of them analyzed it first.
+    """
+    if extracted is not None:
+        text = extracted.text
+        language = language or extracted.language
+    fields = {"text": text or "", "language": language or None, "model": model or None}
+    if num_sentences is not None:
+        fields["num_sentences"] = num_sentences
+    return AnalyzeRequest(**fields)
+
+
+def cached_analysis(request: AnalyzeRequest) -> Optional[AnalyzeResponse]:
+    """
+    The analysis for this request from the ANALYZE_CACHE, if there is one
+    """
+    cached = ANALYZE_CACHE.get(analyze_cache_key(request))
+    if cached is not None and request.session:
+        return SESSIONS.create(cached)
+    return cached
+
+
+def analyze(request: AnalyzeRequest, use_cache: bool = True) -> AnalyzeResponse:
+    """
+    Runs the analysis (spaCy pipeline, health entities, summary) for an AnalyzeRequest.
+    Results are kept in the ANALYZE_CACHE, so repeated (or prefetched) documents are served from there.
+    """
+    with profiled():
+        return _analyze(request, use_cache)
+
+
+def _analyze(request: AnalyzeRequest, use_cache: bool) -> AnalyzeResponse:
+    key = analyze_cache_key(request)
+    if use_cache:
+        cached = ANALYZE_CACHE.get(key)
+        if cached:
+            log.debug(f"Analysis {key} served from cache")
+            return SESSIONS.create(cached) if request.session else cached
+
+    language, text, model, num_sentences, summarizer = map(
+        dict(request).get, ("language", "text", "model", "num_sentences", "summarizer")
+    )
+
+    analyzer = TextAnalyzer(text, language, model)
+    nlp = analyzer()
+    model_name = f"{analyzer.language}_{analyzer.model}"
+
+    analyzed_text = text.strip().replace("\n", " ")
+
+    doc = None
+    if request.incremental if request.incremental is not None else INCREMENTAL_ANALYSIS:
+        # Only changed paragraphs are analyzed, the others come from the PARAGRAPH_CACHE
+        part = _analyze_paragraphs(analyzer, nlp, model_name, text.strip(), analyzed_text)
+    else:
+        # Calls the spaCy NLP pipeline
+        with timed("nlp", model=model_name):
+            doc = nlp(analyzed_text)
+        part = _analyze_doc(analyzer, doc, model_name)
+
+    # Get the top-n sentences (the "summary"), the engine depends on the length of the text
+    with timed("top_sentences"):
+        top_sentences = analyzer.top_sentences(
+            part.sentences, num_sentences=num_sentences, engine=summarizer
+        )
+
+    # Keywords and a search query: the most specific noun chunks and entities, health entities first
+    with timed("keywords"):
+        keywords = rank_keywords(
+            [span.text for span in part.noun_chunks + part.entities + part.health_entities],
+            boost=[entity.text for entity in part.health_entities],
+        )
+
+    response = AnalyzeResponse.construct(
+        language=analyzer.language or None,
+        model=analyzer.model or None,
+        text=analyzed_text,
+        entities=part.entities or None,
+        health_entities=part.health_entities or None,
+        # lemmatized_text=lemma_text or None,
+        # entities_text=entities_text or None,
+        # noun_chunks=noun_chunks or None,
+        # noun_chunks_text=noun_chunks_text or None,
+        # sentences=sentences or None,
+        top_sentences=top_sentences or None,
+        summarizer=analyzer.summarizer,
+        keywords=keywords or None,
+        search_query=search_query(keywords),
+        # lemma=lemma or None,
+    )
+
+    ANALYZE_CACHE.set(key, response)
+
+    if request.session:
+        # Keeps the Doc, so noun chunks etc. can be derived later (in incremental mode, it's parsed when needed)
+        return SESSIONS.create(response, doc)
+    return response
+
+
+def _analyze_doc(
+    analyzer: TextAnalyzer,
+    doc,
+    model_name: str,
+    ta4h_entities: Optional[List[NamedEntity]] = None,
+) -> AnalyzeResponse:
+    """
+    Entities, health entities, noun chunks and sentences of a parsed text (or paragraph), with offsets relative to it.
+    TA4H entities are requested, unless passed (see _analyze_paragraphs)
+    """
+    #
+    # Named entities identify "things", like organisations, quantities
+    #
+    # Server generated data, so we skip pydantic validation (.construct) for the many small objects
+    entities = [
+        NamedEntity.construct(
+            text=entity.text,
+            start=entity.start_char,
+            end=entity.end_char,
+            label=entity.label_,
+        )
+        for entity in doc.ents
+    ]
+
+    #
+    # Medical Named Entities, from the gazetteer and/or Azure Text Analytics for Health (if configured)
+    #
+    with timed("health_entities"):
+        entities_medical = analyzer.get_health_entities(doc.text, doc, ta4h_entities)
+
+    # Noun chunks with their position in the original text.
+    # These are usually good keywords e.g. for a custom web search, without leading stopwords ("the", "our"...)
+    try:
+        chunks = list(doc.noun_chunks)
+    except (NotImplementedError, ValueError):
+        # No syntax iterator or parser for this language/model
+        chunks = []
+    noun_chunks = []
+    for chunk in chunks:
+        while len(chunk) and chunk[0].is_stop:
+            chunk = chunk[1:]
+        if len(chunk):
+            noun_chunks.append(
+                NounChunk.construct(text=chunk.text, start=chunk.start_char, end=chunk.end_char)
+            )
+
+    # Sentences detected by the sentencizer.
+    # We will use the "lemmatized" sentence without stopwords for the ranking
+    #
+    with timed("sentences", model=model_name):
+        sentences: List[Sentence] = [
+            Sentence.construct(
+                text=sentence.text,
+                lemmatized_text=" ".join(
+                    [token.lemma_ for token in sentence if not token.is_stop]
+                ),
+                start=sentence.start_char,
+                end=sentence.end_char,
+            )
+            for sentence in doc.sents
+            if len(sentence.text) >= 9
+            # TODO check if we can improve the default spaCy sentencizer
+        ]
+
+    return AnalyzeResponse.construct(
+        text=doc.text,
+        entities=entities,
+        health_entities=entities_medical,
+        noun_chunks=noun_chunks,
+        sentences=sentences,
+    )
+
+
+def paragraphs(text: str) -> List[Tuple[int, int]]:
+    """
+    (start, end) offsets of the paragraphs (separated by blank lines) of a text
+    """
+    spans, start = [], 0
+    for separator in PARAGRAPH_SEPARATOR.finditer(text):
+        if separator.start() > start:
+            spans.append((start, separator.start()))
+        start = separator.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def _shifted(spans: Optional[list], offset: int) -> list:
+    return [
+        span.__class__.construct(
+            **{**span.__dict__, "start": span.start + offset, "end": span.end + offset}
+        )
+        for span in spans or []
+    ]
+
+
+def _analyze_paragraphs(
+    analyzer: TextAnalyzer, nlp, model_name: str, text: str, analyzed_text: str
+) -> AnalyzeResponse:
+    """
+    Incremental analysis: paragraphs are analyzed on their own, and their results cached by content hash.
+    After an edit, only the changed paragraphs are parsed (and sent to TA4H, in one request), the results
+    of the others are reused, with their offsets shifted to the new positions.
+    """
+    # Results depend on the model and on where the health entities come from, besides the paragraph itself
+    context = f"{model_name}\x00{','.join(HEALTH_ENTITY_SOURCES)}\x00{analyzer.uses_ta4h()}\x00"
+
+    # Offsets of the text and the analyzed text are the same, just newlines were replaced
+    spans = paragraphs(text)
+    keys = [
+        hashlib.sha256((context + analyzed_text[start:end]).encode("utf-8")).hexdigest()
+        for start, end in spans
+    ]
+
+    parts = {}
+    for key in set(keys):
+        cached = PARAGRAPH_CACHE.get(key)
+        if cached is not None:
+            parts[key] = cached
+
+    changed = [
+        (key, analyzed_text[start:end])
+        for key, (start, end) in zip(keys, spans)
+        if key not in parts
+    ]
+    changed = list(dict(changed).items())
+    log.debug(f"Incremental analysis: {len(changed)} of {len(spans)} paragraphs changed")
+
+    if changed:
+        with timed("nlp", model=model_name):
+            docs = list(nlp.pipe(paragraph for _, paragraph in changed))
+        if analyzer.uses_ta4h():
+            with timed("health_entities"):
+                ta4h_entities = analyzer.get_ta4h_entities_batch(
+                    [paragraph for _, paragraph in changed]
+                )
+        else:
+            ta4h_entities = [None] * len(changed)
+        for (key, _), doc, paragraph_ta4h in zip(changed, docs, ta4h_entities):
+            parts[key] = _analyze_doc(analyzer, doc, model_name, paragraph_ta4h)
+            PARAGRAPH_CACHE.set(key, parts[key])
+
+    result = AnalyzeResponse.construct(
+        entities=[], health_entities=[], noun_chunks=[], sentences=[]
+    )
+    for key, (start, _) in zip(keys, spans):
+        part = parts[key]
+        result.entities += _shifted(part.entities, start)
+        result.health_entities += _shifted(part.health_entities, start)
+        result.noun_chunks += _shifted(part.noun_chunks, start)
+        result.sentences += _shifted(part.sentences, start)
+    return result
@@ -1,8 +1,8 @@
 # Basic imports
 from app import bing_search, cognitive_services, dictionary, text_extract
 from app.renderer import HTMLRenderer
-import os, logging, tempfile
-from typing import List, Text
+import asyncio, os, logging, tempfile
+from typing import List, Optional, Text, Union
 from dotenv import load_dotenv, find_dotenv
 import requests
 from urllib.parse import urlencode
@@ -14,18 +14,33 @@ import logging
 
 # FastAPI, Starlette, Pydantic etc...
 import fastapi
-from fastapi import FastAPI
-from fastapi.datastructures import UploadFile
-from fastapi.params import File
+from fastapi import FastAPI, Request
 from fastapi.exceptions import HTTPException
-from starlette.responses import HTMLResponse, JSONResponse, RedirectResponse
-
-# Spacy and lang models
-import spacy
-
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import (
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 
-from app.textanalyzer import TextAnalyzer
+from app import startup
+from app.admission import ADMISSION
+from app.analysis import analyze, cached_analysis
+from app.compact import to_compact
+from app.pipeline import extract_url, extract_urls, run_pipeline
+from app.jobs import JobWorkers, check_callback_url, get_job_store
+from app.model_registry import MODELS
+from app.keywords import SEARCH_QUERY_KEYWORDS
+from app.sessions import SESSIONS
+from app.prefetch import Prefetcher
+from app.timing import METRICS
 from app.utils import init_api
+from app.cache import DEFINITION_CACHE, SEARCH_CACHE, TRANSLATE_CACHE, UPLOAD_CACHE
+from app.uploads import spool_upload
 
 from app.bing_search import bing_search
 
@@ -37,11 +52,18 @@ from app.api_models import (
     ExtractResponse,
     ImmersiveReaderTokenResponse,
     Lemma,
+    AnalyzeJobRequest,
     AnalyzeRequest,
     AnalyzeResponse,
+    CompactRenderRequest,
+    ExtractBatchRequest,
+    ExtractBatchResponse,
     DefinitionResponse,
+    JobResponse,
     NamedEntity,
     NounChunk,
+    PipelineRequest,
+    PipelineResponse,
     RenderRequest,
     SearchResponse,
     Sentence,
@@ -55,6 +77,12 @@ log = logging.getLogger(__name__)
 # If running in an (AKS) cluster...
 prefix = os.getenv("CLUSTER_ROUTE_PREFIX", "").rstrip("/")
 
+# Upper limit of URLs per /extract/batch request
+EXTRACT_BATCH_MAX_URLS = int(os.getenv("EXTRACT_BATCH_MAX_URLS", 20))
+
+# Estimated cost (text length) for admission control of /pipeline requests for a URL
+PIPELINE_URL_COST = int(os.getenv("PIPELINE_URL_COST", 50000))
+
 
 #
 # Based on a text, language and model name, construct the name of the loadable spacy Language (e.g. "en_core_web_sm")
@@ -73,6 +101,47 @@ api = FastAPI(
 init_api(api, log)
 
 
+#
+# Load heavy dependencies and models before serving, if configured. Otherwise they load on first use.
+#
+@api.on_event("startup")
+async def warmup_on_startup():
+    if os.getenv("WARMUP_ON_STARTUP", "false").lower() in ("1", "true", "yes"):
+        startup.warmup()
+    startup.startup_completed()
+
+
+#
+# Asynchronous analysis jobs (see app/jobs.py). The job store (database) is created on first use.
+#
+JOB_WORKERS: Optional[JobWorkers] = None
+
+
+@api.on_event("startup")
+async def start_job_workers():
+    global JOB_WORKERS
+    workers = int(os.getenv("JOBS_WORKERS", 1))
+    if workers > 0:
+        store = await run_in_threadpool(get_job_store)
+        JOB_WORKERS = JobWorkers(store, workers=workers, loop=asyncio.get_event_loop())
+        JOB_WORKERS.start()
+
+
+@api.on_event("shutdown")
+async def stop_job_workers():
+    if JOB_WORKERS is not None:
+        JOB_WORKERS.stop()
+
+
+#
+# Warm the result stores with (pre-)analyzed pages from trusted websites, if enabled
+#
+@api.on_event("startup")
+async def start_prefetcher():
+    if Prefetcher.enabled():
+        Prefetcher.from_env().start()
+
+
 #
 # / gets redirected to API docs
 #
@@ -82,14 +151,52 @@ async def docs_redirect():
     return RedirectResponse(f"docs")
 
 
+#
+# Latency histograms and counters per stage, model and upstream (Prometheus text format)
+#
+@api.get("/metrics", include_in_schema=False)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(METRICS.render())
+
+
+#
+# Import and startup times, to see which modules dominate the (cold) start
+#
+@api.get("/startup", include_in_schema=False)
+async def get_startup() -> JSONResponse:
+    return JSONResponse(startup.startup_report())
+
+
+#
+# Loaded spaCy models of this worker, with their approximate memory (see app/model_registry.py)
+#
+@api.get("/models", include_in_schema=False)
+async def get_models() -> JSONResponse:
+    return JSONResponse(
+        {"memory_budget_mb": MODELS.memory_budget_mb, "loaded": MODELS.loaded()}
+    )
+
+
 @api.get(
     "/translate",
-    description="Translate text into a target language.",
+    description="Translate text into a target language. \
+        Instead of the text, the session_id of an analysis can be given.",
     response_model=TranslateResponse,
     tags=["text_analysis"],
 )
-async def get_translate(text: str, to: str = "de") -> TranslateResponse:
-    result = await cognitive_services.translate(text=text, to=to)
+async def get_translate(
+    text: Optional[str] = None, to: str = "de", session_id: Optional[str] = None
+) -> TranslateResponse:
+    if session_id:
+        # The analyzed text of an analysis session
+        text = (await run_in_threadpool(SESSIONS.get, session_id)).analysis.text
+    if not text:
+        raise HTTPException(422, "Either 'text' or 'session_id' is required")
+
+    result = await TRANSLATE_CACHE.get_async((to, text))
+    if result is None:
+        result = await cognitive_services.translate(text=text, to=to)
+        await TRANSLATE_CACHE.set_async((to, text), result)
 
     return result
 
@@ -108,12 +215,27 @@ async def get_ir_token() -> ImmersiveReaderTokenResponse:
 
 @api.post(
     "/render",
-    description="Render an Analysis response into HTML",
+    description="Render an Analysis response into HTML. \
+        With stream=true, the HTML is sent as chunked response, segment by segment. \
+        Accepts analyses in the default and the compact format, or the session_id of an analysis.",
     response_class=HTMLResponse,
     tags=["frontend"],
 )
-async def post_render(request: RenderRequest) -> HTMLResponse:
+async def post_render(
+    request: Union[CompactRenderRequest, RenderRequest] = None,
+    stream: bool = False,
+    session_id: Optional[str] = None,
+) -> HTMLResponse:
+    if session_id:
+        # The analysis of an analysis session, no need to send it back
+        request = (await run_in_threadpool(SESSIONS.get, session_id)).analysis
+    if request is None:
+        raise HTTPException(422, "Either an analysis or 'session_id' is required")
+
     renderer = HTMLRenderer()
+    if stream:
+        # Chunked response, so browsers can start painting long documents right away
+        return StreamingResponse(renderer.stream(request), media_type="text/html")
     return renderer(request)
 
 
@@ -124,113 +246,216 @@ async def post_render(request: RenderRequest) -> HTMLResponse:
     tags=["text_extract"],
 )
 async def get_extract(url: str) -> ExtractResponse:
-    extractor = text_extract.Extractor()
-    options = {}
-    result = extractor(url, options)
-    return result
+    # Might have been extracted before, or by the prefetcher.
+    # Off the event loop: downloads, the document type classifier, and maybe loading its model
+    return await run_in_threadpool(extract_url, url)
+
+
+@api.post(
+    "/extract/batch",
+    description="Extract text and metadata from several publicly reachable URLs. \
+        Pages are downloaded in parallel and their document types classified in one batch.",
+    response_model=ExtractBatchResponse,
+    tags=["text_extract"],
+)
+async def post_extract_batch(request: ExtractBatchRequest) -> ExtractBatchResponse:
+    if len(request.urls) > EXTRACT_BATCH_MAX_URLS:
+        raise HTTPException(
+            422, f"At most {EXTRACT_BATCH_MAX_URLS} URLs per request are supported"
+        )
+    results, errors = await run_in_threadpool(extract_urls, request.urls)
+    return ExtractBatchResponse(results=results, errors=errors)
+
+
+@api.post(
+    "/extract/upload",
+    description="Extract text and metadata from an uploaded document. \
+        Send the raw file as request body, with its media type (text/plain, text/html) as Content-Type. \
+        The body is streamed to a spooled temporary file, so large uploads are never held in memory.",
+    response_model=ExtractResponse,
+    tags=["text_extract"],
+)
+async def post_extract_upload(
+    request: Request, filename: Optional[str] = None
+) -> ExtractResponse:
+    mediatype = request.headers.get("content-type", "text/plain")
+    file, sha256, size = await spool_upload(request.stream())
+
+    try:
+        # Identical uploads are only extracted once
+        cache_key = (sha256, mediatype)
+        result = await UPLOAD_CACHE.get_async(cache_key)
+        if result:
+            log.info(f"Upload {sha256} already extracted, using cached result")
+        else:
+            extractor = text_extract.Extractor()
+            # Only what depends on the content, the filename is set per request
+            options = {
+                "sourceUrl": f"upload://{sha256}",
+                "metadata": {"sha256": sha256, "size": size},
+            }
+            try:
+                result = await run_in_threadpool(
+                    extractor.extract_file_storage, file, mediatype, options
+                )
+            except text_extract.UnsupportedMediaType as e:
+                raise HTTPException(415, str(e))
+            await UPLOAD_CACHE.set_async(cache_key, result)
+    finally:
+        file.close()
+
+    return result.copy(update={"metadata": {**(result.metadata or {}), "filename": filename}})
 
 
 @api.post(
     "/analyze",
-    description="Extract the named entities from a input text",
+    description="Extract the named entities from a input text. \
+        With format=compact, entities and sentences are returned as parallel arrays (see CompactAnalyzeResponse). \
+        With session=true, the analysis is kept on the server, and its session_id accepted by /render, /translate and /search.",
     response_model=AnalyzeResponse,
     tags=["text_analysis"],
 )
-async def post_analyze(request: AnalyzeRequest) -> AnalyzeResponse:
-    language, text, model, num_sentences = map(
-        dict(request).get, ("language", "text", "model", "num_sentences")
-    )
+async def post_analyze(
+    request: AnalyzeRequest, format: Optional[str] = None
+) -> AnalyzeResponse:
+    # Off the event loop: the result store (and the session store) may do network or disk I/O
+    result = await run_in_threadpool(cached_analysis, request)
+    if result is None:
+        # CPU heavy: admission controlled, and off the event loop
+        async with ADMISSION.admit(len(request.text)):
+            result = await run_in_threadpool(analyze, request)
+
+    # Returned as response, not as model: FastAPI would validate the whole (constructed, server generated)
+    # analysis again against response_model. That stays for the documentation.
+    if format == "compact":
+        # Columnar encoding
+        return ORJSONResponse(to_compact(result))
+    return ORJSONResponse(result.dict())
+
 
-    analyzer = TextAnalyzer(text, language, model)
-    nlp = analyzer()
+@api.get(
+    "/sessions/{session_id}",
+    description="The analysis of an analysis session (see AnalyzeRequest.session)",
+    response_model=AnalyzeResponse,
+    tags=["text_analysis"],
+)
+async def get_session(session_id: str) -> AnalyzeResponse:
+    return (await run_in_threadpool(SESSIONS.get, session_id)).analysis
 
-    analyzed_text = text.strip().replace("\n", " ")
 
-    # Calls the spaCy NLP pipeline
-    doc = nlp(analyzed_text)
+@api.get(
+    "/sessions/{session_id}/noun_chunks",
+    description="Noun chunks of the analyzed text of an analysis session. \
+        Usually good keywords, e.g. for a custom web search.",
+    response_model=List[NounChunk],
+    tags=["text_analysis"],
+)
+async def get_session_noun_chunks(session_id: str) -> List[NounChunk]:
+    # Derived from the stored document, without parsing the text again
+    return await run_in_threadpool(SESSIONS.noun_chunks, session_id)
 
-    #
-    # Named entities identify "things", like organisations, quantities
-    #
-    entities = [
-        NamedEntity(
-            text=entity.text,
-            start=entity.start_char,
-            end=entity.end_char,
-            label=entity.label_,
-        )
-        for entity in doc.ents
-    ]
-    entities_text = [entity.text for entity in doc.ents]
-    entities_text.sort()
-
-    #
-    # Named Entities found from Azure Text Analytics for Health (if configured)
-    #
-    entities_medical = analyzer.get_health_entities(analyzed_text)
-    # entities = entities_medical
-
-    # Noun chunks with their position in the original text.
-    # These are usually good keywords e.g. for a custom web search.
-    # noun_chunks = [
-    #    NounChunk(text=chunk.text, start=chunk.start_char, end=chunk.end_char)
-    #    for chunk in doc.noun_chunks
-    # ]
-    # noun_chunks_text = [chunk.text for chunk in doc.noun_chunks]
-    # noun_chunks_text.sort()
-
-    lemma = [Lemma(text=token.lemma_, is_stopword=token.is_stop) for token in doc]
-    lemma_text = " ".join([token.lemma_ for token in doc if not token.is_stop])
-
-    # Sentences detected by the sentencizer.
-    # We will use the "lemmatized" sentence without stopwords for the ranking
-    #
-    sentences: List[Sentence] = [
-        Sentence(
-            text=sentence.text,
-            lemmatized_text=" ".join(
-                [token.lemma_ for token in sentence if not token.is_stop]
-            ),
-            start=sentence.start_char,
-            end=sentence.end_char,
-        )
-        for sentence in doc.sents
-        if len(sentence.text) >= 9
-        # TODO check if we can improve the default spaCy sentencizer
-    ]
-
-    # Get the top-n sentences (the "summary")
-    top_sentences = analyzer.top_sentences(sentences, num_sentences=num_sentences)
-
-    response = AnalyzeResponse(
-        language=analyzer.language or None,
-        model=analyzer.model or None,
-        text=analyzed_text,
-        entities=entities or None,
-        health_entities=entities_medical or None,
-        # lemmatized_text=lemma_text or None,
-        # entities_text=entities_text or None,
-        # noun_chunks=noun_chunks or None,
-        # noun_chunks_text=noun_chunks_text or None,
-        # sentences=sentences or None,
-        top_sentences=top_sentences or None
-        # lemma=lemma or None,
-    )
 
-    return response
+@api.delete(
+    "/sessions/{session_id}",
+    description="Delete an analysis session",
+    status_code=204,
+    tags=["text_analysis"],
+)
+async def delete_session(session_id: str) -> Response:
+    await run_in_threadpool(SESSIONS.delete, session_id)
+    return Response(status_code=204)
+
+
+@api.post(
+    "/pipeline",
+    description="Extract (from a URL), analyze and render a text in one request, server-side. \
+        Returns only the requested outputs (extract, analysis, html).",
+    response_model=PipelineResponse,
+    tags=["text_analysis"],
+)
+async def post_pipeline(request: PipelineRequest) -> PipelineResponse:
+    # The text length of a URL is unknown up-front, we assume a long document
+    cost = len(request.text) if request.text else PIPELINE_URL_COST
+    async with ADMISSION.admit(cost):
+        return await run_in_threadpool(run_pipeline, request)
+
+
+@api.post(
+    "/jobs/analyze",
+    description="Submit a text or URL for analysis as asynchronous job. Returns the job id immediately, \
+        poll /jobs/{id} for progress and fetch the AnalyzeResponse from /jobs/{id}/result.",
+    response_model=JobResponse,
+    status_code=202,
+    tags=["jobs"],
+)
+async def post_analyze_job(request: AnalyzeJobRequest) -> JobResponse:
+    if not request.url and not request.text:
+        raise HTTPException(422, "Either 'url' or 'text' is required")
+    if request.callback_url:
+        try:
+            await run_in_threadpool(check_callback_url, request.callback_url)
+        except ValueError as e:
+            raise HTTPException(422, str(e))
+    return await run_in_threadpool(lambda: get_job_store().submit(request))
+
+
+@api.get(
+    "/jobs/{job_id}",
+    description="Status and progress of an asynchronous job",
+    response_model=JobResponse,
+    tags=["jobs"],
+)
+async def get_job(job_id: str) -> JobResponse:
+    job = await run_in_threadpool(lambda: get_job_store().get(job_id))
+    if not job:
+        raise HTTPException(404, f"Unknown job '{job_id}'")
+    return job
+
+
+@api.get(
+    "/jobs/{job_id}/result",
+    description="The AnalyzeResponse of a finished job",
+    response_model=AnalyzeResponse,
+    tags=["jobs"],
+)
+async def get_job_result(job_id: str) -> Response:
+    result = await run_in_threadpool(lambda: get_job_store().result(job_id))
+    if result is None:
+        job = await run_in_threadpool(lambda: get_job_store().get(job_id))
+        if not job:
+            raise HTTPException(404, f"Unknown job '{job_id}'")
+        raise HTTPException(409, f"Job '{job_id}' is {job.status}, no result (yet)")
+    # Stored as JSON already, no need to parse and serialize it again
+    return Response(content=result, media_type="application/json")
 
 
 @api.get(
     "/search",
     response_model=SearchResponse,
     summary="Search for related medical documents",
-    description="Search for medical documents related to a search query string. May find webpages, images and videos.",
+    description="Search for medical documents related to a search query string. May find webpages, images and videos. \
+        With the session_id of an analysis instead, the query is made of its keywords.",
     response_description="The search results",
     tags=["search"],
 )
-async def get_search(q: str) -> SearchResponse:
+async def get_search(
+    q: Optional[str] = None, session_id: Optional[str] = None
+) -> SearchResponse:
+    if not q and session_id:
+        # Keywords of an analysis session (its search query), see app/keywords.py
+        q = " ".join(
+            await run_in_threadpool(SESSIONS.keywords, session_id, SEARCH_QUERY_KEYWORDS)
+        )
+    if not q:
+        raise HTTPException(422, "Either 'q' or 'session_id' is required")
+
+    response = await SEARCH_CACHE.get_async(q)
+    if response:
+        return response
+
     try:
         response = bing_search(q)
+        await SEARCH_CACHE.set_async(q, response)
     except Exception as e:
         log.error(str(e))
         message = f"Error calling search services for '{q}'"
@@ -251,7 +476,11 @@ async def get_search(q: str) -> SearchResponse:
 async def get_definition(term: str) -> DefinitionResponse:
 
     try:
-        response = dictionary.lookup_term(term)
+        response = await DEFINITION_CACHE.get_async(term)
+        if response is None:
+            response = dictionary.lookup_term(term)
+            if response is not None:
+                await DEFINITION_CACHE.set_async(term, response)
         return response
 
     except Exception as e:
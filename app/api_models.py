@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from fastapi.datastructures import UploadFile
 from pydantic.main import BaseModel
 from enum import Enum
@@ -48,10 +48,31 @@ class SentenceRequest(NLPBaseRequest):
     pass
 
 
+class SummarizerEngine(str, Enum):
+    auto = "auto"
+    lexrank = "lexrank"
+    textrank = "textrank"
+    lsa = "lsa"
+    centroid = "centroid"
+
+
 class AnalyzeRequest(NLPBaseRequest):
+    """
+    - **summarizer** Engine for the top sentences: lexrank, textrank, lsa, centroid,
+      or "auto" (default) to choose by the length of the text
+    - **incremental** Analyze paragraph by paragraph, reusing the results of paragraphs analyzed before
+      (for documents re-submitted after small edits)
+    - **session** Keep the analysis (and the parsed document) on the server, see AnalyzeResponse.session_id
+    """
+
     num_sentences: Optional[int] = 3
+    summarizer: Optional[SummarizerEngine] = None
+    incremental: Optional[bool] = None
+    session: Optional[bool] = None
 
     class Config:
+        # Plain strings, e.g. for the cache key
+        use_enum_values = True
         schema_extra = {
             "example": {
                 "text": "Breast cancer most commonly presents as a lump that feels different from the rest of the breast tissue.\
@@ -60,6 +81,63 @@ More than 80% of cases are discovered when a person detects such a lump with the
         }
 
 
+class PipelineOutput(str, Enum):
+    extract = "extract"
+    analysis = "analysis"
+    html = "html"
+
+
+class PipelineRequest(BaseRequest):
+    """
+    Request to run extract, analyze and render in one go, server-side.
+
+    - **url** A publicly reachable URL to extract the text from, or
+    - **text** The text to analyze
+    - **outputs** Which results to return: "extract", "analysis" and/or "html"
+    """
+
+    url: Optional[str] = None
+    text: Optional[str] = None
+    language: Optional[str] = None
+    model: Optional[str] = None
+    num_sentences: Optional[int] = 3
+    outputs: List[PipelineOutput] = [PipelineOutput.analysis, PipelineOutput.html]
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "url": "https://en.wikipedia.org/wiki/Breast_cancer",
+                "outputs": ["analysis", "html"],
+            }
+        }
+
+
+class ExtractBatchRequest(BaseRequest):
+    """
+    Request to extract several URLs at once.
+
+    - **urls** Publicly reachable URLs
+    """
+
+    urls: List[str]
+
+
+class AnalyzeJobRequest(BaseRequest):
+    """
+    Request to analyze a text, or the text of a URL, as asynchronous job.
+
+    - **callback_url** Optional URL, which gets the JobResponse POSTed when the job is done (or failed).
+        Only public hosts, or those allowed by JOBS_CALLBACK_HOSTS
+    """
+
+    url: Optional[str] = None
+    text: Optional[str] = None
+    language: Optional[str] = None
+    model: Optional[str] = None
+    num_sentences: Optional[int] = 3
+    callback_url: Optional[str] = None
+
+
 #
 # Response Models (= schema for API responses)
 #
@@ -79,12 +157,30 @@ class TranslateResponse(BaseResponse):
 
 
 class ExtractResponse(BaseResponse):
+    """
+    Extracted text and metadata of a document
+
+    - **document_class** The predicted document type (personal_report, research, news_article...)
+    - **document_class_scores** Scores of all document types, if the classifier is available
+    """
+
     sourceUrl: str
     text: str
     document_class: str
     language: str
     mediatype: str
     metadata: Optional[dict] = None
+    document_class_scores: Optional[Dict[str, float]] = None
+
+
+class ExtractBatchResponse(BaseResponse):
+    """
+    - **results** Extracted documents, in the order of the requested URLs (where extraction succeeded)
+    - **errors** Error messages of failed URLs, by URL
+    """
+
+    results: List[ExtractResponse] = []
+    errors: Dict[str, str] = {}
 
 
 class NLPBaseResponse(BaseResponse):
@@ -102,6 +198,13 @@ class AnalyzeResponse(NLPBaseResponse):
     # noun_chunks_text: Optional[List[str]]
     sentences: Optional[List[Sentence]] = None
     top_sentences: Optional[List[Sentence]] = None
+    # The engine that ranked the top sentences
+    summarizer: Optional[str] = None
+    # The most relevant noun chunks and entities, and a web search query made of them
+    keywords: Optional[List[str]] = None
+    search_query: Optional[str] = None
+    # ID of the analysis session (if requested), for /render, /translate, /search and /sessions
+    session_id: Optional[str] = None
 
     # lemma: Optional[List[Lemma]]
     # lemmatized_text: Optional[str]
@@ -119,6 +222,68 @@ class AnalyzeResponse(NLPBaseResponse):
         }
 
 
+class PipelineResponse(BaseResponse):
+    extract: Optional[ExtractResponse] = None
+    analysis: Optional[AnalyzeResponse] = None
+    html: Optional[str] = None
+
+
+class CompactSpans(BaseModel):
+    """
+    A list of text spans (entities, sentences...) as parallel arrays.
+    The span texts are not included, they are text[start:end] of the analyzed text.
+
+    - **starts** Start offsets
+    - **ends** End offsets
+    - **label_ids** Index of the label in the label table (for entities)
+    - **definitions** Short descriptions (for entities)
+    - **scores** Ranking scores (for sentences)
+    """
+
+    starts: List[int] = []
+    ends: List[int] = []
+    label_ids: Optional[List[int]] = None
+    definitions: Optional[List[Optional[str]]] = None
+    scores: Optional[List[Optional[float]]] = None
+
+
+class CompactAnalyzeResponse(NLPBaseResponse):
+    """
+    Compact (columnar) encoding of an AnalyzeResponse, see /analyze?format=compact
+
+    - **labels** The label table, entities refer to it by index (label_ids)
+    """
+
+    encoding: str = "compact"
+    labels: List[str]
+    entities: Optional[CompactSpans] = None
+    health_entities: Optional[CompactSpans] = None
+    noun_chunks: Optional[CompactSpans] = None
+    sentences: Optional[CompactSpans] = None
+    top_sentences: Optional[CompactSpans] = None
+    summarizer: Optional[str] = None
+    keywords: Optional[List[str]] = None
+    search_query: Optional[str] = None
+    session_id: Optional[str] = None
+
+
+class JobResponse(BaseResponse):
+    """
+    State of an asynchronous job
+
+    - **status** queued, running, done or failed
+    - **stage** What the job is doing right now (extract, analyze...)
+    - **progress** Between 0 and 1
+    """
+
+    id: str
+    status: str
+    stage: Optional[str] = None
+    progress: float = 0
+    created: float
+    updated: float
+
+
 class ImmersiveReaderTokenResponse(BaseResponse):
     token: str
     subdomain: str
@@ -145,6 +310,14 @@ class RenderRequest(AnalyzeResponse):
     format: Optional[str] = "html"
 
 
+class CompactRenderRequest(CompactAnalyzeResponse):
+    """
+    Request to render a compact "analyze" response, see RenderRequest
+    """
+
+    format: Optional[str] = "html"
+
+
 class Page(BaseModel):
     """
     A related webpage
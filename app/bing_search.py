@@ -1,4 +1,6 @@
+from fastapi.exceptions import HTTPException
 from app.api_models import SearchResponse
+from app.timing import upstream
 import os, requests, urllib.parse
 
 #
@@ -13,8 +15,6 @@ page_search_url = f"{search_url}/search"
 image_search_url = f"{search_url}/images/search"
 video_search_url = f"{search_url}/videos/search"
 
-assert subscription_key
-
 
 def bing_search_hosted_ui(q: str, language="en"):
     """
@@ -39,6 +39,12 @@ def bing_search(q: str) -> SearchResponse:
     - **q** The search query, e.g. 'breast cancer commonly present lump feel different rest breast tissue'
     """
 
+    if not subscription_key:
+        raise HTTPException(
+            500,
+            "Server configuration error: please configure a valid API key for Bing Custom Search",
+        )
+
     search_term = q
 
     headers = {
@@ -68,18 +74,21 @@ def bing_search(q: str) -> SearchResponse:
     }
 
     # Query for "webpages"
-    response = requests.get(page_search_url, headers=headers, params=page_params)
-    response.raise_for_status()
+    with upstream("bing_pages"):
+        response = requests.get(page_search_url, headers=headers, params=page_params)
+        response.raise_for_status()
     pages_results = dict(response.json())
 
     # Query for "images"
-    response = requests.get(image_search_url, headers=headers, params=image_params)
-    response.raise_for_status()
+    with upstream("bing_images"):
+        response = requests.get(image_search_url, headers=headers, params=image_params)
+        response.raise_for_status()
     image_results = dict(response.json())
 
     # Query for "videos"
-    response = requests.get(video_search_url, headers=headers, params=video_params)
-    response.raise_for_status()
+    with upstream("bing_videos"):
+        response = requests.get(video_search_url, headers=headers, params=video_params)
+        response.raise_for_status()
     video_results = dict(response.json())
 
     # pages_results['webPages']['value'] => (name, url, displayUrl, language, snippet)
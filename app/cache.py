@@ -0,0 +1,212 @@
+import hashlib, logging, os, threading, time, zlib
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Type
+
+import orjson
+from pydantic.main import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from app.api_models import (
+    AnalyzeResponse,
+    DefinitionResponse,
+    ExtractResponse,
+    SearchResponse,
+    TranslateResponse,
+)
+from app.result_store import ResultStore, store_from_env
+
+log = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+    """
+    A small, thread-safe in-process cache with least-recently-used eviction
+    and an optional time-to-live (in seconds) for its entries.
+    Used to keep (expensive) results around, e.g. extracted uploads keyed by their content hash.
+    """
+
+    def __init__(self, max_items: int = 128, ttl: Optional[float] = None) -> None:
+        super().__init__()
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Optional[Any]:
+        with self._lock:
+            if key not in self._items:
+                return default
+            expires, value = self._items[key]
+            if expires is not None and expires < time.monotonic():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._items[key] = (expires, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+# Values larger than this are compressed before they go into the shared store
+COMPRESS_MIN_BYTES = 1024
+# Values larger than this (after compression) are not put into the shared store
+MAX_VALUE_BYTES = int(os.getenv("RESULT_STORE_MAX_VALUE_BYTES", 8 * 1024 * 1024))
+COMPRESSION_LEVEL = int(os.getenv("RESULT_STORE_COMPRESSION_LEVEL", 6))
+
+# The shared result store, if configured (see app/result_store.py)
+SHARED_STORE = store_from_env()
+
+
+class ResultCache(object):
+    """
+    Cache for results (pydantic models) of one kind, e.g. analyses.
+
+    Results are kept in a local LRU cache (as objects), and - if configured - in the result store
+    shared by all replicas (serialized, compressed, size limited).
+    Failures of the shared store are logged and treated as cache misses.
+    Async code uses get_async and set_async, which keep the store I/O off the event loop.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        model: Type[BaseModel],
+        max_items: int = 128,
+        ttl: Optional[float] = None,
+        store: Optional[ResultStore] = None,
+    ) -> None:
+        super().__init__()
+        self.namespace = namespace
+        self.model = model
+        self.ttl = ttl
+        self.store = store
+        self.local = LRUCache(max_items=max_items, ttl=ttl)
+
+    def _key(self, key: Hashable) -> str:
+        if isinstance(key, tuple):
+            key = "\x00".join(str(k) for k in key)
+        key = str(key)
+        if len(key) > 128:
+            key = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return f"summed:{self.namespace}:{key}"
+
+    def get(self, key: Hashable) -> Optional[BaseModel]:
+        value = self.local.get(key)
+        if value is not None or self.store is None:
+            return value
+
+        try:
+            data = self.store.get(self._key(key))
+        except Exception as e:
+            log.warning(f"Result store get failed ({self.namespace}): {e}")
+            return None
+        if data is None:
+            return None
+
+        try:
+            value = self.model.parse_obj(orjson.loads(self._decode(data)))
+        except Exception as e:
+            log.warning(f"Unable to decode stored {self.namespace} result: {e}")
+            return None
+        self.local.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: BaseModel) -> None:
+        self.local.set(key, value)
+        if self.store is None:
+            return
+
+        try:
+            data = self._encode(orjson.dumps(value.dict()))
+            if len(data) > MAX_VALUE_BYTES:
+                log.debug(f"{self.namespace} result of {len(data)} bytes too large for the result store")
+                return
+            self.store.set(self._key(key), data, ttl=self.ttl)
+        except Exception as e:
+            log.warning(f"Result store set failed ({self.namespace}): {e}")
+
+    async def get_async(self, key: Hashable) -> Optional[BaseModel]:
+        value = self.local.get(key)
+        if value is not None or self.store is None:
+            return value
+        return await run_in_threadpool(self.get, key)
+
+    async def set_async(self, key: Hashable, value: BaseModel) -> None:
+        if self.store is None:
+            self.local.set(key, value)
+            return
+        await run_in_threadpool(self.set, key, value)
+
+    @staticmethod
+    def _encode(data: bytes) -> bytes:
+        # First byte flags compression
+        if len(data) >= COMPRESS_MIN_BYTES:
+            return b"z" + zlib.compress(data, COMPRESSION_LEVEL)
+        return b"r" + data
+
+    @staticmethod
+    def _decode(data: bytes) -> bytes:
+        if data[:1] == b"z":
+            return zlib.decompress(data[1:])
+        return data[1:]
+
+
+def _ttl(name: str) -> Optional[float]:
+    value = float(os.getenv(name, 0))
+    return value or None
+
+
+def _cache(namespace: str, model: Type[BaseModel], default_size: int) -> ResultCache:
+    name = namespace.upper()
+    return ResultCache(
+        namespace,
+        model,
+        max_items=int(os.getenv(f"{name}_CACHE_SIZE", default_size)),
+        ttl=_ttl(f"{name}_CACHE_TTL"),
+        store=SHARED_STORE,
+    )
+
+
+#
+# Result stores shared by the API endpoints and the background prefetcher
+#
+
+# Extracted webpages, keyed by URL
+EXTRACT_CACHE = _cache("extract", ExtractResponse, 512)
+
+# Extracted uploads, keyed by (sha256, mediatype)
+UPLOAD_CACHE = _cache("upload", ExtractResponse, 64)
+
+# Analysis results, keyed by a hash of the analyze request
+ANALYZE_CACHE = _cache("analyze", AnalyzeResponse, 512)
+
+# Analysis results of single paragraphs (incremental analysis), keyed by a hash of model and paragraph text
+PARAGRAPH_CACHE = _cache("paragraph", AnalyzeResponse, 4096)
+
+# Search results, keyed by query
+SEARCH_CACHE = _cache("search", SearchResponse, 512)
+
+# Dictionary definitions, keyed by term
+DEFINITION_CACHE = _cache("definition", DefinitionResponse, 1024)
+
+# Translations, keyed by (target language, text)
+TRANSLATE_CACHE = _cache("translate", TranslateResponse, 512)
@@ -2,6 +2,7 @@ import os, logging, requests, uuid
 from fastapi.exceptions import HTTPException
 
 from app.api_models import ImmersiveReaderTokenResponse, TranslateResponse
+from app.timing import upstream
 
 log = logging.getLogger(__name__)
 
@@ -28,8 +29,11 @@ async def translate(text: str, to="de") -> str:
 
     body = [{"text": text}]
 
-    request = requests.post(constructed_url, params=params, headers=headers, json=body)
-    response = request.json()
+    with upstream("translator"):
+        request = requests.post(
+            constructed_url, params=params, headers=headers, json=body
+        )
+        response = request.json()
 
     result = [
         {
@@ -71,7 +75,8 @@ async def getIRToken():
     subdomain = os.getenv("AZURE_IMMERSIVE_READER_SUBDOMAIN")
 
     resource = "https://cognitiveservices.azure.com/"
-    oauthTokenUrl = f"https://login.windows.net/{tenantId}/oauth2/token"
+    authority = os.getenv("AZURE_AD_AUTHORITY_URL", "https://login.windows.net")
+    oauthTokenUrl = f"{authority}/{tenantId}/oauth2/token"
     grantType = "client_credentials"
 
     try:
@@ -83,12 +88,13 @@ async def getIRToken():
             "grant_type": grantType,
         }
 
-        resp = requests.post(
-            oauthTokenUrl,
-            data=data,
-            headers=headers,
-        )
-        jsonResp = resp.json()
+        with upstream("aad_token"):
+            resp = requests.post(
+                oauthTokenUrl,
+                data=data,
+                headers=headers,
+            )
+            jsonResp = resp.json()
 
         if "access_token" not in jsonResp:
             print(jsonResp)
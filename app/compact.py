@@ -0,0 +1,60 @@
+from typing import Dict, Iterator, Optional, Tuple
+
+from app.api_models import AnalyzeResponse, CompactAnalyzeResponse, CompactSpans
+
+# Fields of an AnalyzeResponse that hold lists of text spans
+SPAN_FIELDS = ("entities", "health_entities", "noun_chunks", "sentences", "top_sentences")
+
+
+def to_compact(analysis: AnalyzeResponse) -> dict:
+    """
+    Encodes an analysis in the compact, columnar format (see CompactAnalyzeResponse),
+    as plain dict ready for a fast JSON encoder.
+    Span texts and lemmatized sentences are left out, spans refer to the analyzed text by offset.
+    """
+    labels: Dict[str, int] = {}
+    result = {
+        name: value
+        for name, value in analysis.__dict__.items()
+        if name not in SPAN_FIELDS
+    }
+    result["encoding"] = "compact"
+
+    for name in SPAN_FIELDS:
+        spans = getattr(analysis, name, None)
+        if spans is None:
+            result[name] = None
+            continue
+
+        columns = {
+            "starts": [span.start for span in spans],
+            "ends": [span.end for span in spans],
+        }
+        if spans and hasattr(spans[0], "label"):
+            columns["label_ids"] = [
+                labels.setdefault(span.label, len(labels)) for span in spans
+            ]
+        if spans and hasattr(spans[0], "definition"):
+            columns["definitions"] = [span.definition for span in spans]
+        if spans and hasattr(spans[0], "score"):
+            columns["scores"] = [span.score for span in spans]
+        result[name] = columns
+
+    result["labels"] = list(labels)
+    return result
+
+
+def labeled_spans(
+    compact: CompactAnalyzeResponse, name: str
+) -> Iterator[Tuple[int, int, str]]:
+    """
+    The (start, end, label) triples of a span field of a compact analysis
+    """
+    spans: Optional[CompactSpans] = getattr(compact, name)
+    if not spans:
+        return iter(())
+    label_ids = spans.label_ids or [None] * len(spans.starts)
+    return (
+        (start, end, compact.labels[label_id] if label_id is not None else "")
+        for start, end, label_id in zip(spans.starts, spans.ends, label_ids)
+    )
@@ -1,11 +1,16 @@
 import os, requests, logging, urllib
 from fastapi.exceptions import HTTPException
 from app.api_models import DefinitionResponse, TermDefinition
+from app.timing import upstream
 from pprint import pprint
 from urllib.request import pathname2url
 
 log = logging.getLogger(__name__)
 
+base_url = os.getenv(
+    "MW_API_BASE_URL", "https://www.dictionaryapi.com/api/v3/references/medical/json"
+)
+
 
 def lookup_term(term: str) -> DefinitionResponse:
     apiKey = os.getenv("MW_API_KEY", None)
@@ -16,13 +21,14 @@ def lookup_term(term: str) -> DefinitionResponse:
         )
 
     sanitized_term = pathname2url(term.strip())  # urlencode(term.strip())
-    url = f"https://www.dictionaryapi.com/api/v3/references/medical/json/{sanitized_term}?key={apiKey}"
+    url = f"{base_url}/{sanitized_term}?key={apiKey}"
     log.info(f"Looking up term definition via dictionary: {sanitized_term}")
 
-    resp = requests.get(url)
-    # pprint(resp.content)
+    with upstream("dictionary"):
+        resp = requests.get(url)
+        # pprint(resp.content)
 
-    resp.raise_for_status()
+        resp.raise_for_status()
     try:
 
         if resp.ok:
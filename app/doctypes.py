@@ -0,0 +1,102 @@
+import logging, os
+from typing import Dict, List, Optional, Tuple
+
+from app.api_models import ExtractResponse
+from app.model_registry import MODELS
+from app.timing import timed
+
+log = logging.getLogger(__name__)
+
+#
+# Medical document type classifier (personal_report, research, news_article, ...),
+# trained and packaged by nlp_models/textcat_en_medical_doctypes.
+#
+# DOCTYPE_MODEL is the installed package, or a name the model registry resolves (e.g. to the path of
+# training/model-best, see SPACY_MODELS). The model is loaded once per worker, on first use or during warmup,
+# and hot-reloaded by the registry. If it is not installed, extracted documents keep the DOCTYPE_DEFAULT_CLASS.
+#
+DOCTYPE_MODEL = os.getenv("DOCTYPE_MODEL", "en_medical_doctypes")
+DOCTYPE_DEFAULT_CLASS = os.getenv("DOCTYPE_DEFAULT_CLASS", "article")
+# Only the beginning of a document is classified, the type is evident early and cost grows with length
+DOCTYPE_PREFIX_CHARS = int(os.getenv("DOCTYPE_PREFIX_CHARS", 5000))
+DOCTYPE_BATCH_SIZE = int(os.getenv("DOCTYPE_BATCH_SIZE", 16))
+
+
+def text_prefix(text: str, max_chars: int) -> str:
+    """
+    The beginning of a text, cut at a whitespace so no word is split
+    """
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars)
+    return text[: cut if cut > 0 else max_chars]
+
+
+class DocumentClassifier(object):
+    """
+    Classifies texts with the document type textcat model, in batches (nlp.pipe).
+    """
+
+    def __init__(
+        self,
+        model: str = DOCTYPE_MODEL,
+        prefix_chars: int = DOCTYPE_PREFIX_CHARS,
+        batch_size: int = DOCTYPE_BATCH_SIZE,
+        default_class: str = DOCTYPE_DEFAULT_CLASS,
+    ) -> None:
+        super().__init__()
+        self.model = model
+        self.prefix_chars = prefix_chars
+        self.batch_size = batch_size
+        self.default_class = default_class
+
+        self._unavailable = False
+
+    def load(self) -> Optional["spacy.Language"]:
+        """
+        The loaded model, or None if it is not available
+        """
+        if self._unavailable or not self.model:
+            return None
+
+        try:
+            return MODELS.get(self.model)
+        except (OSError, ImportError) as e:
+            # Don't retry on every request
+            self._unavailable = True
+            log.warning(
+                f"Document type model '{self.model}' not available, using '{self.default_class}': {e}"
+            )
+            return None
+
+    def classify(self, texts: List[str]) -> List[Tuple[str, Dict[str, float]]]:
+        """
+        Document class and the scores of all classes, per text.
+        Texts are classified together, in batches of batch_size.
+        """
+        nlp = self.load()
+        if nlp is None:
+            return [(self.default_class, {}) for _ in texts]
+
+        results = []
+        prefixes = (text_prefix(text or "", self.prefix_chars) for text in texts)
+        with timed("doctype_classify"):
+            for doc in nlp.pipe(prefixes, batch_size=self.batch_size):
+                scores = {label: float(score) for label, score in doc.cats.items()}
+                label = max(scores, key=scores.get) if scores else self.default_class
+                results.append((label, scores))
+        return results
+
+    def apply(self, responses: List[ExtractResponse]) -> List[ExtractResponse]:
+        """
+        Sets document_class and document_class_scores of extracted documents
+        """
+        for response, (label, scores) in zip(
+            responses, self.classify([r.text for r in responses])
+        ):
+            response.document_class = label
+            response.document_class_scores = scores or None
+        return responses
+
+
+CLASSIFIER = DocumentClassifier()
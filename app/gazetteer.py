@@ -0,0 +1,179 @@
+import csv, json, logging, os, threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.api_models import NamedEntity
+from app.model_registry import MODELS
+from app.startup import lazy_import
+from app.timing import timed
+
+log = logging.getLogger(__name__)
+
+spacy = lazy_import("spacy")
+spacy_matcher = lazy_import("spacy.matcher")
+spacy_tokens = lazy_import("spacy.tokens")
+spacy_util = lazy_import("spacy.util")
+
+#
+# In-process medical entity matching, from a local terminology list (a "gazetteer").
+#
+# The list (GAZETTEER_TERMS, tab separated: term, label, definition) is compiled into spaCy PhraseMatcher
+# patterns once, and saved to GAZETTEER_PATH: the tokenized terms as DocBin, and their labels/definitions as JSON.
+# Loading that takes no tokenization at all. It is (re-)compiled automatically when the list is newer,
+# or offline with: python -m app.gazetteer <terms.tsv> <output dir>
+#
+# Labels follow the categories of Text Analytics for Health (Diagnosis, SymptomOrSign, MedicationName...),
+# and terms are matched case-insensitive.
+#
+GAZETTEER_TERMS = os.getenv("GAZETTEER_TERMS", "./data/gazetteer/medical_terms.tsv")
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "./.gazetteer")
+GAZETTEER_LANGUAGE = os.getenv("GAZETTEER_LANGUAGE", "en")
+
+PATTERNS_FILE = "patterns.spacy"
+ENTRIES_FILE = "entries.json"
+
+
+def read_terms(path: str) -> List[Tuple[str, str, str]]:
+    """
+    (term, label, definition) rows of a terminology list
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = csv.DictReader(f, delimiter="\t")
+        return [
+            (row["term"].strip(), row["label"].strip(), (row.get("definition") or "").strip())
+            for row in rows
+            if row.get("term") and row.get("label")
+        ]
+
+
+def compile_terms(terms_path: str, output_path: str, language: str = GAZETTEER_LANGUAGE) -> int:
+    """
+    Tokenizes the terms, and writes patterns and entries to output_path. Returns the number of terms.
+    Terms with the same label and definition are one entry (one match id).
+    """
+    nlp = spacy.blank(language)
+    entries: Dict[Tuple[str, str], int] = {}
+    db = spacy_tokens.DocBin(attrs=["ORTH"], store_user_data=True)
+
+    terms = read_terms(terms_path)
+    for (term, label, definition), doc in zip(
+        terms, nlp.tokenizer.pipe(t[0] for t in terms)
+    ):
+        doc.user_data["entry"] = entries.setdefault((label, definition), len(entries))
+        db.add(doc)
+
+    output = Path(output_path)
+    output.mkdir(parents=True, exist_ok=True)
+    db.to_disk(output / PATTERNS_FILE)
+    with open(output / ENTRIES_FILE, "w", encoding="utf-8") as f:
+        json.dump({"language": language, "entries": list(entries)}, f)
+    log.info(f"Compiled {len(terms)} terms ({len(entries)} entries) to {output_path}")
+    return len(terms)
+
+
+class Gazetteer(object):
+    """
+    Matches the compiled terms in spaCy docs, producing health entities.
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        path = Path(path)
+        with open(path / ENTRIES_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+        self.language = data["language"]
+        self.entries: List[Tuple[str, str]] = [tuple(e) for e in data["entries"]]
+        self._patterns = spacy_tokens.DocBin(store_user_data=True).from_disk(
+            path / PATTERNS_FILE
+        )
+
+    def matcher(self, vocab) -> "spacy.matcher.PhraseMatcher":
+        """
+        The PhraseMatcher for a vocab. A matcher is bound to (and keeps alive) the vocab of a model,
+        so it's kept with the model in the registry, and released when the model is evicted or reloaded.
+        """
+        matcher = MODELS.attachment(vocab, self, lambda: self._build_matcher(vocab))
+        if matcher is None:
+            # Not a registry model (e.g. a blank pipeline)
+            matcher = self._build_matcher(vocab)
+        return matcher
+
+    def _build_matcher(self, vocab) -> "spacy.matcher.PhraseMatcher":
+        matcher = spacy_matcher.PhraseMatcher(vocab, attr="LOWER")
+        patterns: Dict[int, list] = {}
+        for doc in self._patterns.get_docs(vocab):
+            patterns.setdefault(doc.user_data["entry"], []).append(doc)
+        for entry, docs in patterns.items():
+            matcher.add(str(entry), docs)
+        return matcher
+
+    def __call__(self, doc) -> List[NamedEntity]:
+        """
+        Health entities in a doc (longest match wins where terms overlap)
+        """
+        with timed("gazetteer"):
+            matches = {
+                (start, end): doc.vocab.strings[match_id]
+                for match_id, start, end in self.matcher(doc.vocab)(doc)
+            }
+            spans = [doc[start:end] for start, end in matches]
+            entities = []
+            for span in spacy_util.filter_spans(spans):
+                label, definition = self.entries[int(matches[(span.start, span.end)])]
+                entities.append(
+                    NamedEntity.construct(
+                        text=span.text,
+                        start=span.start_char,
+                        end=span.end_char,
+                        label=label,
+                        definition=definition,
+                    )
+                )
+        return entities
+
+
+_GAZETTEER: Optional[Gazetteer] = None
+_GAZETTEER_LOADED = False
+_GAZETTEER_LOCK = threading.Lock()
+
+
+def get_gazetteer() -> Optional[Gazetteer]:
+    """
+    The gazetteer of this process, compiled first if the terminology list changed.
+    None if there is no terminology list.
+    """
+    global _GAZETTEER, _GAZETTEER_LOADED
+    if _GAZETTEER_LOADED:
+        return _GAZETTEER
+
+    with _GAZETTEER_LOCK:
+        if not _GAZETTEER_LOADED:
+            try:
+                entries = Path(GAZETTEER_PATH) / ENTRIES_FILE
+                terms = Path(GAZETTEER_TERMS)
+                if terms.exists() and (
+                    not entries.exists() or terms.stat().st_mtime > entries.stat().st_mtime
+                ):
+                    compile_terms(str(terms), GAZETTEER_PATH)
+                if entries.exists():
+                    _GAZETTEER = Gazetteer(GAZETTEER_PATH)
+                else:
+                    log.warning("No medical terminology list, health entities only from TA4H")
+            except Exception as e:
+                log.error(f"Unable to load the gazetteer from '{GAZETTEER_PATH}': {e}")
+            _GAZETTEER_LOADED = True
+    return _GAZETTEER
+
+
+if __name__ == "__main__":
+    import typer
+
+    def build(
+        terms_path: Path = typer.Argument(Path(GAZETTEER_TERMS)),
+        output_path: Path = typer.Argument(Path(GAZETTEER_PATH)),
+        language: str = GAZETTEER_LANGUAGE,
+    ):
+        count = compile_terms(str(terms_path), str(output_path), language)
+        typer.echo(f"Compiled {count} terms to {output_path}")
+
+    typer.run(build)
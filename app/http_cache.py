@@ -0,0 +1,230 @@
+import hashlib, json, logging, os, zlib
+from urllib.parse import parse_qs
+from typing import Iterable, List, Optional
+
+log = logging.getLogger(__name__)
+
+#
+# HTTP caching semantics for the (expensive) result endpoints.
+#
+# The results of /render only depend on the request (and the deployed version),
+# so the strong ETag is derived from a hash of the request itself: method, path, query and body.
+# Clients sending it back in `If-None-Match` get a `304 Not Modified`, before anything is parsed or computed.
+# Don't add endpoints whose results depend on anything else, e.g. /pipeline (the current content of a webpage).
+# /analyze isn't conditional by default either: its results change with hot reloaded models (app/model_registry.py)
+# and with the automatic summarizer choice (which depends on measured latencies). Only add it with pinned
+# models and explicit summarizers. Requests creating state (`session=true`) never get ETags.
+#
+# Bump ETAG_VERSION when a deployment changes results for identical requests (e.g. new models),
+# to invalidate what clients hold.
+#
+ETAG_VERSION = os.getenv("ETAG_VERSION", "")
+CONDITIONAL_PATHS = [
+    p.strip()
+    for p in os.getenv("CONDITIONAL_PATHS", "/render").split(",")
+    if p.strip()
+]
+
+# Responses smaller than this are not worth compressing
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", 1024))
+
+
+def _header(scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value
+    return None
+
+
+def accepts_gzip(scope) -> bool:
+    return b"gzip" in (_header(scope, b"accept-encoding") or b"").lower()
+
+
+def request_etag(scope, body: bytes) -> str:
+    """
+    Strong ETag of the response to a request.
+    Compressed and uncompressed responses are different representations, so whether
+    the client accepts gzip is part of the hash, too.
+    """
+    digest = hashlib.sha256()
+    for part in (
+        ETAG_VERSION.encode("utf-8"),
+        scope["method"].encode("latin-1"),
+        scope["path"].encode("utf-8"),
+        scope.get("query_string", b""),
+        b"gzip" if accepts_gzip(scope) else b"identity",
+    ):
+        digest.update(part)
+        digest.update(b"\x00")
+    digest.update(body)
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def creates_session(scope, body: bytes) -> bool:
+    """
+    Whether the request asks for a session (session=true in the query or JSON body):
+    every response has a new session id, so it must not be answered with 304
+    """
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    if any(value.lower() in ("1", "true", "yes") for value in query.get("session", [])):
+        return True
+    if b'"session"' not in body:
+        return False
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and data.get("session") is True
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    """
+    Weak comparison, as required for If-None-Match (RFC 7232, 3.2)
+    """
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class ConditionalRequestMiddleware(object):
+    """
+    ASGI middleware adding request derived ETags to successful responses of the result endpoints,
+    and answering matching conditional requests with 304, without calling the app.
+    """
+
+    def __init__(self, app, paths: Iterable[str] = CONDITIONAL_PATHS) -> None:
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("GET", "POST")
+            or scope["path"] not in self.paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        # The ETag depends on the complete body, so read it up-front (the endpoints parse it completely anyway)
+        chunks: List[bytes] = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                # Client went away
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        replayed = False
+
+        async def replay_receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        if creates_session(scope, body):
+            await self.app(scope, replay_receive, send)
+            return
+
+        etag = request_etag(scope, body)
+        if_none_match = _header(scope, b"if-none-match")
+        if if_none_match and etag_matches(etag, if_none_match.decode("latin-1")):
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": [
+                        (b"etag", etag.encode("latin-1")),
+                        (b"vary", b"Accept-Encoding"),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message = {
+                    **message,
+                    "headers": list(message.get("headers", []))
+                    + [(b"etag", etag.encode("latin-1"))],
+                }
+            await send(message)
+
+        await self.app(scope, replay_receive, send_with_etag)
+
+
+class CompressionMiddleware(object):
+    """
+    ASGI middleware compressing response bodies with gzip, for clients accepting it.
+
+    Complete bodies are compressed at once (if at least minimum_size bytes).
+    Streamed bodies (e.g. /render?stream=true) are compressed chunk by chunk, each flushed right away,
+    so clients can still process them incrementally.
+    """
+
+    def __init__(self, app, minimum_size: int = GZIP_MINIMUM_SIZE) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not accepts_gzip(scope):
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # Sent with the first body chunk, when we know if it's compressed
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = list(start.get("headers", []))
+                encoded = any(key.lower() == b"content-encoding" for key, _ in headers)
+                if encoded or (not more_body and len(body) < self.minimum_size):
+                    await send(start)
+                else:
+                    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+                    headers = [
+                        (key, value)
+                        for key, value in headers
+                        if key.lower() != b"content-length"
+                    ] + [(b"content-encoding", b"gzip"), (b"vary", b"Accept-Encoding")]
+                    if not more_body:
+                        body = compressor.compress(body) + compressor.flush()
+                        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+                        compressor = None
+                    await send({**start, "headers": headers})
+                start = None
+            elif compressor is None:
+                await send(message)
+                return
+
+            if compressor is not None:
+                if more_body:
+                    body = compressor.compress(body) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                else:
+                    body = compressor.compress(body) + compressor.flush()
+                    compressor = None
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,441 @@
+import asyncio, ipaddress, json, logging, os, socket, sqlite3, threading, time, uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from app.api_models import AnalyzeJobRequest, AnalyzeRequest, JobResponse
+
+log = logging.getLogger(__name__)
+
+#
+# Asynchronous analysis jobs, in a local durable (SQLite) queue.
+#
+# Submitting a job returns its id immediately. Worker threads claim queued jobs, run extraction (for URLs)
+# and analysis, and store the result. Clients poll the job, or get notified via a callback URL.
+#
+# A claimed job holds a lease (with a token identifying the claim), which the worker renews while
+# it runs the job. Jobs of a crashed or restarted process are picked up again when their lease expires,
+# so no queued work is lost. Updates of a job whose lease went to another claim are ignored.
+#
+# The analysis of a job goes through the CPU admission control of the interactive requests (app/admission.py),
+# so jobs and requests share the same limits. Jobs wait for their turn there, they are never rejected.
+#
+# Configured by environment variables:
+#
+# - **JOBS_DB** SQLite database file (default: ./.jobs.sqlite)
+# - **JOBS_WORKERS** Worker threads per process, 0 to only accept jobs (default: 1)
+# - **JOBS_LEASE_SECONDS** Lease of a running job (default: 600)
+# - **JOBS_MAX_ATTEMPTS** Attempts before a job fails for good (default: 3)
+# - **JOBS_RETENTION_SECONDS** Finished jobs are deleted after this time (default: 7 days)
+# - **JOBS_CALLBACK_HOSTS** Hosts callback URLs may point to, e.g. "hooks.example.com,.example.org"
+#   (a leading dot allows subdomains). Without, callbacks to private, loopback and link-local addresses
+#   are refused (see check_callback_url)
+#
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+JOBS_CALLBACK_HOSTS = [
+    host.strip().lower()
+    for host in os.getenv("JOBS_CALLBACK_HOSTS", "").split(",")
+    if host.strip()
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    request TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    callback_url TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL,
+    lease TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+"""
+
+
+class JobStore(object):
+    def __init__(
+        self,
+        path: str,
+        lease_seconds: float = 600,
+        max_attempts: int = 3,
+        retention_seconds: float = 7 * 24 * 60 * 60,
+    ) -> None:
+        super().__init__()
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+            if "lease" not in columns:
+                # Databases created before leases had tokens
+                db.execute("ALTER TABLE jobs ADD COLUMN lease TEXT")
+
+    @classmethod
+    def from_env(cls) -> "JobStore":
+        return cls(
+            path=os.getenv("JOBS_DB", "./.jobs.sqlite"),
+            lease_seconds=float(os.getenv("JOBS_LEASE_SECONDS", 600)),
+            max_attempts=int(os.getenv("JOBS_MAX_ATTEMPTS", 3)),
+            retention_seconds=float(os.getenv("JOBS_RETENTION_SECONDS", 7 * 24 * 60 * 60)),
+        )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One connection per operation: used from the event loop and several worker threads (and processes)
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def submit(self, request: AnalyzeJobRequest) -> JobResponse:
+        now = time.time()
+        job_id = str(uuid.uuid4())
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, stage, request, callback_url, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, QUEUED, request.json(), request.callback_url, now, now),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[JobResponse]:
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._response(row) if row else None
+
+    def result(self, job_id: str) -> Optional[str]:
+        """
+        The result (AnalyzeResponse) of a finished job, as JSON
+        """
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT result FROM jobs WHERE id = ? AND status = ?", (job_id, DONE)
+            ).fetchone()
+        return row["result"] if row else None
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Claims the oldest queued job, or a running job with an expired lease.
+        Expired jobs that used up their attempts fail instead: their process most likely died running them
+        (e.g. killed for running out of memory), so they never reached fail().
+
+        Returns the job (as before the claim, i.e. with the attempts made before this one),
+        with the token of this claim as "lease".
+        """
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    "UPDATE jobs SET status = ?, stage = ?, error = ?, lease_until = NULL, updated = ? "
+                    "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                    (
+                        FAILED,
+                        FAILED,
+                        "Lease expired on the last attempt (worker died?)",
+                        now,
+                        RUNNING,
+                        now,
+                        self.max_attempts,
+                    ),
+                )
+                row = db.execute(
+                    "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) "
+                    "ORDER BY created LIMIT 1",
+                    (QUEUED, RUNNING, now),
+                ).fetchone()
+                job = None
+                if row:
+                    job = dict(row, lease=str(uuid.uuid4()))
+                    db.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, lease = ?, "
+                        "updated = ? WHERE id = ?",
+                        (RUNNING, now + self.lease_seconds, job["lease"], now, row["id"]),
+                    )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return job
+
+    def _update_claimed(self, job_id: str, lease: str, assignments: str, values: tuple) -> bool:
+        """
+        Updates a running job, if it's still held by the claim with this lease token
+        """
+        with self._connect() as db:
+            cursor = db.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND status = ? AND lease = ?",
+                values + (job_id, RUNNING, lease),
+            )
+            return cursor.rowcount == 1
+
+    def renew(self, job_id: str, lease: str) -> bool:
+        """
+        Extends the lease of a running job. False if the lease was lost (expired and claimed again)
+        """
+        now = time.time()
+        return self._update_claimed(
+            job_id, lease, "lease_until = ?, updated = ?", (now + self.lease_seconds, now)
+        )
+
+    def progress(self, job_id: str, lease: str, stage: str, progress: float) -> bool:
+        now = time.time()
+        return self._update_claimed(
+            job_id,
+            lease,
+            "stage = ?, progress = ?, lease_until = ?, updated = ?",
+            (stage, progress, now + self.lease_seconds, now),
+        )
+
+    def finish(self, job_id: str, lease: str, result: str) -> bool:
+        return self._update_claimed(
+            job_id,
+            lease,
+            "status = ?, stage = ?, progress = 1, result = ?, lease_until = NULL, updated = ?",
+            (DONE, DONE, result, time.time()),
+        )
+
+    def fail(self, job_id: str, lease: str, error: str, attempts: int) -> bool:
+        # Retried (queued again) until the maximum number of attempts is reached
+        status = FAILED if attempts >= self.max_attempts else QUEUED
+        return self._update_claimed(
+            job_id,
+            lease,
+            "status = ?, stage = ?, error = ?, lease_until = NULL, updated = ?",
+            (status, status, error, time.time()),
+        )
+
+    def purge(self) -> int:
+        """
+        Deletes finished jobs older than the retention time
+        """
+        with self._connect() as db:
+            cursor = db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                (DONE, FAILED, time.time() - self.retention_seconds),
+            )
+            return cursor.rowcount
+
+    @staticmethod
+    def _response(row: sqlite3.Row) -> JobResponse:
+        return JobResponse(
+            id=row["id"],
+            status=row["status"],
+            stage=row["stage"],
+            progress=row["progress"],
+            error=row["error"] if row["status"] == FAILED else None,
+            created=row["created"],
+            updated=row["updated"],
+        )
+
+
+def check_callback_url(url: str) -> None:
+    """
+    Raises ValueError unless the URL is a http(s) URL of an allowed host (JOBS_CALLBACK_HOSTS),
+    or - without allowlist - of a host with public addresses only. Resolves the host (blocking).
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise ValueError(f"Callback URL must be a http(s) URL: '{url}'")
+
+    if JOBS_CALLBACK_HOSTS:
+        if not any(
+            host == allowed or (allowed.startswith(".") and host.endswith(allowed))
+            for allowed in JOBS_CALLBACK_HOSTS
+        ):
+            raise ValueError(f"Callback host '{host}' is not allowed")
+        return
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or 80)}
+    except (socket.gaierror, UnicodeError) as e:
+        raise ValueError(f"Unable to resolve callback host '{host}': {e}")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"Callback host '{host}' is not a public address")
+
+
+_JOB_STORE: Optional[JobStore] = None
+_JOB_STORE_LOCK = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """
+    The job store of this process, created (with its database) on first use
+    """
+    global _JOB_STORE
+    if _JOB_STORE is None:
+        with _JOB_STORE_LOCK:
+            if _JOB_STORE is None:
+                _JOB_STORE = JobStore.from_env()
+    return _JOB_STORE
+
+
+class JobWorkers(object):
+    """
+    Worker threads running the queued analysis jobs.
+    With the event loop of the server, analyses are admitted by ADMISSION on that loop.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        workers: int = 1,
+        poll_interval: float = 1.0,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ):
+        super().__init__()
+        self.store = store
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.loop = loop
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        log.info(f"Started {self.workers} job workers")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        last_purge = 0.0
+        while not self._stop.is_set():
+            try:
+                if time.time() - last_purge > 3600:
+                    self.store.purge()
+                    last_purge = time.time()
+
+                row = self.store.claim()
+            except sqlite3.Error as e:
+                log.error(f"Unable to claim job: {e}")
+                row = None
+
+            if row is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.run_job(row)
+
+    @contextmanager
+    def _heartbeat(self, job_id: str, lease: str) -> Iterator[None]:
+        """
+        Renews the lease of a job while it runs, e.g. waiting for admission or in a long analysis
+        """
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(self.store.lease_seconds / 3):
+                try:
+                    if not self.store.renew(job_id, lease):
+                        log.warning(f"Job {job_id} lost its lease")
+                        return
+                except sqlite3.Error as e:
+                    log.error(f"Unable to renew the lease of job {job_id}: {e}")
+
+        thread = threading.Thread(target=renew, name=f"job-heartbeat-{job_id}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def run_job(self, row: Dict[str, Any]) -> None:
+        # Imported here, as the analysis pulls in the heavy (lazy) dependencies
+        from app.analysis import analyze, document_request
+        from app.pipeline import extract_url
+
+        job_id, lease = row["id"], row["lease"]
+        request = AnalyzeJobRequest(**json.loads(row["request"]))
+        log.info(f"Running job {job_id} (attempt {row['attempts'] + 1})")
+
+        try:
+            with self._heartbeat(job_id, lease):
+                extracted = None
+                if request.url:
+                    self.store.progress(job_id, lease, "extract", 0.1)
+                    extracted = extract_url(request.url)
+
+                self.store.progress(job_id, lease, "analyze", 0.4)
+                result = self._admitted(
+                    analyze,
+                    document_request(
+                        request.text,
+                        request.language,
+                        request.model,
+                        request.num_sentences,
+                        extracted=extracted,
+                    ),
+                )
+            if not self.store.finish(job_id, lease, result.json()):
+                log.warning(f"Job {job_id} lost its lease, result discarded")
+        except Exception as e:
+            # HTTPExceptions (e.g. of the extraction) have their message in detail
+            error = getattr(e, "detail", None) or str(e) or e.__class__.__name__
+            log.error(f"Job {job_id} failed: {error}")
+            attempts = row["attempts"] + 1
+            if 400 <= getattr(e, "status_code", 500) < 500:
+                # Invalid input, trying again won't help
+                attempts = self.store.max_attempts
+            if not self.store.fail(job_id, lease, str(error), attempts):
+                log.warning(f"Job {job_id} lost its lease, failure discarded")
+
+        if request.callback_url:
+            self._callback(job_id, request.callback_url)
+
+    def _admitted(self, analyze, request: AnalyzeRequest):
+        """
+        Runs the analysis once admitted (in the lane of its cost, like an /analyze request)
+        """
+        if self.loop is None:
+            return analyze(request)
+
+        from app.admission import ADMISSION
+
+        async def admitted():
+            async with ADMISSION.admit(len(request.text), reject=False):
+                return await self.loop.run_in_executor(None, analyze, request)
+
+        return asyncio.run_coroutine_threadsafe(admitted(), self.loop).result()
+
+    def _callback(self, job_id: str, url: str) -> None:
+        job = self.store.get(job_id)
+        if job.status not in (DONE, FAILED):
+            # Will be retried, no notification yet
+            return
+        try:
+            # Again, the host may resolve differently by now
+            check_callback_url(url)
+            requests.post(
+                url,
+                data=job.json(),
+                headers={"Content-Type": "application/json"},
+                timeout=10,
+                # Not to somewhere check_callback_url didn't see
+                allow_redirects=False,
+            )
+        except (ValueError, requests.RequestException) as e:
+            log.warning(f"Callback for job {job_id} to {url} failed: {e}")
@@ -0,0 +1,249 @@
+import hashlib, logging, math, mmap, os, re, struct, tempfile, threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+#
+# Keywords and a search query for each analysis, from its noun chunks and entities,
+# ranked by how specific their words are: the inverse document frequency (IDF) in a reference corpus.
+#
+# The IDF table is built offline from a local corpus (e.g. extracted pages of trusted websites):
+#
+#   python -m app.keywords <output file> <corpus file or directory>... [--urls data/txt/trusted_websites.txt]
+#
+# It's a compact binary file (IDF_TABLE), memory-mapped read-only, so all workers share the pages:
+# an open-addressing hash table (linear probing) of (8 byte blake2b hash of the term, float32 idf) slots.
+# Lookups are O(1), no terms (strings) are kept at all. Without a table, all words weigh the same.
+#
+IDF_TABLE = os.getenv("IDF_TABLE", "./.idf.bin")
+KEYWORDS_LIMIT = int(os.getenv("KEYWORDS_LIMIT", 5))
+# Phrases in the search query
+SEARCH_QUERY_KEYWORDS = int(os.getenv("SEARCH_QUERY_KEYWORDS", 3))
+
+MAGIC = b"SIDF"
+VERSION = 1
+# magic, version, number of slots (power of 2), number of documents, idf of unknown terms
+HEADER = struct.Struct("<4sIIIf")
+# term hash (0 = empty slot), idf
+SLOT = struct.Struct("<Qf")
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def words(text: str) -> List[str]:
+    return [w for w in WORD.findall(text.lower()) if not w.isdigit()]
+
+
+def term_hash(term: str) -> int:
+    h = int.from_bytes(
+        hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+    # 0 marks empty slots
+    return h or 1
+
+
+def idf_value(documents: int, frequency: int) -> float:
+    # Smoothed, always positive
+    return math.log((documents + 1) / (frequency + 1)) + 1
+
+
+class IdfTable(object):
+    """
+    Read-only, memory-mapped IDF table
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, slots, documents, default = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"'{path}' is not an IDF table (version {VERSION})")
+        if len(self._mm) < HEADER.size + slots * SLOT.size:
+            raise ValueError(f"IDF table '{path}' is truncated")
+        self.slots = slots
+        self.documents = documents
+        self.default = default
+        self._mask = slots - 1
+
+    def idf(self, term: str) -> float:
+        h = term_hash(term)
+        i = h & self._mask
+        while True:
+            key, value = SLOT.unpack_from(self._mm, HEADER.size + i * SLOT.size)
+            if key == h:
+                return value
+            if key == 0:
+                return self.default
+            i = (i + 1) & self._mask
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+def write_table(
+    frequencies: Dict[str, int], documents: int, path: str, load_factor: float = 0.5
+) -> int:
+    """
+    Writes the IDF table of the document frequencies (atomically, workers keep reading the old one).
+    Returns the number of slots.
+    """
+    slots = 8
+    while slots * load_factor < len(frequencies):
+        slots *= 2
+    mask = slots - 1
+
+    table = bytearray(HEADER.size + slots * SLOT.size)
+    HEADER.pack_into(table, 0, MAGIC, VERSION, slots, documents, idf_value(documents, 0))
+    for term, frequency in frequencies.items():
+        h = term_hash(term)
+        i = h & mask
+        while True:
+            offset = HEADER.size + i * SLOT.size
+            key, _ = SLOT.unpack_from(table, offset)
+            if key == 0 or key == h:
+                SLOT.pack_into(table, offset, h, idf_value(documents, frequency))
+                break
+            i = (i + 1) & mask
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(table)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return slots
+
+
+def document_frequencies(
+    documents: Iterable[str], min_frequency: int = 1
+) -> Tuple[Dict[str, int], int]:
+    """
+    In how many documents each word occurs, and the number of documents
+    """
+    frequencies = Counter()
+    count = 0
+    for document in documents:
+        frequencies.update(set(words(document)))
+        count += 1
+    return {t: f for t, f in frequencies.items() if f >= min_frequency}, count
+
+
+_TABLE: Optional[IdfTable] = None
+_TABLE_LOADED = False
+_TABLE_LOCK = threading.Lock()
+
+
+def get_idf_table() -> Optional[IdfTable]:
+    """
+    The IDF table of this process, None if there is none
+    """
+    global _TABLE, _TABLE_LOADED
+    if not _TABLE_LOADED:
+        with _TABLE_LOCK:
+            if not _TABLE_LOADED:
+                try:
+                    if os.path.exists(IDF_TABLE):
+                        _TABLE = IdfTable(IDF_TABLE)
+                        log.info(f"Using IDF table {IDF_TABLE} ({_TABLE.documents} documents)")
+                    else:
+                        log.warning(f"No IDF table at '{IDF_TABLE}', keywords are ranked by frequency only")
+                except (OSError, ValueError) as e:
+                    log.error(f"Unable to load IDF table: {e}")
+                _TABLE_LOADED = True
+    return _TABLE
+
+
+def rank_keywords(
+    phrases: Iterable[str], limit: int = KEYWORDS_LIMIT, boost: Iterable[str] = ()
+) -> List[str]:
+    """
+    The most relevant (specific, frequent) phrases, e.g. noun chunks and entities of a text.
+    Phrases in boost (e.g. health entities) weigh more. Phrases made redundant by higher ranked ones are skipped.
+    """
+    table = get_idf_table()
+    idf = table.idf if table is not None else (lambda term: 1.0)
+    # Words in more than 70% of the documents are function words ("the", "of"...), dropped from phrases
+    min_idf = idf_value(10, 7) if table is not None and table.documents >= 10 else 0
+
+    counts = Counter()
+    for phrase in phrases:
+        terms = tuple(w for w in words(phrase) if idf(w) >= min_idf)
+        if terms:
+            counts[terms] += 1
+    boosted = {tuple(words(phrase)) for phrase in boost}
+
+    scores = {}
+    for terms, count in counts.items():
+        specificity = sum(idf(w) for w in terms) / math.sqrt(len(terms))
+        scores[terms] = (1 + math.log(count)) * specificity * (1.5 if terms in boosted else 1.0)
+
+    keywords, covered = [], []
+    for terms in sorted(scores, key=scores.get, reverse=True):
+        if any(set(terms) <= c for c in covered):
+            continue
+        keywords.append(" ".join(terms))
+        covered.append(set(terms))
+        if len(keywords) >= limit:
+            break
+    return keywords
+
+
+def search_query(keywords: List[str]) -> Optional[str]:
+    return " ".join(keywords[:SEARCH_QUERY_KEYWORDS]) or None
+
+
+def read_documents(paths: List[Path]) -> Iterable[str]:
+    """
+    Documents of the corpus: every file of a directory is one document,
+    other files have documents separated by blank lines.
+    """
+    for path in paths:
+        if path.is_dir():
+            for file in sorted(p for p in path.glob("**/*") if p.is_file()):
+                yield file.read_text(encoding="utf-8", errors="replace")
+        else:
+            text = path.read_text(encoding="utf-8", errors="replace")
+            yield from (doc for doc in text.split("\n\n") if doc.strip())
+
+
+def extract_documents(urls_file: Path) -> Iterable[str]:
+    """
+    Texts of the webpages listed in a file (one URL per line)
+    """
+    from app.text_extract import Extractor
+
+    extractor = Extractor()
+    for url in urls_file.read_text(encoding="utf-8").split():
+        try:
+            yield extractor(url, {"classify": False}).text
+        except Exception as e:
+            log.warning(f"Skipping '{url}': {e}")
+
+
+if __name__ == "__main__":
+    import itertools
+    import typer
+
+    def build(
+        output: Path = typer.Argument(Path(IDF_TABLE)),
+        corpus: List[Path] = typer.Argument(None, help="Corpus files or directories"),
+        urls: Optional[Path] = typer.Option(None, help="File with URLs of pages to extract and add"),
+        min_frequency: int = typer.Option(2, help="Leave out rarer words (they get the idf of unknown words)"),
+    ):
+        documents = read_documents(corpus or [])
+        if urls:
+            documents = itertools.chain(documents, extract_documents(urls))
+        frequencies, count = document_frequencies(documents, min_frequency)
+        slots = write_table(frequencies, count, str(output))
+        size = os.path.getsize(output) / 1024
+        typer.echo(f"{len(frequencies)} terms of {count} documents, {slots} slots ({size:.0f} KB) in {output}")
+
+    typer.run(build)
@@ -0,0 +1,159 @@
+import atexit, copy, json, logging, os, queue, random
+from logging.handlers import QueueHandler, QueueListener
+from sys import stderr
+from typing import Dict, Optional
+
+LOG_FORMAT = "[%(asctime)s] %(levelname)-8s %(name)-20s %(message)s"
+
+# Attributes every LogRecord has, everything else was passed as `extra=...`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+# Loggers whose records go through the queue
+LOGGERS = ("app", "uvicorn")
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Structured log records: one JSON object per line, including any `extra` fields
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Formatted before queueing, see LocalQueueHandler
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    Queues records for a listener in the same process.
+    QueueHandler.prepare() formats the whole record and drops exc_info (for pickling),
+    here only the message and the traceback are rendered, so the formatters
+    of the listener still see the exception.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Don't keep the traceback (and its frames) alive in the queue
+            record.exc_text = record.exc_text or _EXCEPTION_FORMATTER.formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes only a share of the (below WARNING) records of hot-path loggers, e.g. {"app.textanalyzer": 0.01}.
+    Warnings and errors always pass.
+    """
+
+    def __init__(self, rates: Dict[str, float]) -> None:
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name)
+        return rate is None or random.random() < rate
+
+
+def _sampling_rates(setting: str) -> Dict[str, float]:
+    """
+    Parses a setting like "app.textanalyzer=0.01,app.renderer=0.1"
+    """
+    rates = {}
+    for item in setting.split(","):
+        if "=" in item:
+            name, rate = item.split("=", 1)
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def configure_logging() -> QueueListener:
+    """
+    Configures non-blocking logging for the app: loggers only put records into a queue,
+    a background thread (QueueListener) formats and writes them to the console and log file.
+    Idempotent, calling it again returns the running listener.
+
+    Configured by environment variables:
+
+    - **LOGLEVEL** Level of the app loggers (default: INFO)
+    - **LOG_STYLE** "plain" or "json" (default: plain)
+    - **LOG_FILE** Log file, empty to disable (default: ./.server.log)
+    - **LOG_SAMPLING** Sampling rates for hot-path loggers, e.g. "app.textanalyzer=0.01,app.renderer=0.1"
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _listener
+
+    if os.getenv("LOG_STYLE", "plain").lower() == "json":
+        formatter = JsonFormatter()
+    else:
+        # FIXME find a working(!) ANSI code console formatter (colorlog didnt qwork for me in VS code terminal)
+        formatter = logging.Formatter(LOG_FORMAT)
+
+    # TODO: use log forwarding to a centralized log mgmt solution / syslog
+    handlers = []
+    console_handler = logging.StreamHandler(stream=stderr)
+    console_handler.setFormatter(formatter)
+    handlers.append(console_handler)
+
+    log_file = os.getenv("LOG_FILE", "./.server.log")
+    if log_file:
+        logfile_handler = logging.FileHandler(log_file)
+        logfile_handler.setFormatter(formatter)
+        handlers.append(logfile_handler)
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = LocalQueueHandler(log_queue)
+    _queue_handler.addFilter(
+        SamplingFilter(_sampling_rates(os.getenv("LOG_SAMPLING", "")))
+    )
+
+    for name in LOGGERS:
+        logging.getLogger(name).addHandler(_queue_handler)
+    logging.getLogger("app").setLevel(os.getenv("LOGLEVEL", logging.INFO))
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    return _listener
+
+
+def shutdown_logging() -> None:
+    """
+    Flushes the queued records and stops the writer thread
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    for name in LOGGERS:
+        logging.getLogger(name).removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+    _queue_handler = None
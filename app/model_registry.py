@@ -0,0 +1,301 @@
+import json, logging, os, threading, time, weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from app.startup import lazy_import
+from app.timing import METRICS, rss_mb, timed
+
+log = logging.getLogger(__name__)
+
+spacy = lazy_import("spacy")
+
+#
+# Registry of the loaded spaCy models (spacy.Language instances), shared by all requests of a worker.
+#
+# - Names resolve to installed packages (e.g. "en_core_web_sm") or to paths of our own trained models,
+#   configured with SPACY_MODELS="name=target,..." and/or a JSON file {"name": "target"} (MODEL_REGISTRY_FILE).
+# - The approximate memory of each model is tracked. Above MODEL_MEMORY_BUDGET_MB, the least recently used
+#   models are evicted (and loaded again when requested).
+# - Hot reload: every MODEL_CHECK_INTERVAL seconds, the registry file is re-read. A model is reloaded
+#   when its target changed, or when a model directory was replaced (meta.json modified).
+#   Checks and reloads run in a background thread, requests are served by the old instance until
+#   the new one is loaded. Requests still using the old instance finish with it.
+#   Note: Installed packages are imported once, a new package version needs a restart. Use paths for hot swaps.
+#   The first check is due check_interval seconds after the registry was created. Forked workers (app/server.py)
+#   start with fresh locks, even if the parent was checking at the time of the fork.
+#
+SPACY_MODELS = os.getenv("SPACY_MODELS", "")
+MODEL_REGISTRY_FILE = os.getenv("MODEL_REGISTRY_FILE")
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", 0))
+MODEL_CHECK_INTERVAL = float(os.getenv("MODEL_CHECK_INTERVAL", 30))
+
+
+def parse_sources(value: str) -> Dict[str, str]:
+    """
+    "name=target,name2=target2" -> {"name": "target", ...}
+    """
+    sources = {}
+    for item in value.split(","):
+        name, sep, target = item.partition("=")
+        if sep and name.strip() and target.strip():
+            sources[name.strip()] = target.strip()
+    return sources
+
+
+def _is_path(target: str) -> bool:
+    return os.sep in target or target.startswith(".") or Path(target).exists()
+
+
+def _version(target: str) -> Optional[float]:
+    """
+    Changes when a model directory is replaced (the mtime of its meta.json)
+    """
+    if not _is_path(target):
+        return None
+    try:
+        return os.stat(os.path.join(target, "meta.json")).st_mtime
+    except OSError:
+        return None
+
+
+def _disk_mb(target: str) -> float:
+    try:
+        path = Path(target) if _is_path(target) else spacy.util.get_package_path(target)
+        return sum(f.stat().st_size for f in path.glob("**/*") if f.is_file()) / (
+            1024 * 1024
+        )
+    except Exception:
+        return 0
+
+
+class ModelEntry(object):
+    def __init__(self, name: str, target: str, nlp, size_mb: float) -> None:
+        super().__init__()
+        self.name = name
+        self.target = target
+        self.nlp = nlp
+        self.size_mb = size_mb
+        self.version = _version(target)
+        self.loaded = time.time()
+        self.last_used = self.loaded
+        # Objects bound to this instance (e.g. matchers of its vocab), released with it
+        self.attachments: Dict[Hashable, Any] = {}
+        self.lock = threading.Lock()
+
+
+class ModelRegistry(object):
+    """
+    Loads spaCy models on first use and keeps them within a memory budget (LRU).
+    Thread safe, a model is only loaded once even when requested concurrently.
+    """
+
+    def __init__(
+        self,
+        sources: Optional[Dict[str, str]] = None,
+        registry_file: Optional[str] = None,
+        memory_budget_mb: float = 0,
+        check_interval: float = 30,
+    ) -> None:
+        super().__init__()
+        self.sources = dict(sources or {})
+        self.registry_file = registry_file
+        self.memory_budget_mb = memory_budget_mb
+        self.check_interval = check_interval
+
+        self._file_sources: Dict[str, str] = {}
+        self._file_mtime: Optional[float] = None
+        # The registry file is read right away, no need to check it before the interval passed
+        self._checked = time.monotonic()
+        self._checking = threading.Lock()
+
+        self._models: "OrderedDict[str, ModelEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+
+        self._read_registry_file()
+
+        if hasattr(os, "register_at_fork"):
+            registry = weakref.ref(self)
+            os.register_at_fork(
+                after_in_child=lambda: registry() is not None and registry()._after_fork()
+            )
+
+    @classmethod
+    def from_env(cls) -> "ModelRegistry":
+        return cls(
+            sources=parse_sources(SPACY_MODELS),
+            registry_file=MODEL_REGISTRY_FILE,
+            memory_budget_mb=MODEL_MEMORY_BUDGET_MB,
+            check_interval=MODEL_CHECK_INTERVAL,
+        )
+
+    def resolve(self, name: str) -> str:
+        """
+        The package name or path to load for a model name
+        """
+        return self._file_sources.get(name) or self.sources.get(name) or name
+
+    def get(self, name: str) -> "spacy.Language":
+        """
+        The loaded model, loading it (and evicting others) if required
+        """
+        self.check()
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is not None:
+                self._models.move_to_end(name)
+                entry.last_used = time.time()
+                return entry.nlp
+            loading = self._loading.setdefault(name, threading.Lock())
+
+        with loading:
+            with self._lock:
+                entry = self._models.get(name)
+            if entry is None:
+                # Loaded at most once, other requests for this model wait here
+                entry = self._load(name)
+                self._add(entry)
+        return entry.nlp
+
+    def reload(self, name: str) -> None:
+        """
+        Loads the current version of a model, and swaps it in when ready
+        """
+        with self._loading.setdefault(name, threading.Lock()):
+            entry = self._load(name)
+            self._add(entry)
+        log.info(f"Reloaded model '{name}' from '{entry.target}'")
+
+    def attachment(self, vocab, key: Hashable, factory: Callable[[], Any]) -> Optional[Any]:
+        """
+        An object bound to the vocab of a loaded model, created by factory once per model instance.
+        It is released with the model (when evicted or reloaded), instead of keeping the model alive.
+        None if the vocab is not of a loaded model.
+        """
+        with self._lock:
+            entry = next(
+                (e for e in self._models.values() if getattr(e.nlp, "vocab", None) is vocab),
+                None,
+            )
+        if entry is None:
+            return None
+        with entry.lock:
+            if key not in entry.attachments:
+                entry.attachments[key] = factory()
+            return entry.attachments[key]
+
+    def evict(self, name: str) -> None:
+        with self._lock:
+            self._models.pop(name, None)
+
+    def loaded(self) -> List[dict]:
+        """
+        Loaded models, least recently used first
+        """
+        with self._lock:
+            return [
+                {
+                    "name": e.name,
+                    "target": e.target,
+                    "size_mb": round(e.size_mb, 1),
+                    "loaded": e.loaded,
+                    "last_used": e.last_used,
+                }
+                for e in self._models.values()
+            ]
+
+    def check(self) -> Optional[threading.Thread]:
+        """
+        Picks up changes of the registry file and of model directories, at most every check_interval seconds.
+        Returns the background thread checking (and reloading), if one was started.
+        """
+        now = time.monotonic()
+        if self.check_interval <= 0 or now - self._checked < self.check_interval:
+            return None
+        # One check at a time, requests go on with what is loaded
+        if not self._checking.acquire(blocking=False):
+            return None
+        self._checked = now
+        thread = threading.Thread(target=self._check, name="model-check", daemon=True)
+        try:
+            thread.start()
+        except BaseException:
+            self._checking.release()
+            raise
+        return thread
+
+    def _check(self) -> None:
+        try:
+            self._read_registry_file()
+            with self._lock:
+                entries = list(self._models.values())
+            for entry in entries:
+                if (
+                    self.resolve(entry.name) != entry.target
+                    or _version(entry.target) != entry.version
+                ):
+                    try:
+                        self.reload(entry.name)
+                    except Exception as e:
+                        # Keep serving the version we have
+                        log.error(f"Unable to reload model '{entry.name}': {e}")
+        finally:
+            self._checking.release()
+
+    def _after_fork(self) -> None:
+        # Only the forking thread exists in the child: locks held by others (e.g. the check thread) are never released
+        self._checking = threading.Lock()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def _read_registry_file(self) -> None:
+        if not self.registry_file:
+            return
+        try:
+            mtime = os.stat(self.registry_file).st_mtime
+            if mtime == self._file_mtime:
+                return
+            with open(self.registry_file) as f:
+                self._file_sources = {str(k): str(v) for k, v in json.load(f).items()}
+            self._file_mtime = mtime
+        except (OSError, ValueError, AttributeError) as e:
+            log.warning(f"Unable to read model registry file '{self.registry_file}': {e}")
+
+    def _load(self, name: str) -> ModelEntry:
+        target = self.resolve(name)
+        log.info(f"Loading language model: '{name}' from '{target}' ...")
+        before = rss_mb()
+        with timed("model_load", model=name):
+            nlp = spacy.load(target)
+        # Approximation: growth of this process while loading (other threads allocate, too),
+        # or the size on disk if that's not measurable
+        size_mb = rss_mb() - before
+        if size_mb <= 0:
+            size_mb = _disk_mb(target)
+        return ModelEntry(name, target, nlp, size_mb)
+
+    def _add(self, entry: ModelEntry) -> None:
+        with self._lock:
+            self._models[entry.name] = entry
+            self._models.move_to_end(entry.name)
+            self._evict(keep=entry.name)
+
+    def _evict(self, keep: str) -> None:
+        if self.memory_budget_mb <= 0:
+            return
+        total = sum(e.size_mb for e in self._models.values())
+        for name in list(self._models):
+            if total <= self.memory_budget_mb:
+                break
+            if name == keep:
+                continue
+            entry = self._models.pop(name)
+            total -= entry.size_mb
+            METRICS.increment("summed_model_evictions_total", model=name)
+            log.info(
+                f"Evicted model '{name}' ({entry.size_mb:.0f} MB), {total:.0f} of {self.memory_budget_mb:.0f} MB in use"
+            )
+
+
+MODELS = ModelRegistry.from_env()
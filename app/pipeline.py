@@ -0,0 +1,114 @@
+import logging, os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from fastapi.exceptions import HTTPException
+
+from app import text_extract
+from app.analysis import analyze, document_request
+from app.api_models import (
+    PipelineOutput,
+    PipelineRequest,
+    PipelineResponse,
+)
+from app.api_models import ExtractResponse
+from app.cache import EXTRACT_CACHE
+from app.doctypes import CLASSIFIER
+from app.renderer import HTMLRenderer
+
+log = logging.getLogger(__name__)
+
+# Downloads in parallel for /extract/batch
+EXTRACT_BATCH_CONCURRENCY = int(os.getenv("EXTRACT_BATCH_CONCURRENCY", 4))
+
+
+def extract_url(url: str):
+    """
+    Extracts a webpage, using the EXTRACT_CACHE
+    """
+    cached = EXTRACT_CACHE.get(url)
+    if cached:
+        return cached
+
+    extractor = text_extract.Extractor()
+    result = extractor(url, {})
+    EXTRACT_CACHE.set(url, result)
+    return result
+
+
+def extract_urls(
+    urls: List[str],
+) -> Tuple[List[ExtractResponse], Dict[str, str]]:
+    """
+    Extracts several webpages, using the EXTRACT_CACHE.
+    Pages are downloaded in parallel, and the new ones are classified together, in one nlp.pipe.
+    Returns the extracted pages (in order of the urls) and the errors of failed urls.
+    """
+    results: Dict[str, ExtractResponse] = {}
+    missing = []
+    for url in dict.fromkeys(urls):
+        cached = EXTRACT_CACHE.get(url)
+        if cached:
+            results[url] = cached
+        else:
+            missing.append(url)
+
+    errors = {}
+
+    def download(url):
+        try:
+            return text_extract.Extractor().extract_webpage(url, {"classify": False})
+        except Exception as e:
+            log.warning(f"Unable to extract '{url}': {e}")
+            errors[url] = str(e) or e.__class__.__name__
+            return None
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=EXTRACT_BATCH_CONCURRENCY) as executor:
+            extracted = [
+                (url, result)
+                for url, result in zip(missing, executor.map(download, missing))
+                if result is not None
+            ]
+
+        CLASSIFIER.apply([result for _, result in extracted])
+        for url, result in extracted:
+            EXTRACT_CACHE.set(url, result)
+            results[url] = result
+
+    return [results[url] for url in urls if url in results], errors
+
+
+def run_pipeline(request: PipelineRequest) -> PipelineResponse:
+    """
+    Runs extraction (for urls), analysis and rendering in-process, on the same objects.
+    Only the requested outputs are computed and returned.
+    """
+    if not request.url and not request.text:
+        raise HTTPException(422, "Either 'url' or 'text' is required")
+
+    outputs = set(request.outputs)
+    response = PipelineResponse()
+
+    extracted = None
+    if request.url:
+        extracted = extract_url(request.url)
+        if PipelineOutput.extract in outputs:
+            response.extract = extracted
+
+    if PipelineOutput.analysis in outputs or PipelineOutput.html in outputs:
+        analysis = analyze(
+            document_request(
+                request.text,
+                request.language,
+                request.model,
+                request.num_sentences,
+                extracted=extracted,
+            )
+        )
+        if PipelineOutput.analysis in outputs:
+            response.analysis = analysis
+        if PipelineOutput.html in outputs:
+            response.html = HTMLRenderer()(analysis)
+
+    return response
@@ -0,0 +1,203 @@
+import io, os, logging, re, threading, time
+from collections import deque
+from typing import Iterable, List, Optional
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import requests
+
+from app.analysis import analyze, document_request
+from app.cache import EXTRACT_CACHE
+from app.server import worker_slot
+from app.text_extract import Extractor
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SEEDS_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "data", "txt", "trusted_websites.txt"
+)
+
+# Very simple link extraction, good enough for crawling a few levels of a website
+HREF_PATTERN = re.compile(r"""href\s*=\s*["']([^"'#]+)["']""", re.IGNORECASE)
+
+# Pages with less text than this are (most likely) index/navigation pages, we don't analyze them
+MIN_TEXT_LENGTH = 500
+
+
+class Prefetcher(object):
+    """
+    Background prefetcher for the trusted (medical) websites our users actually read.
+
+    Crawls the seed URLs up to a configurable link depth, and runs extraction and analysis
+    for every page it finds, so that the result stores (EXTRACT_CACHE, ANALYZE_CACHE) are warm
+    when users request those pages. Runs in a low priority daemon thread, rate limited, and repeats
+    every `interval` seconds.
+
+    Configured by environment variables:
+
+    - **PREFETCH_ENABLED** Set to "true" to start the prefetcher with the server
+    - **PREFETCH_SEEDS_FILE** File with seed URLs, one per line (default: data/txt/trusted_websites.txt)
+    - **PREFETCH_DEPTH** How many links deep to follow from a seed URL (default: 1)
+    - **PREFETCH_MAX_PAGES** Maximum number of pages per run (default: 200)
+    - **PREFETCH_RATE** Maximum number of page downloads per second (default: 0.5)
+    - **PREFETCH_INTERVAL** Seconds between two runs (default: 86400)
+    - **PREFETCH_NICENESS** Niceness of the prefetcher thread, where supported (default: 10)
+    """
+
+    def __init__(
+        self,
+        seeds: Iterable[str],
+        depth: int = 1,
+        max_pages: int = 200,
+        rate: float = 0.5,
+        interval: float = 24 * 60 * 60,
+        niceness: int = 10,
+    ) -> None:
+        super().__init__()
+        self.seeds = [s.strip() for s in seeds if s.strip()]
+        self.depth = depth
+        self.max_pages = max_pages
+        self.rate = rate
+        self.interval = interval
+        self.niceness = niceness
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_request = 0.0
+
+    @staticmethod
+    def enabled() -> bool:
+        # With several worker processes, only the first one prefetches
+        return os.getenv("PREFETCH_ENABLED", "false").lower() in (
+            "1",
+            "true",
+            "yes",
+        ) and worker_slot() in (None, 0)
+
+    @classmethod
+    def from_env(cls) -> "Prefetcher":
+        seeds_file = os.getenv("PREFETCH_SEEDS_FILE", DEFAULT_SEEDS_FILE)
+        with open(seeds_file, encoding="utf-8") as f:
+            seeds = [line for line in f if not line.startswith("#")]
+
+        return cls(
+            seeds=seeds,
+            depth=int(os.getenv("PREFETCH_DEPTH", 1)),
+            max_pages=int(os.getenv("PREFETCH_MAX_PAGES", 200)),
+            rate=float(os.getenv("PREFETCH_RATE", 0.5)),
+            interval=float(os.getenv("PREFETCH_INTERVAL", 24 * 60 * 60)),
+            niceness=int(os.getenv("PREFETCH_NICENESS", 10)),
+        )
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="prefetcher", daemon=True
+        )
+        self._thread.start()
+        log.info(
+            f"Prefetcher started: {len(self.seeds)} seeds, depth={self.depth}, rate={self.rate}/s"
+        )
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        self._lower_priority()
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                count = self.run_once()
+                log.info(
+                    f"Prefetcher run done: {count} pages in {time.monotonic() - started:.0f}s"
+                )
+            except Exception as e:
+                log.error(f"Prefetcher run failed: {e}")
+            self._stop.wait(self.interval)
+
+    def _lower_priority(self) -> None:
+        # On Linux, the niceness of a single thread can be set via its native thread id
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.niceness)
+        except (AttributeError, OSError) as e:
+            log.debug(f"Unable to lower prefetcher thread priority: {e}")
+
+    def _throttle(self) -> None:
+        if self.rate <= 0:
+            return
+        wait = self._last_request + 1.0 / self.rate - time.monotonic()
+        if wait > 0:
+            self._stop.wait(wait)
+        self._last_request = time.monotonic()
+
+    def run_once(self) -> int:
+        """
+        Crawls all seeds (breadth first), and extracts + analyzes every page found.
+        Returns the number of processed pages.
+        """
+        seen = set()
+        queue = deque((seed, 0) for seed in self.seeds)
+        processed = 0
+
+        while queue and processed < self.max_pages and not self._stop.is_set():
+            url, level = queue.popleft()
+            if url in seen:
+                continue
+            seen.add(url)
+
+            self._throttle()
+            try:
+                html = self._download(url)
+            except Exception as e:
+                log.debug(f"Prefetcher skipping {url}: {e}")
+                continue
+
+            self.prefetch(url, html)
+            processed += 1
+
+            if level < self.depth:
+                for link in self._links(url, html):
+                    if link not in seen:
+                        queue.append((link, level + 1))
+
+        return processed
+
+    def prefetch(self, url: str, html: str) -> None:
+        """
+        Extracts and analyzes a single (downloaded) page into the result stores
+        """
+        extractor = Extractor()
+        extracted = extractor.extract_file_storage(
+            io.BytesIO(html.encode("utf-8")), "text/html", {"sourceUrl": url}
+        )
+        EXTRACT_CACHE.set(url, extracted)
+
+        if len(extracted.text) < MIN_TEXT_LENGTH:
+            return
+
+        try:
+            # The same request as /pipeline and jobs make for this page, so they find the result
+            analyze(document_request(extracted=extracted))
+        except Exception as e:
+            log.warning(f"Prefetcher unable to analyze {url}: {e}")
+
+    def _download(self, url: str) -> str:
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        if "html" not in response.headers.get("content-type", "text/html"):
+            raise ValueError(f"not a html page ({response.headers['content-type']})")
+        return response.text
+
+    def _links(self, url: str, html: str) -> List[str]:
+        """
+        Links from a page, restricted to the same host
+        """
+        host = urlparse(url).netloc
+        links = []
+        for href in HREF_PATTERN.findall(html):
+            link, _ = urldefrag(urljoin(url, href))
+            parsed = urlparse(link)
+            if parsed.scheme in ("http", "https") and parsed.netloc == host:
+                links.append(link)
+        return links
@@ -0,0 +1,138 @@
+import cProfile, hashlib, logging, os, pstats, random, secrets, sys, time, uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+log = logging.getLogger(__name__)
+
+#
+# Opt-in, per-request CPU profiling.
+#
+# Enabled by configuration only, and then per request, either with the `X-Profile` header set to PROFILE_TOKEN,
+# or randomly for a share (PROFILE_SAMPLE_RATE) of all requests. Without configuration, no middleware is installed.
+#
+# The profile of a request is written to PROFILE_DIR as `<timestamp>-<request id>-<text hash>.prof`
+# (view it e.g. with snakeviz, or `python -m pstats`).
+#
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./.profiles")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+
+PROFILING_ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+# Profiles collected for the current request, one per thread that did work for it
+_request_profiles: ContextVar[Optional[List[cProfile.Profile]]] = ContextVar(
+    "request_profiles", default=None
+)
+
+
+@contextmanager
+def profiled() -> Iterator[None]:
+    """
+    Profiles a (CPU heavy) section, if the current request is being profiled.
+    Needed for work that runs in the threadpool, as profiles are collected per thread.
+    """
+    profiles = _request_profiles.get() if PROFILING_ENABLED else None
+    if profiles is None or sys.getprofile() is not None:
+        # Not profiling, or this thread is already being profiled
+        yield
+        return
+
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Another profiler is active (Python 3.12+ allows only one per process)
+        yield
+        return
+
+    profiles.append(profile)
+    try:
+        yield
+    finally:
+        profile.disable()
+
+
+class ProfilingMiddleware(object):
+    """
+    ASGI middleware profiling selected requests.
+
+    Note: While a request is profiled, the profile of the event loop thread
+    also contains the work of other requests that run concurrently.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    def _selected(self, scope) -> bool:
+        if PROFILE_TOKEN:
+            for name, value in scope.get("headers", []):
+                if name == b"x-profile":
+                    return secrets.compare_digest(value, PROFILE_TOKEN.encode("utf-8"))
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._selected(scope):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers", []))
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1") or str(
+            uuid.uuid4()
+        )
+
+        # Hash the request body (the text) while the app consumes it
+        text_hash = hashlib.sha256(scope.get("query_string", b""))
+
+        async def hashing_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                text_hash.update(message.get("body", b""))
+            return message
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message = {
+                    **message,
+                    "headers": list(message.get("headers", []))
+                    + [(b"x-request-id", request_id.encode("latin-1"))],
+                }
+            await send(message)
+
+        profiles = [cProfile.Profile()]
+        try:
+            profiles[0].enable()
+        except ValueError:
+            # Another profiler is active (Python 3.12+ allows only one per process),
+            # e.g. for a concurrent profiled request
+            log.info(f"Not profiling request {request_id}, another profile is in progress")
+            await self.app(scope, receive, send)
+            return
+
+        token = _request_profiles.set(profiles)
+        try:
+            await self.app(scope, hashing_receive, send_with_request_id)
+        finally:
+            profiles[0].disable()
+            _request_profiles.reset(token)
+            await run_in_threadpool(
+                self._write, profiles, request_id, text_hash.hexdigest()[:16]
+            )
+
+    def _write(self, profiles: List[cProfile.Profile], request_id: str, text_hash: str):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        safe_id = "".join(c for c in request_id if c.isalnum() or c in "-_")[:64]
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(PROFILE_DIR, f"{timestamp}-{safe_id}-{text_hash}.prof")
+
+        try:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(path)
+            log.info(f"Wrote profile of request {request_id} to {path}")
+        except Exception as e:
+            # e.g. no function calls recorded at all
+            log.warning(f"Unable to write profile of request {request_id}: {e}")
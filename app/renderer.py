@@ -1,42 +1,200 @@
-from typing import List
-from app.api_models import AnalyzeResponse, NamedEntity, Sentence
-import os, json, logging, tempfile
-import requests
-
-from jinja2 import Template
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple, Union
+from app.api_models import (
+    AnalyzeResponse,
+    CompactAnalyzeResponse,
+    NamedEntity,
+    Sentence,
+)
+from app.compact import labeled_spans
+from app.profiling import profiled
+from app.startup import lazy_import
+from app.timing import timed
 
 # Init logging
 import logging
 
 log = logging.getLogger(__name__)
 
-# Spacy and lang models
-import spacy
+from markupsafe import Markup, escape
 
+jinja2 = lazy_import("jinja2")
 
-class HTMLRenderer(object):
-    def __call__(self, analysis: AnalyzeResponse) -> str:
-
-        # with open('renderer.html.jinja') as f:
-        #    template = Template(f.read())
-        entities = analysis.entities
-        tagged_text = analysis.text
-
-        already_replaced = []
-        for e in entities:
-
-            if not e.text in already_replaced:
-                tagged_text = tagged_text.replace(
-                    e.text, f"<span alt='{e.label}' class='{e.label}'>{e.text}</span>"
-                )
-                already_replaced.append(e.text)
-        log.info(tagged_text)
-        template = Template(
-            f"""
+TEMPLATE_SOURCE = """
             <div id='myId' class='summed_text_container'>
-            {tagged_text}
+            {{ tagged_text }}
             </div>
         """
+
+
+@lru_cache(maxsize=None)
+def template():
+    """
+    The template, compiled once (on first use). The tagged text is passed in as (already escaped) Markup
+    """
+    return jinja2.Environment(autoescape=True).from_string(TEMPLATE_SOURCE)
+
+
+@lru_cache(maxsize=None)
+def template_parts() -> Tuple[str, str]:
+    """
+    Header and footer of the template, for streaming the tagged text in between
+    """
+    header, footer = template().render(tagged_text=Markup("\x00")).split("\x00")
+    return header, footer
+
+# (start, end, label) of an entity in the analyzed text
+Span = Tuple[int, int, str]
+
+# Approximate size (in chars of text) of the segments yielded when streaming
+STREAM_SEGMENT_SIZE = 4096
+
+
+class HTMLRenderer(object):
+    """
+    Renders an analysis into HTML, wrapping every (health) entity into a <span> tagged with its label.
+
+    Entities are placed by their start/end offsets in a single linear pass over the text,
+    so rendering is linear in the text length. Overlapping entities are not nested:
+    the first (and longest) entity at a position wins.
+    """
+
+    def __call__(
+        self, analysis: Union[AnalyzeResponse, CompactAnalyzeResponse]
+    ) -> str:
+        text = analysis.text or ""
+        with timed("render"), profiled():
+            spans = self.spans(analysis)
+
+            tagged_text = Markup("").join(self.tag(text, spans, 0, len(text)))
+            log.debug(f"Rendered {len(spans)} entities into {len(tagged_text)} chars")
+
+            html = template().render(tagged_text=tagged_text)
+        return html
+
+    def stream(
+        self,
+        analysis: Union[AnalyzeResponse, CompactAnalyzeResponse],
+        segment_size: int = STREAM_SEGMENT_SIZE,
+    ) -> Iterator[str]:
+        """
+        Renders like __call__, but yields the HTML piece by piece: the container header first,
+        then the tagged text in segments ending on sentence boundaries, then the footer.
+        """
+        text = analysis.text or ""
+        spans = self.spans(analysis)
+
+        span_ends = [span[1] for span in spans]
+
+        header, footer = template_parts()
+
+        yield header
+        start = 0
+        for end in self.segment_boundaries(analysis, spans, segment_size):
+            first = bisect_right(span_ends, start)
+            yield "".join(self.tag(text, spans, start, end, first))
+            start = end
+        yield footer
+
+    @staticmethod
+    def segment_boundaries(
+        analysis: Union[AnalyzeResponse, CompactAnalyzeResponse],
+        spans: List[Span],
+        segment_size: int,
+    ) -> Iterator[int]:
+        """
+        End offsets of the streamed segments, each at least segment_size chars long (except the last one).
+        Segments end with a sentence: at the end of a detected sentence if the analysis has sentences,
+        else after the next ". ". A segment never ends inside of a span.
+        """
+        text = analysis.text or ""
+        if isinstance(analysis, CompactAnalyzeResponse):
+            sentence_ends = sorted(analysis.sentences.ends if analysis.sentences else [])
+        else:
+            sentence_ends = sorted(s.end for s in (analysis.sentences or []))
+        sentence_index = 0
+        span_index = 0
+
+        start = 0
+        while start < len(text):
+            target = start + segment_size
+            while (
+                sentence_index < len(sentence_ends)
+                and sentence_ends[sentence_index] < target
+            ):
+                sentence_index += 1
+            if sentence_index < len(sentence_ends):
+                end = sentence_ends[sentence_index]
+            else:
+                period = text.find(". ", target)
+                end = period + 1 if period >= 0 else len(text)
+
+            # Move the boundary behind any span it would cut
+            while span_index < len(spans) and spans[span_index][1] <= end:
+                span_index += 1
+            if span_index < len(spans) and spans[span_index][0] < end:
+                end = spans[span_index][1]
+
+            end = min(end, len(text))
+            yield end
+            start = end
+
+    @staticmethod
+    def spans(analysis: Union[AnalyzeResponse, CompactAnalyzeResponse]) -> List[Span]:
+        """
+        The entities and health entities of an analysis as sorted, non-overlapping spans
+        """
+        text_length = len(analysis.text or "")
+        if isinstance(analysis, CompactAnalyzeResponse):
+            entities = list(labeled_spans(analysis, "health_entities")) + list(
+                labeled_spans(analysis, "entities")
+            )
+        else:
+            entities = [
+                (e.start, e.end, e.label)
+                for e in (analysis.health_entities or []) + (analysis.entities or [])
+            ]
+
+        candidates = sorted(
+            (
+                (start, end, label)
+                for start, end, label in entities
+                if 0 <= start < end <= text_length
+            ),
+            key=lambda span: (span[0], -span[1]),
         )
-        html = template.render(analysis)
-        return html  # super().__call__(*args, **kwds)
+
+        spans = []
+        last_end = 0
+        for start, end, label in candidates:
+            if start >= last_end:
+                spans.append((start, end, label))
+                last_end = end
+
+        return spans
+
+    @staticmethod
+    def tag(
+        text: str, spans: List[Span], start: int, end: int, first: int = 0
+    ) -> Iterator[Markup]:
+        """
+        Yields the escaped text between start and end, with the (sorted) spans inside of it tagged.
+        Spans must not cross the start/end boundaries. Scanning starts at spans[first].
+        """
+        position = start
+        for span_start, span_end, label in islice(spans, first, None):
+            if span_end <= start:
+                continue
+            if span_start >= end:
+                break
+            if span_start > position:
+                yield escape(text[position:span_start])
+            yield Markup("<span alt='{0}' class='{0}'>{1}</span>").format(
+                label, text[span_start:span_end]
+            )
+            position = span_end
+
+        if position < end:
+            yield escape(text[position:end])
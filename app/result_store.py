@@ -0,0 +1,191 @@
+import hashlib, logging, os, struct, tempfile, threading, time
+from collections import OrderedDict
+from typing import Optional
+
+from app.startup import lazy_import
+
+log = logging.getLogger(__name__)
+
+redis = lazy_import("redis")
+
+#
+# Result stores: byte values by string key, with an optional time-to-live.
+# A store shared by all replicas (disk on a shared volume, or a network key-value store)
+# lets every result be computed once per cluster instead of once per replica.
+#
+
+
+class ResultStore(object):
+    """
+    Interface of the result store backends
+    """
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError()
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError()
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError()
+
+
+class MemoryStore(ResultStore):
+    """
+    In-process backend (not shared), e.g. for development and tests
+    """
+
+    def __init__(self, max_items: int = 1024) -> None:
+        super().__init__()
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires is not None and expires < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._items[key] = (time.time() + ttl if ttl else None, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+
+class DiskStore(ResultStore):
+    """
+    Local-disk backend: one file per key, written atomically.
+    Shared by all processes on a node, or across nodes on a shared volume.
+    The oldest files are removed when the directory grows beyond `max_bytes`.
+    """
+
+    # Expiry timestamp (0 = never), in front of the value
+    HEADER = struct.Struct("!d")
+
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024) -> None:
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._file(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        (expires,) = self.HEADER.unpack_from(data)
+        if expires and expires < time.time():
+            self.delete(key)
+            return None
+        return data[self.HEADER.size :]
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        header = self.HEADER.pack(time.time() + ttl if ttl else 0)
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                f.write(value)
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+        with self._lock:
+            self._written += len(value)
+            check = self._written > self.max_bytes // 10
+            if check:
+                self._written = 0
+        if check:
+            self._evict()
+
+    def delete(self, key: str) -> None:
+        try:
+            os.unlink(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        entries = []
+        total = 0
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class RedisStore(ResultStore):
+    """
+    Network key-value backend (Redis, or anything speaking its protocol)
+    """
+
+    def __init__(self, url: str) -> None:
+        super().__init__()
+        self.client = redis.Redis.from_url(url, socket_timeout=2)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        self.client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(key)
+
+
+def store_from_env() -> Optional[ResultStore]:
+    """
+    The shared result store configured by RESULT_STORE (memory, disk or redis), None if not configured
+    """
+    backend = os.getenv("RESULT_STORE", "").lower()
+    if not backend:
+        return None
+    if backend == "memory":
+        return MemoryStore(max_items=int(os.getenv("RESULT_STORE_MAX_ITEMS", 1024)))
+    if backend == "disk":
+        return DiskStore(
+            path=os.getenv("RESULT_STORE_PATH", "./.results"),
+            max_bytes=int(os.getenv("RESULT_STORE_MAX_BYTES", 1024 * 1024 * 1024)),
+        )
+    if backend == "redis":
+        return RedisStore(os.getenv("RESULT_STORE_URL", "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown RESULT_STORE backend '{backend}'")
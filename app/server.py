@@ -0,0 +1,237 @@
+import gc, logging, os, random, signal, socket, sys, threading, time
+from typing import Dict, List, Optional
+
+from app.log_config import LOG_FORMAT
+from app.timing import rss_mb
+
+log = logging.getLogger(__name__)
+
+#
+# Production serving mode: a pre-forking launcher for uvicorn workers.
+#
+# The parent process imports the app and loads the spaCy models once, then forks the workers.
+# Model memory is shared copy-on-write between them instead of being loaded N times.
+# Workers are recycled gracefully after a number of requests or when exceeding an RSS threshold,
+# the parent replaces every worker that exits. Workers that crash (exit non-zero) shortly after starting
+# are replaced with an exponential backoff, so e.g. a startup error doesn't turn into a fork loop.
+#
+# Configured by environment variables (see serve_from_env):
+#
+# - **HOST**, **PORT** Where to listen (default: 0.0.0.0:5000)
+# - **WEB_CONCURRENCY** Number of worker processes (default: number of CPUs)
+# - **PRELOAD_MODELS** spaCy models to load in the parent before forking (default: WARMUP_MODELS)
+# - **MAX_REQUESTS** Recycle a worker after this many requests, 0 to disable (default: 0)
+# - **MAX_RSS_MB** Recycle a worker when its resident memory exceeds this, 0 to disable (default: 0)
+#
+
+
+class PreforkServer(object):
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 5000,
+        workers: int = 1,
+        preload_models: Optional[List[str]] = None,
+        max_requests: int = 0,
+        max_rss_mb: float = 0,
+        log_level: str = "info",
+        restart_backoff: float = 1.0,
+        max_restart_backoff: float = 60.0,
+        min_uptime: float = 30.0,
+    ) -> None:
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.preload_models = preload_models
+        self.max_requests = max_requests
+        self.max_rss_mb = max_rss_mb
+        self.log_level = log_level
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        # Workers crashing before running this long count as failed starts
+        self.min_uptime = min_uptime
+
+        # worker pid -> worker slot (0..workers-1)
+        self._children: Dict[int, int] = {}
+        # worker pid -> start time (monotonic)
+        self._started: Dict[int, float] = {}
+        # worker slot -> consecutive failed starts
+        self._failures: Dict[int, int] = {}
+        # worker slot -> when to start its replacement (monotonic)
+        self._restarts: Dict[int, float] = {}
+        self._stopping = False
+        self._socket: Optional[socket.socket] = None
+
+    def run(self) -> None:
+        # The parent logs directly: the queue-based logging is set up in the workers (on startup),
+        # as its writer thread would not survive the fork.
+        handler = logging.StreamHandler(stream=sys.stderr)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+
+        # Import the app and load the models *before* forking, so the workers share that memory
+        from app import api, startup
+
+        started = time.perf_counter()
+        startup.warmup(self.preload_models)
+        log.info(f"Preloaded models in {time.perf_counter() - started:.1f}s")
+
+        # Move everything loaded so far out of the GC's reach,
+        # so collections in the workers don't touch (and copy) the shared pages.
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(2048)
+        self._socket.set_inheritable(True)
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+
+        log.info(f"Starting {self.workers} workers on {self.host}:{self.port}")
+        for slot in range(self.workers):
+            self._spawn(api, slot)
+
+        while self._children or self._restarts:
+            self._spawn_due(api)
+            try:
+                # Don't block while replacements are waiting for their backoff
+                pid, status = os.waitpid(-1, os.WNOHANG if self._restarts else 0)
+            except ChildProcessError:
+                if not self._restarts:
+                    break
+                pid = 0
+            except InterruptedError:
+                continue
+
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+
+            slot = self._children.pop(pid, None)
+            started = self._started.pop(pid, None)
+            if slot is None:
+                continue
+            if not self._stopping:
+                uptime = time.monotonic() - started if started is not None else 0.0
+                delay = self._restart_delay(slot, status, uptime)
+                log.info(
+                    f"Worker {pid} exited ({status}), starting a replacement"
+                    + (f" in {delay:.1f}s" if delay else "")
+                )
+                self._restarts[slot] = time.monotonic() + delay
+
+        self._socket.close()
+        log.info("All workers stopped")
+
+    def _restart_delay(self, slot: int, status: int, uptime: float) -> float:
+        """
+        Seconds to wait before replacing the worker of a slot: none after a clean exit (recycling)
+        or a long run, doubling with every consecutive failed start otherwise
+        """
+        if status == 0 or uptime >= self.min_uptime:
+            self._failures.pop(slot, None)
+            return 0.0
+        failures = self._failures[slot] = self._failures.get(slot, 0) + 1
+        return min(self.max_restart_backoff, self.restart_backoff * 2 ** (failures - 1))
+
+    def _spawn_due(self, api) -> None:
+        now = time.monotonic()
+        for slot, due in list(self._restarts.items()):
+            if due <= now and not self._stopping:
+                del self._restarts[slot]
+                self._spawn(api, slot)
+
+    def _handle_stop(self, signum, frame) -> None:
+        self._stopping = True
+        self._restarts.clear()
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _spawn(self, api, slot: int) -> None:
+        pid = os.fork()
+        if pid:
+            self._children[pid] = slot
+            self._started[pid] = time.monotonic()
+            return
+
+        # In the worker process
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            os.environ["SERVER_WORKER_SLOT"] = str(slot)
+            self._serve(api)
+        except BaseException as e:
+            log.error(f"Worker {os.getpid()} failed: {e}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def _serve(self, api) -> None:
+        import uvicorn
+
+        config = uvicorn.Config(
+            api,
+            log_level=self.log_level,
+            log_config=None,
+            limit_max_requests=self._request_limit(),
+        )
+        server = uvicorn.Server(config)
+
+        if self.max_rss_mb:
+            threading.Thread(
+                target=self._watch_rss, args=(server,), name="rss-watch", daemon=True
+            ).start()
+
+        server.run(sockets=[self._socket])
+
+    def _request_limit(self) -> Optional[int]:
+        """
+        Requests until the worker is recycled, None for no limit
+        """
+        if not self.max_requests:
+            return None
+        # Some jitter, so the workers don't all recycle at the same time
+        return self.max_requests + random.randint(0, self.max_requests // 10)
+
+    def _watch_rss(self, server) -> None:
+        while not server.should_exit:
+            time.sleep(5)
+            if rss_mb() > self.max_rss_mb:
+                log.info(
+                    f"Worker {os.getpid()} exceeds {self.max_rss_mb:.0f} MB RSS, recycling"
+                )
+                # Graceful: stops accepting, finishes in-flight requests
+                server.should_exit = True
+
+
+def worker_slot() -> Optional[int]:
+    """
+    Slot of this worker process (0..WEB_CONCURRENCY-1) in production mode, None otherwise.
+    Used to run singletons (like the prefetcher) in one worker only.
+    """
+    slot = os.getenv("SERVER_WORKER_SLOT")
+    return int(slot) if slot is not None else None
+
+
+def serve_from_env() -> None:
+    models = os.getenv("PRELOAD_MODELS", os.getenv("WARMUP_MODELS", ""))
+    PreforkServer(
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", 5000)),
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        preload_models=[m.strip() for m in models.split(",") if m.strip()],
+        max_requests=int(os.getenv("MAX_REQUESTS", 0)),
+        max_rss_mb=float(os.getenv("MAX_RSS_MB", 0)),
+        log_level=os.getenv("LOGLEVEL", "info").lower(),
+    ).run()
@@ -0,0 +1,230 @@
+import logging, os, secrets, struct, threading, time
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+import orjson
+from fastapi.exceptions import HTTPException
+
+from app.api_models import AnalyzeResponse, NounChunk
+from app.cache import SHARED_STORE
+from app.model_registry import MODELS
+from app.result_store import ResultStore
+from app.startup import lazy_import
+from app.timing import timed
+
+log = logging.getLogger(__name__)
+
+spacy_tokens = lazy_import("spacy.tokens")
+
+#
+# Analysis sessions: the AnalyzeResponse and the parsed spaCy Doc (serialized as DocBin) of an /analyze request,
+# kept under an ID. Downstream endpoints (/render, /translate, /search) accept the ID instead of the full text or analysis,
+# and noun chunks are derived from the stored Doc on demand, without parsing again.
+#
+# Sessions expire after SESSION_TTL seconds. The oldest are evicted when they take more than SESSION_MAX_MB.
+# If a shared result store is configured (see app/result_store.py), sessions are kept there, too,
+# so any worker or replica can serve them.
+#
+SESSION_TTL = float(os.getenv("SESSION_TTL", 1800))
+SESSION_MAX_MB = float(os.getenv("SESSION_MAX_MB", 256))
+
+
+class AnalysisSession(object):
+    def __init__(
+        self,
+        id: str,
+        analysis: AnalyzeResponse,
+        doc_bytes: Optional[bytes] = None,
+        expires: Optional[float] = None,
+    ) -> None:
+        super().__init__()
+        self.id = id
+        self.analysis = analysis
+        self.doc_bytes = doc_bytes
+        self.expires = expires if expires is not None else time.time() + SESSION_TTL
+
+    @property
+    def model_name(self) -> str:
+        return f"{self.analysis.language}_{self.analysis.model}"
+
+    @property
+    def size(self) -> int:
+        # Approximation: the serialized Doc, plus the text (and about as much for the analysis objects)
+        return len(self.doc_bytes or b"") + 2 * len(self.analysis.text or "")
+
+    def doc(self) -> "spacy.tokens.Doc":
+        """
+        The analyzed Doc. Parsed again (once) if it wasn't kept, e.g. for analyses served from cache.
+        """
+        nlp = MODELS.get(self.model_name)
+        if self.doc_bytes is None:
+            with timed("nlp", model=self.model_name):
+                doc = nlp(self.analysis.text or "")
+            self.doc_bytes = to_doc_bytes(doc)
+            return doc
+        doc_bin = spacy_tokens.DocBin().from_bytes(self.doc_bytes)
+        return next(doc_bin.get_docs(nlp.vocab))
+
+    # Serialized: length of the JSON header, JSON header (analysis, expiry), DocBin bytes
+    HEADER = struct.Struct("!I")
+
+    def to_bytes(self) -> bytes:
+        header = orjson.dumps({"analysis": self.analysis.dict(), "expires": self.expires})
+        return self.HEADER.pack(len(header)) + header + (self.doc_bytes or b"")
+
+    @classmethod
+    def from_bytes(cls, id: str, data: bytes) -> "AnalysisSession":
+        (length,) = cls.HEADER.unpack_from(data)
+        header = orjson.loads(data[cls.HEADER.size : cls.HEADER.size + length])
+        doc_bytes = data[cls.HEADER.size + length :] or None
+        return cls(
+            id,
+            AnalyzeResponse.parse_obj(header["analysis"]),
+            doc_bytes=doc_bytes,
+            expires=header["expires"],
+        )
+
+
+def to_doc_bytes(doc) -> bytes:
+    # DocBin keeps all token annotations (tags, dependencies, entities, sentences), compressed
+    doc_bin = spacy_tokens.DocBin(store_user_data=False)
+    doc_bin.add(doc)
+    return doc_bin.to_bytes()
+
+
+class SessionStore(object):
+    """
+    Sessions of this worker (LRU, bounded by memory and TTL), and optionally in the shared result store
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl: float = SESSION_TTL,
+        store: Optional[ResultStore] = None,
+    ) -> None:
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = store
+        self._sessions: "OrderedDict[str, AnalysisSession]" = OrderedDict()
+        # Sizes as accounted when the sessions were put
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def create(self, analysis: AnalyzeResponse, doc=None) -> AnalyzeResponse:
+        """
+        Keeps an analysis (and its Doc) as new session. Returns the analysis with the session_id set.
+        """
+        session_id = secrets.token_urlsafe(16)
+        analysis = analysis.copy(update={"session_id": session_id})
+        session = AnalysisSession(
+            session_id,
+            analysis,
+            doc_bytes=to_doc_bytes(doc) if doc is not None else None,
+            expires=time.time() + self.ttl,
+        )
+        self._put(session)
+        self._save(session)
+        return analysis
+
+    def get(self, session_id: str) -> AnalysisSession:
+        """
+        The session, raises 404 if it doesn't exist (anymore)
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                if session.expires < time.time():
+                    self._remove(session_id)
+                    session = None
+                else:
+                    self._sessions.move_to_end(session_id)
+
+        if session is None and self.store is not None:
+            try:
+                data = self.store.get(self._key(session_id))
+                if data is not None:
+                    session = AnalysisSession.from_bytes(session_id, data)
+                    self._put(session)
+            except Exception as e:
+                log.warning(f"Unable to get session from the result store: {e}")
+
+        if session is None or session.expires < time.time():
+            raise HTTPException(404, f"Unknown or expired session '{session_id}'")
+        return session
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._remove(session_id)
+        if self.store is not None:
+            try:
+                self.store.delete(self._key(session_id))
+            except Exception as e:
+                log.warning(f"Unable to delete session from the result store: {e}")
+
+    def noun_chunks(self, session_id: str) -> List[NounChunk]:
+        """
+        Noun chunks of the analyzed text, from the stored Doc
+        """
+        session = self.get(session_id)
+        had_doc = session.doc_bytes is not None
+        doc = session.doc()
+        if not had_doc:
+            # Parsed now, keep the Doc for the next time
+            self._put(session)
+            self._save(session)
+        try:
+            chunks = list(doc.noun_chunks)
+        except (NotImplementedError, ValueError):
+            # No syntax iterator or parser for this language/model
+            chunks = []
+        return [
+            NounChunk.construct(text=chunk.text, start=chunk.start_char, end=chunk.end_char)
+            for chunk in chunks
+        ]
+
+    def keywords(self, session_id: str, limit: int = 5) -> List[str]:
+        """
+        The keywords of a session's analysis, e.g. as search query.
+        For analyses without keywords: the most frequent health entities (or, without those, noun chunks).
+        """
+        session = self.get(session_id)
+        if session.analysis.keywords:
+            return session.analysis.keywords[:limit]
+        spans = session.analysis.health_entities or self.noun_chunks(session_id)
+        counts = Counter(span.text.lower() for span in spans)
+        return [text for text, _ in counts.most_common(limit)]
+
+    def _key(self, session_id: str) -> str:
+        return f"summed:session:{session_id}"
+
+    def _put(self, session: AnalysisSession) -> None:
+        with self._lock:
+            self._remove(session.id)
+            self._sessions[session.id] = session
+            self._sizes[session.id] = session.size
+            self._bytes += session.size
+            while self._bytes > self.max_bytes and len(self._sessions) > 1:
+                oldest = next(iter(self._sessions))
+                self._remove(oldest)
+
+    def _remove(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+        self._bytes -= self._sizes.pop(session_id, 0)
+
+    def _save(self, session: AnalysisSession) -> None:
+        if self.store is None:
+            return
+        try:
+            self.store.set(
+                self._key(session.id),
+                session.to_bytes(),
+                ttl=max(session.expires - time.time(), 1),
+            )
+        except Exception as e:
+            log.warning(f"Unable to save session to the result store: {e}")
+
+
+SESSIONS = SessionStore(max_bytes=int(SESSION_MAX_MB * 1024 * 1024), store=SHARED_STORE)
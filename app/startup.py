@@ -0,0 +1,190 @@
+import builtins, importlib, logging, os, sys, threading, time
+from types import ModuleType
+from typing import Dict, List, Optional
+
+#
+# Startup time measurement and lazy loading of heavy dependencies.
+#
+# - ImportTimer measures which modules dominate the import of the app (see app/__init__.py)
+# - lazy_import() defers heavy imports (spaCy, sumy, newspaper...) until they are first used
+# - warmup() loads them (and the default models) explicitly, e.g. before serving requests
+#
+# Note: this module must not import anything heavy itself.
+#
+
+log = logging.getLogger(__name__)
+
+# Set when the "app" package started importing (see app/__init__.py)
+IMPORT_STARTED: Optional[float] = None
+# Seconds it took to import the app
+IMPORT_SECONDS: Optional[float] = None
+# Seconds from the start of the import until the startup events completed
+STARTUP_SECONDS: Optional[float] = None
+
+# Startup time budget in seconds. Exceeding it is logged as warning.
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", 10))
+
+# Import times of lazy modules, by module name
+LAZY_IMPORT_SECONDS: Dict[str, float] = {}
+
+
+class ImportTimer(object):
+    """
+    Context manager timing every module imported (via import statements) while active.
+    Records inclusive and self time (excluding nested imports) per module.
+    """
+
+    def __init__(self) -> None:
+        self.modules: Dict[str, Dict[str, float]] = {}
+        self._local = threading.local()
+        self._original_import = None
+
+    def __enter__(self) -> "ImportTimer":
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+        return self
+
+    def __exit__(self, *exc) -> None:
+        builtins.__import__ = self._original_import
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level != 0 or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            inclusive = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += inclusive
+            self.modules.setdefault(name, {"inclusive": inclusive, "self": inclusive - nested})
+
+    def report(self, top: int = 20) -> dict:
+        """
+        The modules and top-level packages with the highest (self) import times
+        """
+        packages: Dict[str, float] = {}
+        for name, times in self.modules.items():
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0.0) + times["self"]
+
+        slowest = sorted(self.modules.items(), key=lambda m: m[1]["self"], reverse=True)
+        return {
+            "packages": dict(
+                sorted(packages.items(), key=lambda p: p[1], reverse=True)[:top]
+            ),
+            "modules": [
+                {"module": name, "self_seconds": t["self"], "inclusive_seconds": t["inclusive"]}
+                for name, t in slowest[:top]
+            ],
+        }
+
+
+IMPORT_TIMER = ImportTimer()
+
+
+class LazyModule(ModuleType):
+    """
+    A module that is imported on first attribute access
+    """
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self._lazy_module: Optional[ModuleType] = None
+        self._lazy_lock = threading.Lock()
+
+    def _load(self) -> ModuleType:
+        with self._lazy_lock:
+            if self._lazy_module is None:
+                start = time.perf_counter()
+                self._lazy_module = importlib.import_module(self.__name__)
+                LAZY_IMPORT_SECONDS[self.__name__] = time.perf_counter() - start
+                log.info(
+                    f"Imported '{self.__name__}' in {LAZY_IMPORT_SECONDS[self.__name__]:.2f}s"
+                )
+        return self._lazy_module
+
+    def __getattr__(self, attribute: str):
+        if attribute.startswith("_lazy"):
+            raise AttributeError(attribute)
+        return getattr(self._lazy_module or self._load(), attribute)
+
+
+# All lazy modules, by name
+LAZY_MODULES: Dict[str, LazyModule] = {}
+
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    Returns a placeholder for the module `name`, which imports it on first use.
+    """
+    if name not in LAZY_MODULES:
+        LAZY_MODULES[name] = LazyModule(name)
+    return LAZY_MODULES[name]
+
+
+def warmup(models: Optional[List[str]] = None) -> None:
+    """
+    Imports all lazy modules and loads the given spaCy models (default: WARMUP_MODELS),
+    so the first requests don't have to.
+    """
+    for module in list(LAZY_MODULES.values()):
+        module._load()
+
+    if models is None:
+        models = [m.strip() for m in os.getenv("WARMUP_MODELS", "").split(",") if m.strip()]
+
+    from app.textanalyzer import TextAnalyzer
+
+    for model_name in models:
+        TextAnalyzer("", None, None)._getSpacyLanguage(model_name)
+
+    # The document type classifier, if installed
+    from app.doctypes import CLASSIFIER
+
+    CLASSIFIER.load()
+
+    # The medical gazetteer (compiled first, if the terminology list changed)
+    from app.gazetteer import get_gazetteer
+
+    get_gazetteer()
+
+    # The IDF table for keywords (memory-mapped)
+    from app.keywords import get_idf_table
+
+    get_idf_table()
+
+
+def startup_completed() -> None:
+    """
+    Records the startup time, and warns if it exceeds the budget
+    """
+    global STARTUP_SECONDS
+    if IMPORT_STARTED is None:
+        return
+    STARTUP_SECONDS = time.perf_counter() - IMPORT_STARTED
+    message = f"Startup took {STARTUP_SECONDS:.2f}s (import: {IMPORT_SECONDS:.2f}s)"
+    if STARTUP_SECONDS > STARTUP_BUDGET_SECONDS:
+        slowest = list(IMPORT_TIMER.report(top=5)["packages"].items())
+        log.warning(
+            f"{message}, exceeding the budget of {STARTUP_BUDGET_SECONDS:.1f}s. Slowest imports: {slowest}"
+        )
+    else:
+        log.info(message)
+
+
+def startup_report() -> dict:
+    return {
+        "import_seconds": IMPORT_SECONDS,
+        "startup_seconds": STARTUP_SECONDS,
+        "budget_seconds": STARTUP_BUDGET_SECONDS,
+        "imports": IMPORT_TIMER.report(),
+        "lazy_imports": dict(LAZY_IMPORT_SECONDS),
+    }
@@ -0,0 +1,185 @@
+import logging, math, os, time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+from app.api_models import Sentence, SummarizerEngine
+from app.startup import LazyModule, lazy_import
+from app.timing import timed
+
+log = logging.getLogger(__name__)
+
+# Heavy dependencies are imported on first use (or during warmup), see app/startup.py
+fuzz = lazy_import("fuzzywuzzy.fuzz")
+sumy_plaintext = lazy_import("sumy.parsers.plaintext")
+sumy_tokenizers = lazy_import("sumy.nlp.tokenizers")
+sumy_lex_rank = lazy_import("sumy.summarizers.lex_rank")
+sumy_text_rank = lazy_import("sumy.summarizers.text_rank")
+sumy_lsa = lazy_import("sumy.summarizers.lsa")
+
+#
+# Summarizers (sentence rankers) for the "top sentences" of an analysis.
+#
+# - **lexrank**, **textrank** (sumy) Build a sentence similarity graph, quadratic in the number of sentences
+# - **lsa** (sumy) SVD of the term/sentence matrix
+# - **centroid** Similarity of each sentence to the term frequency centroid of the document, linear time
+#
+# With "auto" (SUMMARIZER=auto, or per request), the first engine in SUMMARIZER_PREFERENCE order whose
+# estimated duration for the number of sentences fits in SUMMARIZER_BUDGET_MS is used. Estimates start from
+# conservative defaults and follow the measured durations.
+#
+SUMMARIZER = os.getenv("SUMMARIZER", "auto")
+SUMMARIZER_BUDGET_MS = float(os.getenv("SUMMARIZER_BUDGET_MS", 250))
+SUMMARIZER_PREFERENCE = [
+    name.strip()
+    for name in os.getenv("SUMMARIZER_PREFERENCE", "lexrank,textrank,lsa,centroid").split(",")
+    if name.strip()
+]
+AUTO = SummarizerEngine.auto.value
+
+
+class Summarizer(object):
+    """
+    A sentence ranking engine, with a cost model of seconds_per_unit * sentences ** exponent
+    """
+
+    # Weight of a new measurement in the estimate (exponentially weighted moving average)
+    ewma_alpha = 0.2
+
+    def __init__(
+        self,
+        name: str,
+        rank: Callable[[List[Sentence], int, str], List[Sentence]],
+        exponent: float,
+        seconds_per_unit: float,
+    ) -> None:
+        super().__init__()
+        self.name = name
+        self.rank = rank
+        self.exponent = exponent
+        self.seconds_per_unit = seconds_per_unit
+
+    def estimate(self, sentences: int) -> float:
+        return self.seconds_per_unit * max(sentences, 1) ** self.exponent
+
+    def observe(self, sentences: int, seconds: float) -> None:
+        if sentences < 10:
+            # Dominated by fixed overhead, says little about larger documents
+            return
+        per_unit = seconds / sentences ** self.exponent
+        self.seconds_per_unit += self.ewma_alpha * (per_unit - self.seconds_per_unit)
+
+    def __call__(
+        self, sentences: List[Sentence], num_sentences: int, language: str
+    ) -> List[Sentence]:
+        started = time.perf_counter()
+        with timed("summarize", engine=self.name):
+            ranked = self.rank(sentences, num_sentences, language)
+        self.observe(len(sentences), time.perf_counter() - started)
+        return ranked
+
+
+def _sumy_ranker(module: LazyModule, class_name: str):
+    """
+    Ranks with a sumy summarizer, on the lemmatized sentences.
+    """
+
+    def rank(sentences: List[Sentence], num_sentences: int, language: str):
+        #  spaCy and Sumy use different tokenizers, so they may do sentencizing slightly differently.
+        #  When we compare "lemmatized" versions, they may not match 1:1 because of that,
+        #  so unless we do a Sumy Parser implementation using the spaCy token/sentences
+        # we may need to do a "fuzzy" match to find the original sentence with the "lemma" matching the summary sentence
+        summarizer = getattr(module, class_name)()
+        doc = "\n".join(s.lemmatized_text for s in sentences)
+        parser = sumy_plaintext.PlaintextParser.from_string(
+            doc, sumy_tokenizers.Tokenizer(language)
+        )
+
+        ranked = []
+        for lemma_sentence in summarizer(parser.document, num_sentences):
+            summary_lemma = str(lemma_sentence).strip()
+            for original in sentences:
+                if fuzz.ratio(summary_lemma, original.lemmatized_text.strip()) >= 80:
+                    ranked.append(original)
+                    break
+        return ranked
+
+    return rank
+
+
+def _terms(sentence: Sentence) -> List[str]:
+    # Lemmatized text has the stopwords removed already, we drop punctuation
+    return [
+        term
+        for term in (sentence.lemmatized_text or sentence.text).lower().split()
+        if any(c.isalnum() for c in term)
+    ]
+
+
+def centroid_rank(
+    sentences: List[Sentence], num_sentences: int, language: str
+) -> List[Sentence]:
+    """
+    Ranks sentences by cosine similarity (tf-idf) to the centroid of the document.
+    Linear in the number of terms, and it works on the spaCy sentences directly (no re-parsing, no fuzzy matching).
+    """
+    counts = [Counter(_terms(s)) for s in sentences]
+    frequency = Counter()
+    for c in counts:
+        frequency.update(c.keys())
+    idf = {t: math.log(len(sentences) / df) + 1 for t, df in frequency.items()}
+
+    centroid = Counter()
+    for c in counts:
+        for t, n in c.items():
+            centroid[t] += n * idf[t]
+    centroid_norm = math.sqrt(sum(v * v for v in centroid.values())) or 1
+
+    scores = []
+    for c in counts:
+        weights = {t: n * idf[t] for t, n in c.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        dot = sum(w * centroid[t] for t, w in weights.items())
+        scores.append(dot / (norm * centroid_norm) if norm else 0.0)
+
+    top = sorted(range(len(sentences)), key=scores.__getitem__, reverse=True)
+    ranked = []
+    # Keep the order of the document
+    for i in sorted(top[:num_sentences]):
+        sentences[i].score = scores[i]
+        ranked.append(sentences[i])
+    return ranked
+
+
+SUMMARIZERS: Dict[str, Summarizer] = {
+    s.name: s
+    for s in (
+        Summarizer("lexrank", _sumy_ranker(sumy_lex_rank, "LexRankSummarizer"), 2, 2e-6),
+        Summarizer("textrank", _sumy_ranker(sumy_text_rank, "TextRankSummarizer"), 2, 2e-6),
+        Summarizer("lsa", _sumy_ranker(sumy_lsa, "LsaSummarizer"), 2, 1e-6),
+        Summarizer("centroid", centroid_rank, 1, 5e-5),
+    )
+}
+
+
+def choose_summarizer(
+    sentences: int, engine: Optional[str] = None, budget_ms: float = SUMMARIZER_BUDGET_MS
+) -> Summarizer:
+    """
+    The summarizer to use for a document of this many sentences.
+    engine: a name from SUMMARIZERS, or "auto" / None for the configured default.
+    Requests are validated already (AnalyzeRequest.summarizer), an unknown name is a configuration error.
+    """
+    engine = (engine or SUMMARIZER).lower()
+    if engine != AUTO:
+        if engine not in SUMMARIZERS:
+            raise ValueError(
+                f"Unknown summarizer '{engine}', use one of: {AUTO}, {', '.join(SUMMARIZERS)}"
+            )
+        return SUMMARIZERS[engine]
+
+    candidates = [SUMMARIZERS[n] for n in SUMMARIZER_PREFERENCE if n in SUMMARIZERS]
+    for summarizer in candidates:
+        if summarizer.estimate(sentences) * 1000 <= budget_ms:
+            return summarizer
+    # Nothing fits, take the fastest for this size
+    return min(candidates or SUMMARIZERS.values(), key=lambda s: s.estimate(sentences))
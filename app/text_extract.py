@@ -1,10 +1,27 @@
+from typing import BinaryIO
 from requests.models import Response
 from app.api_models import ExtractResponse
+from app.doctypes import CLASSIFIER, DOCTYPE_DEFAULT_CLASS
+from app.timing import timed, upstream
 import requests
-import newspaper, re
+import re, codecs
+
+from app.startup import lazy_import
+
+# Heavy dependencies are imported on first use (or during warmup), see app/startup.py
+newspaper = lazy_import("newspaper")
 
 # simple language detector
-from langdetect import detect as detect_language
+langdetect = lazy_import("langdetect")
+
+# Media types extract_file_storage can extract text from
+SUPPORTED_MEDIATYPES = ("text/plain", "text/html")
+
+
+class UnsupportedMediaType(ValueError):
+    """
+    The media type of a document is not supported for extraction
+    """
 
 
 class Extractor(object):
@@ -26,7 +43,8 @@ class Extractor(object):
 
     def extract_webpage(self, url: str, options: dict = {}) -> ExtractResponse:
         """
-        Extracts text + metadata from a url pointing to a HTML
+        Extracts text + metadata from a url pointing to a HTML.
+        With options["classify"] False, the document type is left for the caller to classify (in a batch).
         """
         # session = requests.Session()
         # TODO support auth/login through  options {}
@@ -35,13 +53,15 @@ class Extractor(object):
         # https://newspaper.readthedocs.io/en/latest/
 
         article = newspaper.Article(url=url)
-        article.download()
-        article.parse()
+        with upstream("extract_download"):
+            article.download()
+        with timed("extract_parse"):
+            article.parse()
         text = article.text
 
         meta = {}
-        language = detect_language(text) or "en"
-        doc_class = "article"
+        language = langdetect.detect(text) or "en"
+        doc_class = DOCTYPE_DEFAULT_CLASS
         mediatype = "text/html"
 
         response = ExtractResponse(
@@ -54,12 +74,54 @@ class Extractor(object):
                 "metadata": meta,
             }
         )
+        if options.get("classify", True):
+            CLASSIFIER.apply([response])
 
         return response
 
-    def extract_file_storage(url: str, options: dict = {}) -> ExtractResponse:
+    def extract_file_storage(
+        self, file: BinaryIO, mediatype: str, options: dict = {}
+    ) -> ExtractResponse:
         """
         Extract from a file that exists in internal (file) storage,
         e.g has been uploaded there first.
+
+        The file is decoded in chunks, so only the extracted text is kept in memory.
+        Supported media types: text/plain, text/html (raises UnsupportedMediaType otherwise)
         """
-        pass
+        mediatype = (mediatype or "text/plain").split(";")[0].strip().lower()
+        if mediatype not in SUPPORTED_MEDIATYPES:
+            raise UnsupportedMediaType(f"Unsupported media type for extraction: '{mediatype}'")
+
+        encoding = options.get("encoding") or "utf-8"
+        chunk_size = options.get("chunk_size") or 64 * 1024
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        parts = []
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            parts.append(decoder.decode(chunk))
+        parts.append(decoder.decode(b"", final=True))
+        text = "".join(parts)
+
+        if mediatype == "text/html":
+            # Let newspaper parse the html we already have, instead of downloading it
+            article = newspaper.Article(url=options.get("sourceUrl") or "")
+            article.download(input_html=text)
+            article.parse()
+            text = article.text
+
+        language = langdetect.detect(text) if text.strip() else "en"
+
+        response = ExtractResponse(
+            **{
+                "sourceUrl": options.get("sourceUrl") or "",
+                "language": language,
+                "text": text,
+                "document_class": DOCTYPE_DEFAULT_CLASS,
+                "mediatype": mediatype,
+                "metadata": options.get("metadata") or {},
+            }
+        )
+        if options.get("classify", True):
+            CLASSIFIER.apply([response])
+
+        return response
@@ -1,28 +1,20 @@
-from typing import List
+from typing import List, Optional
 from warnings import simplefilter
 from app.api_models import NamedEntity, Sentence
-import os, json, logging, tempfile, re
+from app.timing import timed, upstream
+import bisect, itertools, os, json, logging, tempfile, re
 import requests
 from pprint import pprint
 
-from fuzzywuzzy import fuzz
-
-
-# Azure Text Analytics
-from azure.core.credentials import AzureKeyCredential
-from azure.ai.textanalytics import TextAnalyticsClient
-
-# Sumy summarizer
-from sumy.parsers.plaintext import PlaintextParser
-from sumy.nlp.tokenizers import Tokenizer
-
-# from sumy.summarizers.lsa import LsaSummarizer as Summarizer
-# from sumy.summarizers.text_rank import TextRankSummarizer as Summarizer
-from sumy.summarizers.lex_rank import LexRankSummarizer as Summarizer
+from app.gazetteer import get_gazetteer
+from app.model_registry import MODELS
+from app.summarizers import choose_summarizer
+from app.startup import lazy_import
 
+# Heavy dependencies are imported on first use (or during warmup), see app/startup.py
 
 # simple language detector
-from langdetect import detect as detect_language
+langdetect = lazy_import("langdetect")
 
 
 # Init logging
@@ -31,10 +23,35 @@ import logging
 log = logging.getLogger(__name__)
 
 # Spacy and lang models
-import spacy
-
-# Languages should be only instatiated once per process, so we keep them here...
-SPACY_LANGUAGE_INSTANCES = {}
+spacy = lazy_import("spacy")
+
+# Where health entities come from: "gazetteer" (in-process) and/or "ta4h" (Azure, if configured)
+HEALTH_ENTITY_SOURCES = [
+    source.strip().lower()
+    for source in os.getenv("HEALTH_ENTITY_SOURCES", "gazetteer,ta4h").split(",")
+]
+
+# Text Analytics for Health accepts documents up to this size, longer texts are sent as several documents
+TA4H_CHUNK_SIZE = 5120
+
+
+def merge_entities(
+    preferred: List[NamedEntity], others: List[NamedEntity]
+) -> List[NamedEntity]:
+    """
+    Merges two lists of entities (sorted by start), taking those of others only where they
+    don't overlap any of preferred (which may overlap each other, e.g. nested TA4H entities)
+    """
+    starts = [e.start for e in preferred]
+    # Largest end of the preferred entities up to each index
+    max_ends = list(itertools.accumulate((e.end for e in preferred), max))
+    kept = []
+    for entity in others:
+        # The preferred entities starting before this one ends overlap it, if one of them ends after it starts
+        i = bisect.bisect_left(starts, entity.end)
+        if i == 0 or max_ends[i - 1] <= entity.start:
+            kept.append(entity)
+    return sorted(preferred + kept, key=lambda e: e.start)
 
 
 class TextAnalyzer(object):
@@ -42,6 +59,7 @@ class TextAnalyzer(object):
     text: str = None
     language: str = None
     model: str = None
+    summarizer: str = None
 
     _azure_ta4h_endpoint: str = None
     _azure_ta4h_apikey: str = None
@@ -61,16 +79,12 @@ class TextAnalyzer(object):
         return nlp
 
     #
-    # manages SPACY_LANGUAGE_INSTANCES (e.g. spacy.Language singletons).
-    # This makes sure loaded spacy.Language models are reused
+    # Loaded spacy.Language models are reused, and kept within the memory budget, by the model registry
+    # (see app/model_registry.py)
     #
-    def _getSpacyLanguage(self, model_name: str) -> spacy.Language:
-        if not SPACY_LANGUAGE_INSTANCES.get(model_name):
-            log.info(f"Loading languge model: '{model_name}' ...")
-            SPACY_LANGUAGE_INSTANCES[model_name] = spacy.load(model_name)
-
-        log.info(f"Using language model: '{model_name}' ...")
-        return SPACY_LANGUAGE_INSTANCES[model_name]
+    def _getSpacyLanguage(self, model_name: str) -> "spacy.Language":
+        log.debug(f"Using language model: '{model_name}' ...")
+        return MODELS.get(model_name)
 
     #
     # Construct the correct  spaCy model name to use with spacy.load(...)
@@ -80,7 +94,8 @@ class TextAnalyzer(object):
     def _getSpacyModelName(self):
         if not self.language or self.language.lower() == "detect":
             # Detect most probable laguage code from input text
-            self.language = detect_language(self.text)[:2].lower()
+            with timed("language_detection"):
+                self.language = langdetect.detect(self.text)[:2].lower()
         if not self.model or self.model.lower() == "default":
             if self.language == "en":
                 self.model = "core_web_sm"
@@ -88,37 +103,45 @@ class TextAnalyzer(object):
                 self.model = "core_news_sm"
 
         # At this point we should have a valid, two-char language code, plus a 'model' shortname.
-        # For default spaCy languages, just join them together, e.g. "de_core_news_sm"
-        # TODO for our specialized languages, we may do something differently here (e.g. resolve to a path)
+        # Just join them together, e.g. "de_core_news_sm". The model registry resolves
+        # the names of our specialized models (e.g. to a path), see SPACY_MODELS
         name = f"{self.language}_{self.model}"
         return name
 
     #
-    # Calls Azure Text Analytics for health on the input text.
+    # Calls Azure Text Analytics for health on the input texts, all of them in one request.
+    # Documents are identified as "<index of the text>.<index of the chunk>"
     # Note: This is a poentially longrunning operation
     #
-    def _azure_text_analytics_for_health(self, text: str, language: str = "en"):
+    def _azure_text_analytics_for_health(self, texts: List[str], language: str = "en"):
 
         headers = {}
         url = (
             f"{self._azure_ta4h_endpoint}/text/analytics/v3.1-preview.4/entities/health"
         )
 
-        chunk_size = 5120
-        chunks = [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+        chunk_size = TA4H_CHUNK_SIZE
         doc_array = [
-            {"id": idx, "language": language, "text": chunk}
-            for idx, chunk in enumerate(chunks)
+            {
+                "id": f"{idx}.{i // chunk_size}",
+                "language": language,
+                "text": text[i : i + chunk_size],
+            }
+            for idx, text in enumerate(texts)
+            for i in range(0, len(text), chunk_size)
         ]
+        if not doc_array:
+            return []
 
         json_doc = {"documents": doc_array}
         log.info("Calling Azure Text Analytics for Health (TA4H)...")
-        resp = requests.post(
-            url,
-            headers=headers,
-            json=json_doc,
-        )
-        resp.raise_for_status()
+        with upstream("ta4h"):
+            resp = requests.post(
+                url,
+                headers=headers,
+                json=json_doc,
+            )
+            resp.raise_for_status()
         log.info("done.")
 
         result = []
@@ -128,84 +151,87 @@ class TextAnalyzer(object):
 
         return result
 
+    #
+    # Identifies the "medical" entities: in-process, with the medical gazetteer (see app/gazetteer.py),
+    # and/or using Azure Text Analytics for Health, if configured (see HEALTH_ENTITY_SOURCES).
+    # Where both found an entity, the one of TA4H is kept.
+    # TA4H entities requested before (e.g. for several texts at once) are passed as ta4h_entities.
+    #
+    def get_health_entities(
+        self, text: str, doc=None, ta4h_entities: Optional[List[NamedEntity]] = None
+    ) -> List[NamedEntity]:
+        entities = []
+        if "gazetteer" in HEALTH_ENTITY_SOURCES:
+            gazetteer = get_gazetteer()
+            if gazetteer is not None and gazetteer.language == self.language:
+                if doc is None:
+                    doc = self().make_doc(text)
+                entities = gazetteer(doc)
+
+        if self.uses_ta4h():
+            if ta4h_entities is None:
+                ta4h_entities = self.get_ta4h_entities(text)
+            entities = merge_entities(ta4h_entities, entities)
+
+        return entities
+
+    def uses_ta4h(self) -> bool:
+        return "ta4h" in HEALTH_ENTITY_SOURCES and bool(self._azure_ta4h_endpoint)
+
     #
     # Identifies the "medical" entities, using Azure Text analytics for Health
     #
-    def get_health_entities(self, text: str) -> List[NamedEntity]:
-        result = self._azure_text_analytics_for_health(text, self.language)
+    def get_ta4h_entities(self, text: str) -> List[NamedEntity]:
+        return self.get_ta4h_entities_batch([text])[0]
 
-        medical_entities = []
+    #
+    # Identifies the "medical" entities of several texts, with one call to Azure Text analytics for Health.
+    # Returns the entities of each text, with offsets relative to it
+    #
+    def get_ta4h_entities_batch(self, texts: List[str]) -> List[List[NamedEntity]]:
+        result = self._azure_text_analytics_for_health(texts, self.language)
+
+        entities_of_texts: List[List[NamedEntity]] = [[] for _ in texts]
 
         for doc in result:
             # log.info(json.dumps(doc, indent=4, sort_keys=True))
+            # Offsets are relative to the chunk we sent as document
+            idx, chunk = map(int, str(doc["id"]).split("."))
+            chunk_offset = chunk * TA4H_CHUNK_SIZE
+            medical_entities = entities_of_texts[idx]
 
             for entity in doc["entities"]:
 
-                ne = NamedEntity(
+                ne = NamedEntity.construct(
                     text=entity["text"],
                     definition=entity.get("name", ""),
-                    start=entity["offset"],
-                    end=entity["offset"] + entity["length"],
+                    start=chunk_offset + entity["offset"],
+                    end=chunk_offset + entity["offset"] + entity["length"],
                     label=entity["category"],
                 )
                 medical_entities.append(ne)
 
-        return medical_entities
+        for medical_entities in entities_of_texts:
+            medical_entities.sort(key=lambda e: e.start)
+        return entities_of_texts
 
     #
     # Returns the top-n ranked Sentences from the list.
     # Uses the "lemmatized" version of the text
     # Preserves the relative order from within the original document (e.g. it is *not* sorted by score)
     #
+    # The summarizer engine is chosen by the length of the document (see app/summarizers.py),
+    # unless requested explicitly. The engine used is kept in self.summarizer
+    #
     # Test URL: https://www.bcpp.org/resource/african-american-women-and-breast-cancer/
     #
     def top_sentences(
-        self, sentences: List[Sentence], num_sentences: int = 5, useLemma: bool = True
+        self, sentences: List[Sentence], num_sentences: int = 5, engine: str = None
     ) -> List[Sentence]:
 
-        text_sents = [s.text for s in sentences]
-        lemma_sents = [l.lemmatized_text for l in sentences]
-
-        ranked_sentences = []
-
-        # pprint(sentences)
-
-        summarizer = Summarizer()
-
-        if not useLemma:
-            doc = "\n".join(text_sents)
-
-            # TODO custom sumy DocumentParser ?
-            parser = PlaintextParser.from_string(doc, Tokenizer(self.language))
-
-            summary = summarizer(parser.document, num_sentences)
-
-            for summary_sentence in summary:
-                for original in sentences:
-                    if str(summary_sentence).strip() == original.text.strip():
-                        ranked_sentences.append(original)
-                        break
-        else:
-            #  spaCy and Sumy use different tokenizers, so they may do sentencizing slightly differently.
-            #  When we compare "lemmatized" versions, they may not match 1:1 because of that,
-            #  so unless we do a Sumy Parser implementation using the spaCy token/sentences
-            # we may need to do a "fuzzy" match to find the original sentence with the "lemma" matching the summary sentence
-            # "lemma"
-            #
-
-            doc = "\n".join(lemma_sents)
-            parser = PlaintextParser.from_string(doc, Tokenizer(self.language))
-            summary = summarizer(parser.document, num_sentences)
-
-            for lemma_sentence in summary:
-                for original in sentences:
-                    summary_lemma = str(lemma_sentence).strip()
-                    original_lemma = original.lemmatized_text.strip()
-                    similarity = fuzz.ratio(summary_lemma, original_lemma)
-                    # pprint(similarity)
-                    if similarity >= 80:
-                        ranked_sentences.append(original)
-                        break
+        summarizer = choose_summarizer(len(sentences), engine)
+        self.summarizer = summarizer.name
+        ranked_sentences = summarizer(sentences, num_sentences, self.language)
 
         if len(ranked_sentences) < num_sentences:
             log.warn(
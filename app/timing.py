@@ -0,0 +1,213 @@
+import re, resource, sys, threading, time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+#
+# Per-stage timing instrumentation.
+#
+# - `timed("nlp", model=...)` measures a processing stage, `upstream("bing_search")` an upstream (HTTP) call
+# - every measurement goes into a latency histogram (see METRICS, scraped via /metrics)
+# - and, while handling a request, into the Server-Timing header of the response (see ServerTimingMiddleware)
+#
+
+# Histogram buckets (in seconds)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Timings of the current request, as (name, seconds)
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+class Histogram(object):
+    """
+    A latency histogram (cumulative buckets, sum and count), in the Prometheus sense
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class MetricsRegistry(object):
+    """
+    Histograms and counters, keyed by metric name and label values.
+    Rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self) -> None:
+        self._histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple], int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name: str, value: int = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), histogram in sorted(
+                    self._histograms.items(), key=lambda item: str(item[0])
+                ):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                        cumulative += count
+                        bucket_labels = labels + (("le", str(bound)),)
+                        lines.append(
+                            f"{name}_bucket{_labels(bucket_labels)} {cumulative}"
+                        )
+                    lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in sorted(
+                    self._counters.items(), key=lambda item: str(item[0])
+                ):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        k + '="'
+        + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        + '"'
+        for k, v in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+METRICS = MetricsRegistry()
+
+
+def rss_mb() -> float:
+    """
+    Resident memory of this process, in MB
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / (1024 * 1024)
+    except (OSError, IndexError, ValueError):
+        # Not on Linux: use the peak RSS instead (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _record(name: str, seconds: float) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def timed(stage: str, **labels) -> Iterator[None]:
+    """
+    Measures a processing stage, e.g. `with timed("nlp", model=model_name): ...`
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        METRICS.observe("summed_stage_duration_seconds", seconds, stage=stage, **labels)
+        _record(stage, seconds)
+
+
+@contextmanager
+def upstream(name: str) -> Iterator[None]:
+    """
+    Measures a call to an upstream service, e.g. `with upstream("bing_search"): requests.get(...)`.
+    Failed calls (exceptions) are counted separately.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        METRICS.increment("summed_upstream_errors_total", upstream=name)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        METRICS.observe("summed_upstream_duration_seconds", seconds, upstream=name)
+        METRICS.increment("summed_upstream_requests_total", upstream=name)
+        _record(name, seconds)
+
+
+class ServerTimingMiddleware(object):
+    """
+    ASGI middleware collecting the timings of a request, and adding them as `Server-Timing` header.
+    Also records the total duration per endpoint into the metrics.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: List[Tuple[str, float]] = []
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total = time.perf_counter() - start
+                header = ", ".join(
+                    f"{_token(name)};dur={seconds * 1000:.1f}"
+                    for name, seconds in timings + [("total", total)]
+                )
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", header.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            # The router sets the matched endpoint in the (shared) scope.
+            # Using its name instead of the path keeps the number of label values bounded.
+            endpoint = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            METRICS.observe(
+                "summed_request_duration_seconds",
+                time.perf_counter() - start,
+                endpoint=endpoint,
+                status=status,
+            )
+
+
+def _token(name: str) -> str:
+    # Server-Timing metric names must be HTTP tokens
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
@@ -0,0 +1,58 @@
+import os, hashlib, logging, tempfile
+from typing import AsyncIterator, BinaryIO, Tuple
+
+from fastapi.exceptions import HTTPException
+
+log = logging.getLogger(__name__)
+
+# Size of the chunks we write to the spooled file (and feed into the hash)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 64 * 1024))
+# Uploads larger than this are rolled over from memory to a temporary file on disk
+UPLOAD_SPOOL_MAX_SIZE = int(os.getenv("UPLOAD_SPOOL_MAX_SIZE", 1024 * 1024))
+# Hard limit for a single upload
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", 512 * 1024 * 1024))
+
+
+async def spool_upload(
+    stream: AsyncIterator[bytes],
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    max_size: int = UPLOAD_MAX_SIZE,
+) -> Tuple[BinaryIO, str, int]:
+    """
+    Streams an (async) byte stream, e.g. a request body, into a spooled temporary file.
+    The data is written in fixed-size chunks and hashed on the fly, so the complete upload
+    is never held in memory.
+
+    Returns the (rewound) file, the sha256 hex digest of the content and its size in bytes.
+    The caller is responsible for closing the file.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_SIZE)
+    sha256 = hashlib.sha256()
+    size = 0
+    buffer = bytearray()
+
+    try:
+        async for data in stream:
+            if not data:
+                continue
+            size += len(data)
+            if size > max_size:
+                raise HTTPException(413, f"Upload exceeds maximum size of {max_size} bytes")
+
+            buffer.extend(data)
+            while len(buffer) >= chunk_size:
+                chunk = bytes(buffer[:chunk_size])
+                del buffer[:chunk_size]
+                sha256.update(chunk)
+                spooled.write(chunk)
+
+        if buffer:
+            sha256.update(buffer)
+            spooled.write(buffer)
+    except BaseException:
+        spooled.close()
+        raise
+
+    spooled.seek(0)
+    log.info(f"Spooled upload of {size} bytes (sha256={sha256.hexdigest()})")
+    return spooled, sha256.hexdigest(), size
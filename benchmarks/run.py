@@ -0,0 +1,402 @@
+"""
+Offline benchmark suite for the SumMed API server.
+
+Starts stand-in servers for all upstreams (see stubs.py) and the API server (uvicorn, in-process),
+drives every endpoint with the sample corpus plus generated long documents,
+and reports throughput and p50/p95/p99 latencies per endpoint.
+
+Compares the results with a stored baseline (benchmarks/baseline.json) and fails (exit code 1)
+on regressions, or if there is no baseline:
+
+    python -m benchmarks.run --requests 50 --concurrency 4
+    python -m benchmarks.run --update-baseline
+
+Latencies depend on the machine, record the baseline where the benchmark runs (e.g. the CI runner).
+The committed baseline was recorded with blank spaCy pipelines (with a sentencizer) for the models and
+the centroid summarizer, so NLP time is left out mostly and the server's own overhead dominates:
+
+    SUMMARIZER=centroid SPACY_MODELS=en_core_web_sm=<blank en>,de_core_news_sm=<blank de>,fr_core_news_sm=<blank fr> \
+        python -m benchmarks.run --update-baseline
+"""
+import json, os, random, socket, statistics, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import requests
+import typer
+
+from benchmarks.stubs import (
+    UPSTREAMS,
+    KeyValueStandIn,
+    StubConfig,
+    StubUpstreams,
+    UpstreamBehavior,
+)
+
+ROOT = Path(__file__).parent.parent
+DEFAULT_CORPUS = ROOT / "data" / "txt" / "sample_texts.txt"
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+
+def load_corpus(path: Path) -> List[str]:
+    """
+    The documents of a corpus file, separated by blank lines
+    """
+    text = path.read_text(encoding="utf-8")
+    return [doc.strip() for doc in text.split("\n\n") if doc.strip()]
+
+
+def generate_long_documents(
+    corpus: List[str], sizes: List[int], seed: int = 0
+) -> List[str]:
+    """
+    Long documents of (at least) the given sizes in chars, made of shuffled corpus sentences in paragraphs
+    """
+    rnd = random.Random(seed)
+    sentences = [s.strip() + "." for doc in corpus for s in doc.split(". ") if s.strip()]
+    documents = []
+    for size in sizes:
+        paragraphs, length = [], 0
+        while length < size:
+            paragraph = " ".join(rnd.choice(sentences) for _ in range(8))
+            paragraphs.append(paragraph)
+            length += len(paragraph) + 1
+        documents.append("\n".join(paragraphs))
+    return documents
+
+
+@dataclass
+class Scenario:
+    """
+    An endpoint to benchmark. `build(i)` returns the keyword arguments for the i-th request
+    """
+
+    name: str
+    method: str
+    path: str
+    build: Callable[[int], dict]
+
+
+@dataclass
+class Result:
+    name: str
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+        return ordered[index]
+
+    def summary(self) -> dict:
+        count = len(self.latencies) + self.errors
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "error_rate": self.errors / count if count else 0.0,
+            "throughput": count / self.elapsed if self.elapsed else 0.0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p95_ms": self.percentile(95) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+        }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api_server(port: int):
+    """
+    Runs the API server with uvicorn in a background thread.
+    The environment must already point to the stand-in upstreams.
+    """
+    import uvicorn
+    from app import api
+
+    config = uvicorn.Config(api, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    server.install_signal_handlers = lambda: None
+    thread = threading.Thread(target=server.run, name="api-server", daemon=True)
+    thread.start()
+
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("API server failed to start")
+        time.sleep(0.05)
+    return server
+
+
+def build_scenarios(
+    base_url: str, stubs: StubUpstreams, documents: List[str], session: requests.Session
+) -> List[Scenario]:
+    def doc(i: int) -> str:
+        return documents[i % len(documents)]
+
+    # Render requests need an analysis, we compute those once up-front
+    analyses = []
+    for text in documents:
+        response = session.post(f"{base_url}/analyze", json={"text": text})
+        response.raise_for_status()
+        analyses.append(response.json())
+    compact_analyses = []
+    for text in documents:
+        response = session.post(
+            f"{base_url}/analyze", params={"format": "compact"}, json={"text": text}
+        )
+        response.raise_for_status()
+        compact_analyses.append(response.json())
+
+    terms = ["breast cancer", "carcinoma", "mammography", "tamoxifen", "biopsy"]
+
+    return [
+        Scenario("analyze", "POST", "/analyze", lambda i: {"json": {"text": doc(i)}}),
+        Scenario(
+            "analyze_compact",
+            "POST",
+            "/analyze",
+            lambda i: {"json": {"text": doc(i)}, "params": {"format": "compact"}},
+        ),
+        Scenario(
+            "render",
+            "POST",
+            "/render",
+            lambda i: {"json": analyses[i % len(analyses)]},
+        ),
+        Scenario(
+            "render_compact",
+            "POST",
+            "/render",
+            lambda i: {"json": compact_analyses[i % len(compact_analyses)]},
+        ),
+        Scenario(
+            "render_stream",
+            "POST",
+            "/render",
+            lambda i: {"json": analyses[i % len(analyses)], "params": {"stream": True}},
+        ),
+        Scenario(
+            "extract",
+            "GET",
+            "/extract",
+            lambda i: {"params": {"url": stubs.page_url(i % len(documents))}},
+        ),
+        Scenario(
+            "extract_batch",
+            "POST",
+            "/extract/batch",
+            lambda i: {
+                "json": {
+                    "urls": [stubs.page_url((i + k) % len(documents)) for k in range(4)]
+                }
+            },
+        ),
+        Scenario(
+            "extract_upload",
+            "POST",
+            "/extract/upload",
+            lambda i: {
+                "data": doc(i).encode("utf-8"),
+                "headers": {"Content-Type": "text/plain"},
+            },
+        ),
+        Scenario(
+            "pipeline",
+            "POST",
+            "/pipeline",
+            lambda i: {"json": {"url": stubs.page_url(i % len(documents))}},
+        ),
+        Scenario(
+            "search",
+            "GET",
+            "/search",
+            lambda i: {"params": {"q": terms[i % len(terms)]}},
+        ),
+        Scenario(
+            "definition",
+            "GET",
+            "/definition",
+            lambda i: {"params": {"term": terms[i % len(terms)]}},
+        ),
+        Scenario(
+            "translate",
+            "GET",
+            "/translate",
+            lambda i: {"params": {"text": terms[i % len(terms)], "to": "de"}},
+        ),
+        Scenario("immersive_reader_token", "GET", "/immersive_reader_token", lambda i: {}),
+        Scenario("metrics", "GET", "/metrics", lambda i: {}),
+    ]
+
+
+def run_scenario(
+    base_url: str, scenario: Scenario, num_requests: int, concurrency: int
+) -> Result:
+    result = Result(name=scenario.name)
+    lock = threading.Lock()
+    local = threading.local()
+
+    def call(i: int) -> None:
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session.request(
+                scenario.method, f"{base_url}{scenario.path}", **scenario.build(i)
+            )
+            # Consume (streamed) bodies completely
+            response.content
+            ok = response.ok
+        except requests.RequestException:
+            ok = False
+        latency = time.perf_counter() - start
+        with lock:
+            if ok:
+                result.latencies.append(latency)
+            else:
+                result.errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(num_requests)))
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def median_summary(summaries: List[dict]) -> dict:
+    """
+    Per metric median of the summaries of repeated runs, so single noisy runs don't decide
+    """
+    return {key: statistics.median_low(s[key] for s in summaries) for key in summaries[0]}
+
+
+def find_regressions(
+    summaries: Dict[str, dict],
+    baseline: Dict[str, dict],
+    tolerance: float,
+    min_delta_ms: float = 0.0,
+) -> List[str]:
+    """
+    Endpoints whose p95 latency, throughput or error rate got worse than the baseline (plus tolerance).
+    Latencies must also be min_delta_ms worse, fast endpoints vary by more than the tolerance easily.
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = summaries.get(name)
+        if current is None:
+            continue
+        if current["p95_ms"] > max(
+            base["p95_ms"] * (1 + tolerance), base["p95_ms"] + min_delta_ms
+        ):
+            regressions.append(
+                f"{name}: p95 {current['p95_ms']:.1f} ms > baseline {base['p95_ms']:.1f} ms"
+            )
+        if current["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {current['throughput']:.1f}/s < baseline {base['throughput']:.1f}/s"
+            )
+        if current["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(
+                f"{name}: error rate {current['error_rate']:.2%} > baseline {base['error_rate']:.2%}"
+            )
+    return regressions
+
+
+def print_report(summaries: Dict[str, dict]) -> None:
+    header = f"{'endpoint':<24}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    typer.echo(header)
+    typer.echo("-" * len(header))
+    for name, s in summaries.items():
+        typer.echo(
+            f"{name:<24}{s['requests']:>9}{s['errors']:>8}{s['throughput']:>9.1f}"
+            f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}"
+        )
+
+
+def main(
+    requests_per_endpoint: int = typer.Option(50, "--requests", help="Requests per endpoint"),
+    repeat: int = typer.Option(3, help="Runs per endpoint, the median of their results counts"),
+    concurrency: int = typer.Option(4, help="Concurrent clients"),
+    endpoints: Optional[str] = typer.Option(None, help="Comma separated endpoints to run (default: all)"),
+    corpus: Path = typer.Option(DEFAULT_CORPUS, help="Corpus with documents separated by blank lines"),
+    long_documents: str = typer.Option("20000,100000", help="Sizes (chars) of generated long documents"),
+    latency: float = typer.Option(0.02, help="Latency of the stand-in upstreams, in seconds"),
+    jitter: float = typer.Option(0.01, help="Random additional upstream latency, in seconds"),
+    error_rate: float = typer.Option(0.0, help="Share of failing upstream requests"),
+    cache: bool = typer.Option(False, help="Keep the result caches enabled"),
+    shared_store: bool = typer.Option(False, help="Use the shared result store, backed by a local key-value stand-in"),
+    baseline: Path = typer.Option(DEFAULT_BASELINE, help="Stored baseline results"),
+    update_baseline: bool = typer.Option(False, help="Store the results as new baseline"),
+    tolerance: float = typer.Option(0.2, help="Allowed relative regression against the baseline"),
+    min_delta_ms: float = typer.Option(50.0, help="Allowed p95 latency regression in ms, in any case"),
+    output: Optional[Path] = typer.Option(None, help="Write the results as JSON"),
+):
+    documents = load_corpus(corpus)
+    sizes = [int(size) for size in long_documents.split(",") if size.strip()]
+    documents += generate_long_documents(documents, sizes)
+
+    behavior = UpstreamBehavior(latency=latency, jitter=jitter, error_rate=error_rate)
+    config = StubConfig(behaviors={name: behavior for name in UPSTREAMS}, pages=documents)
+
+    with StubUpstreams(config) as stubs, KeyValueStandIn() as key_value:
+        # Must be set before the app is imported, as some modules read their settings on import
+        os.environ.update(stubs.environment())
+        if shared_store:
+            os.environ.update({"RESULT_STORE": "redis", "RESULT_STORE_URL": key_value.url})
+        if not cache:
+            for name in ("EXTRACT_CACHE_SIZE", "ANALYZE_CACHE_SIZE", "UPLOAD_CACHE_SIZE"):
+                os.environ[name] = "0"
+
+        port = _free_port()
+        server = start_api_server(port)
+        base_url = f"http://127.0.0.1:{port}"
+
+        try:
+            scenarios = build_scenarios(base_url, stubs, documents, requests.Session())
+            if endpoints:
+                selected = {name.strip() for name in endpoints.split(",")}
+                scenarios = [s for s in scenarios if s.name in selected]
+
+            summaries = {}
+            for scenario in scenarios:
+                runs = [
+                    run_scenario(base_url, scenario, requests_per_endpoint, concurrency).summary()
+                    for _ in range(max(1, repeat))
+                ]
+                summaries[scenario.name] = median_summary(runs)
+        finally:
+            server.should_exit = True
+
+    print_report(summaries)
+    if output:
+        output.write_text(json.dumps(summaries, indent=2))
+
+    if update_baseline:
+        baseline.write_text(json.dumps(summaries, indent=2, sort_keys=True))
+        typer.echo(f"Baseline written to {baseline}")
+        return
+
+    if not baseline.exists():
+        typer.echo(f"\nNo baseline at {baseline}, record one with --update-baseline", err=True)
+        raise typer.Exit(1)
+
+    regressions = find_regressions(
+        summaries, json.loads(baseline.read_text()), tolerance, min_delta_ms
+    )
+    if regressions:
+        typer.echo("\nRegressions against baseline:", err=True)
+        for regression in regressions:
+            typer.echo(f"- {regression}", err=True)
+        raise typer.Exit(1)
+    typer.echo("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,334 @@
+"""
+Local stand-in servers for the upstream services (Bing Custom Search, Merriam-Webster dictionary,
+Azure Text Analytics for Health, Azure Translator, Azure AD) and for web pages to extract.
+
+All upstreams are served by a single HTTP server, under a path prefix per upstream.
+Latency and error rate can be configured per upstream, to see how the API behaves with slow or failing upstreams.
+"""
+import json, random, re, socketserver, threading, time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+# A few terms the TA4H stand-in "recognizes", with their category
+HEALTH_TERMS = {
+    "breast cancer": "Diagnosis",
+    "cancer": "Diagnosis",
+    "carcinoma": "Diagnosis",
+    "biopsy": "ExaminationName",
+    "mammographic screening": "ExaminationName",
+    "surgery": "TreatmentName",
+    "radiation therapy": "TreatmentName",
+    "chemotherapy": "TreatmentName",
+    "tamoxifen": "MedicationName",
+    "raloxifene": "MedicationName",
+    "lump": "SymptomOrSign",
+    "bone pain": "SymptomOrSign",
+    "breast": "BodyStructure",
+    "lymph nodes": "BodyStructure",
+}
+HEALTH_PATTERN = re.compile(
+    r"\b(" + "|".join(sorted(map(re.escape, HEALTH_TERMS), key=len, reverse=True)) + r")\b",
+    re.IGNORECASE,
+)
+
+UPSTREAMS = ("bing", "dictionary", "ta4h", "translator", "aad", "pages")
+
+
+@dataclass
+class UpstreamBehavior:
+    """
+    - **latency** Added delay per request, in seconds
+    - **jitter** Random additional delay (0..jitter), in seconds
+    - **error_rate** Share of requests answered with a 503 error (0..1)
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+
+@dataclass
+class StubConfig:
+    behaviors: Dict[str, UpstreamBehavior] = field(default_factory=dict)
+    # Documents served as web pages under /pages/<index>
+    pages: List[str] = field(default_factory=list)
+    seed: int = 0
+
+    def behavior(self, upstream: str) -> UpstreamBehavior:
+        return self.behaviors.get(upstream) or UpstreamBehavior()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config: StubConfig = StubConfig()
+    random = random.Random(0)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method: str):
+        url = urlparse(self.path)
+        upstream = url.path.strip("/").split("/")[0]
+        behavior = self.config.behavior(upstream)
+
+        delay = behavior.latency + self.random.uniform(0, behavior.jitter)
+        if delay:
+            time.sleep(delay)
+        if behavior.error_rate and self.random.random() < behavior.error_rate:
+            return self._send(503, {"error": f"injected {upstream} error"})
+
+        length = int(self.headers.get("content-length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        handler = getattr(self, f"_{upstream}", None)
+        if handler is None:
+            return self._send(404, {"error": f"unknown upstream {upstream}"})
+        handler(method, url.path, parse_qs(url.query), body)
+
+    def _send(self, status: int, payload, content_type: str = "application/json"):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    #
+    # Upstreams
+    #
+    def _bing(self, method, path, query, body):
+        q = query.get("q", [""])[0]
+        media = {
+            "name": f"About {q}",
+            "contentUrl": "http://localhost/media",
+            "hostPageUrl": "http://localhost/page",
+            "thumbnailUrl": "http://localhost/thumbnail",
+            "webSearchUrl": "http://localhost/search",
+        }
+        if path.endswith("/images/search") or path.endswith("/videos/search"):
+            return self._send(200, {"value": [media] * 3})
+        page = {"name": f"About {q}", "url": "http://localhost/page", "snippet": q}
+        self._send(200, {"webPages": {"value": [page] * 3}})
+
+    def _dictionary(self, method, path, query, body):
+        term = unquote(path.rsplit("/", 1)[-1])
+        self._send(
+            200,
+            [
+                {
+                    "meta": {"id": term},
+                    "hwi": {"hw": term},
+                    "fl": "noun",
+                    "shortdef": [f"a stand-in definition of {term}"],
+                }
+            ],
+        )
+
+    def _ta4h(self, method, path, query, body):
+        documents = json.loads(body or b"{}").get("documents", [])
+        results = []
+        for document in documents:
+            entities = [
+                {
+                    "text": m.group(0),
+                    "offset": m.start(),
+                    "length": len(m.group(0)),
+                    "category": HEALTH_TERMS[m.group(0).lower()],
+                    "name": m.group(0).lower(),
+                }
+                for m in HEALTH_PATTERN.finditer(document["text"])
+            ]
+            results.append({"id": str(document["id"]), "entities": entities})
+        self._send(200, {"documents": results})
+
+    def _translator(self, method, path, query, body):
+        texts = json.loads(body or b"[]")
+        to = query.get("to", ["de"])[0]
+        self._send(
+            200,
+            [
+                {
+                    "detectedLanguage": {"language": "en", "score": 1.0},
+                    "translations": [{"to": to, "text": t["text"]}],
+                }
+                for t in texts
+            ],
+        )
+
+    def _aad(self, method, path, query, body):
+        self._send(200, {"access_token": "stand-in-token"})
+
+    def _pages(self, method, path, query, body):
+        try:
+            text = self.config.pages[int(path.rsplit("/", 1)[-1])]
+        except (ValueError, IndexError):
+            return self._send(404, b"not found", "text/html")
+        paragraphs = "".join(f"<p>{p}</p>" for p in text.split("\n") if p.strip())
+        html = f"<html><head><title>Page</title></head><body><article>{paragraphs}</article></body></html>"
+        self._send(200, html.encode("utf-8"), "text/html; charset=utf-8")
+
+
+class StubUpstreams(object):
+    """
+    Runs the stand-in upstream server in a background thread.
+    Use environment() to point the API server to it, before importing the app:
+
+        with StubUpstreams(StubConfig()) as stubs:
+            os.environ.update(stubs.environment())
+            ...
+    """
+
+    def __init__(self, config: StubConfig, host: str = "127.0.0.1", port: int = 0):
+        handler = type("ConfiguredStubHandler", (StubHandler,), {})
+        handler.config = config
+        handler.random = random.Random(config.seed)
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self) -> Dict[str, str]:
+        """
+        Environment variables pointing the API server to the stand-ins
+        """
+        return {
+            "BING_CUSTOM_SEARCH_API_KEY": "stand-in",
+            "BING_CUSTOM_SEARCH_CONFIG_ID": "stand-in",
+            "BING_CUSTOM_SEARCH_API_BASE_URL": f"{self.url}/bing",
+            "MW_API_KEY": "stand-in",
+            "MW_API_BASE_URL": f"{self.url}/dictionary",
+            "AZURE_TEXT_ANALYTICS_ENDPOINT": f"{self.url}/ta4h",
+            "AZURE_TEXT_ANALYTICS_KEY": "stand-in",
+            "AZURE_COGNITIVE_SERVICES_ENDPOINT": f"{self.url}/translator",
+            "AZURE_COGNITIVE_SERVICES_KEY": "stand-in",
+            "AZURE_COGNITIVE_SERVICES_REGION": "local",
+            "AZURE_AD_AUTHORITY_URL": f"{self.url}/aad",
+            "AZURE_IMMERSIVE_READER_TENANT_ID": "stand-in",
+            "AZURE_IMMERSIVE_READER_SUBDOMAIN": "stand-in",
+        }
+
+    def page_url(self, index: int) -> str:
+        return f"{self.url}/pages/{index}"
+
+    def start(self) -> "StubUpstreams":
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="stub-upstreams", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "StubUpstreams":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+class KeyValueHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough of the Redis protocol (RESP) for the result store: PING, GET, SET (EX/PX), DEL
+    """
+
+    def handle(self):
+        while True:
+            try:
+                command = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+            self.wfile.write(self.server.execute(command))
+
+    def _read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+class KeyValueStandIn(socketserver.ThreadingTCPServer):
+    """
+    A local stand-in for the network key-value store (Redis) of the shared result store.
+    Point the API server to it with RESULT_STORE=redis and RESULT_STORE_URL=stand_in.url
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), KeyValueHandler)
+        self.data: Dict[bytes, tuple] = {}
+        self.lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def execute(self, command: List[bytes]) -> bytes:
+        name = command[0].upper() if command else b""
+        with self.lock:
+            if name == b"PING":
+                return b"+PONG\r\n"
+            if name == b"SELECT" or name == b"CLIENT":
+                return b"+OK\r\n"
+            if name == b"GET":
+                expires, value = self.data.get(command[1], (None, None))
+                if value is None or (expires and expires < time.time()):
+                    self.data.pop(command[1], None)
+                    return b"$-1\r\n"
+                return b"$%d\r\n%s\r\n" % (len(value), value)
+            if name == b"SET":
+                expires = None
+                options = [o.upper() for o in command[3:]]
+                for i, option in enumerate(options[:-1]):
+                    if option == b"EX":
+                        expires = time.time() + float(command[3 + i + 1])
+                    elif option == b"PX":
+                        expires = time.time() + float(command[3 + i + 1]) / 1000
+                self.data[command[1]] = (expires, command[2])
+                return b"+OK\r\n"
+            if name == b"DEL":
+                count = sum(1 for key in command[1:] if self.data.pop(key, None))
+                return b":%d\r\n" % count
+        return b"-ERR unknown command\r\n"
+
+    def start(self) -> "KeyValueStandIn":
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="key-value-stand-in", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "KeyValueStandIn":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -1,4 +1,4 @@
-import logging, uvicorn
+import logging, os, uvicorn
 from dotenv import find_dotenv, load_dotenv
 
 
@@ -21,7 +21,15 @@ import app.api as api
 # Entrypoint for "python main.py"
 if __name__ == "__main__":
 
-    #
-    # Start uvicorn server
-    #
-    uvicorn.run(api, host="0.0.0.0", port=5000, log_level="debug", log_config=None)
+    if os.getenv("SERVER_MODE", "development").lower() == "production":
+        #
+        # Pre-forked uvicorn workers, sharing the preloaded models (see app/server.py)
+        #
+        from app.server import serve_from_env
+
+        serve_from_env()
+    else:
+        #
+        # Start uvicorn server
+        #
+        uvicorn.run(api, host="0.0.0.0", port=5000, log_level="debug", log_config=None)
@@ -0,0 +1,91 @@
+"""Measure accuracy, inference speed and memory of trained textcat models on the eval set."""
+import multiprocessing
+import resource
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import srsly
+import typer
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _dir_size_mb(path: Path) -> float:
+    return sum(f.stat().st_size for f in path.glob("**/*") if f.is_file()) / 1024 / 1024
+
+
+def _format(value: Optional[float], spec: str) -> str:
+    return "n/a" if value is None else format(value, spec)
+
+
+def measure(
+    model_path: Path, dev_path: Path, batch_size: int, repeat: int, max_chars: int
+) -> dict:
+    """Runs in a fresh process, so the memory numbers are those of a single model."""
+    import spacy
+    from spacy.training import Corpus
+
+    rss_before = _max_rss_mb()
+    nlp = spacy.load(model_path)
+    rss_loaded = _max_rss_mb()
+
+    examples = list(Corpus(str(dev_path))(nlp))
+    scores = nlp.evaluate(examples)
+
+    # The server classifies a prefix of each document only (DOCTYPE_PREFIX_CHARS)
+    texts = [eg.reference.text[:max_chars] if max_chars else eg.reference.text for eg in examples]
+    # Words (tokens) of the texts actually classified, not of the complete documents
+    words = sum(len(doc) for doc in nlp.tokenizer.pipe(texts))
+
+    # Warm up, then time nlp.pipe over the eval set
+    list(nlp.pipe(texts[:batch_size], batch_size=batch_size))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _ in nlp.pipe(texts, batch_size=batch_size):
+            pass
+    seconds = (time.perf_counter() - start) / repeat
+
+    return {
+        "model": str(model_path),
+        "cats_score": scores.get("cats_score"),
+        "cats_macro_f": scores.get("cats_macro_f"),
+        "docs": len(texts),
+        "docs_per_second": len(texts) / seconds if seconds else None,
+        "words_per_second": words / seconds if seconds else None,
+        "ms_per_doc": 1000 * seconds / len(texts) if texts else None,
+        "load_rss_mb": rss_loaded - rss_before,
+        "peak_rss_mb": _max_rss_mb() - rss_before,
+        "disk_mb": _dir_size_mb(model_path),
+    }
+
+
+def benchmark(
+    dev_path: Path,
+    output_path: Path,
+    model_paths: List[Path],
+    batch_size: int = typer.Option(16, help="nlp.pipe batch size, as DOCTYPE_BATCH_SIZE of the server"),
+    repeat: int = typer.Option(5, help="Passes over the eval set"),
+    max_chars: int = typer.Option(5000, help="Classify only this prefix, as DOCTYPE_PREFIX_CHARS (0: all)"),
+):
+    # One process per model, so the loaded models don't add up in the memory measurements
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for model_path in model_paths:
+        with context.Pool(1) as pool:
+            result = pool.apply(measure, (model_path, dev_path, batch_size, repeat, max_chars))
+        results.append(result)
+        typer.echo(
+            f"{result['model']}: score={_format(result['cats_score'], '.3f')} "
+            f"{_format(result['docs_per_second'], '.1f')} docs/s "
+            f"({_format(result['ms_per_doc'], '.2f')} ms/doc) "
+            f"memory={result['peak_rss_mb']:.1f} MB disk={result['disk_mb']:.1f} MB"
+        )
+    srsly.write_json(output_path, results)
+
+
+if __name__ == "__main__":
+    typer.run(benchmark)
@@ -1,21 +1,51 @@
-"""Convert textcat annotation from JSONL to spaCy v3 .spacy format."""
+"""Convert textcat annotation from JSONL to spaCy v3 .spacy format.
+
+The input is streamed, tokenized with nlp.pipe (in several processes) and written as
+a directory of .spacy shards, so memory stays bounded by the shard size.
+spaCy's corpus reader (spacy train, spacy evaluate) accepts the directory as is.
+"""
 import srsly
 import typer
-import warnings
 from pathlib import Path
 
 import spacy
 from spacy.tokens import DocBin
 
 
-def convert(lang: str, input_path: Path, output_path: Path):
+def convert(
+    lang: str,
+    input_path: Path,
+    output_path: Path,
+    n_process: int = typer.Option(1, help="Processes for tokenization"),
+    batch_size: int = typer.Option(256, help="Texts per nlp.pipe batch"),
+    shard_size: int = typer.Option(5000, help="Docs per .spacy file"),
+):
     nlp = spacy.blank(lang)
-    db = DocBin()
-    for line in srsly.read_jsonl(input_path):
-        doc = nlp.make_doc(line["text"])
-        doc.cats = line["cats"]
+    output_path.mkdir(parents=True, exist_ok=True)
+    # Remove shards of a previous conversion, they would be read as part of the corpus
+    for previous in output_path.glob("*.spacy"):
+        previous.unlink()
+
+    lines = (
+        (line["text"], line["cats"])
+        for line in srsly.read_jsonl(input_path)
+        if line.get("text")
+    )
+
+    shard, db, total = 0, DocBin(), 0
+    for doc, cats in nlp.pipe(lines, as_tuples=True, n_process=n_process, batch_size=batch_size):
+        doc.cats = cats
         db.add(doc)
-    db.to_disk(output_path)
+        if len(db) >= shard_size:
+            db.to_disk(output_path / f"{shard:04d}.spacy")
+            total += len(db)
+            shard, db = shard + 1, DocBin()
+
+    if len(db) or not shard:
+        db.to_disk(output_path / f"{shard:04d}.spacy")
+        total += len(db)
+        shard += 1
+    typer.echo(f"Converted {total} docs into {shard} shard(s) in {output_path}")
 
 
 if __name__ == "__main__":
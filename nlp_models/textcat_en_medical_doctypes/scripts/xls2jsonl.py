@@ -1,27 +1,38 @@
-"""Convert Excel sheet to XSONL format."""
+"""Convert Excel sheet to JSONL format, streaming row by row."""
 import srsly
 import typer
-import warnings
 from pathlib import Path
-import pandas
-import json
+from typing import Iterator
+
+from openpyxl import load_workbook
+
+
+def read_rows(input_path: Path, sheet_name: str) -> Iterator[dict]:
+    """Rows of the sheet as dicts, keyed by the header row. Rows are read lazily (read-only mode)."""
+    workbook = load_workbook(filename=input_path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = [str(name) if name is not None else None for name in next(rows, ())]
+        for values in rows:
+            if all(value is None for value in values):
+                continue
+            yield {name: value for name, value in zip(header, values) if name is not None}
+    finally:
+        workbook.close()
 
 
 def convert(
-    lang: str = "en",
-    input_path: Path = Path("../assets/docs_doctypes_all.xlsx"),
+    lang: str = typer.Argument("en"),
+    input_path: Path = typer.Argument(Path("../assets/docs_doctypes_all.xlsx")),
+    output_path: Path = typer.Argument(Path("../assets/docs_doctypes_all.jsonl")),
     sheet_name: str = "Sheet1",
-    output_path: Path = Path("../assets/docs_doctypes_all.jsonl"),
     append: bool = False,
 ):
-    # Read excel document
-    df = pandas.read_excel(input_path, sheet_name=sheet_name)
-    # Convert excel json
-    as_json = df.to_json(orient="records")
-    json_input = json.loads(as_json)
-    # print(type(json_input))
     srsly.write_jsonl(
-        path=output_path, lines=json_input, append=append, append_new_line=True
+        path=output_path,
+        lines=read_rows(input_path, sheet_name),
+        append=append,
+        append_new_line=True,
     )
 
 
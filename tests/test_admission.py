@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from fastapi.exceptions import HTTPException
+
+from app.admission import AdmissionController, Lane
+
+
+def _controller() -> AdmissionController:
+    return AdmissionController(
+        short_text_limit=100,
+        short=Lane("short", concurrency=1, max_queued_cost=100),
+        long=Lane("long", concurrency=1, max_queued_cost=1000),
+    )
+
+
+def test_lanes_by_cost():
+    controller = _controller()
+    assert controller.lane(50) is controller.short
+    assert controller.lane(500) is controller.long
+
+
+def test_reject_when_queue_over_budget():
+    controller = _controller()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def work(cost):
+            async with controller.admit(cost):
+                await release.wait()
+
+        running = asyncio.ensure_future(work(80))  # runs
+        queued = asyncio.ensure_future(work(80))  # waits in the short lane
+        await asyncio.sleep(0)
+
+        # Short lane queue is full...
+        with pytest.raises(HTTPException) as e:
+            async with controller.admit(80):
+                pass
+        assert e.value.status_code == 429
+        assert int(e.value.headers["Retry-After"]) >= 1
+
+        # ... but long documents have their own lane
+        long_running = asyncio.ensure_future(work(500))
+        await asyncio.sleep(0)
+        assert controller.long.in_flight == 1
+
+        release.set()
+        await asyncio.gather(running, queued, long_running)
+        assert controller.short.queued_cost == 0
+        assert controller.short.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_background_work_waits_instead_of_rejection():
+    controller = _controller()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def work(cost, reject=True):
+            async with controller.admit(cost, reject=reject):
+                await release.wait()
+
+        running = asyncio.ensure_future(work(80))
+        queued = asyncio.ensure_future(work(80))
+        await asyncio.sleep(0)
+
+        # Over budget, but waits for its turn
+        background = asyncio.ensure_future(work(80, reject=False))
+        await asyncio.sleep(0)
+        assert controller.short.queued_cost == 160
+
+        release.set()
+        await asyncio.gather(running, queued, background)
+        assert controller.short.queued_cost == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,149 @@
+import re
+
+import pytest
+import spacy
+from spacy.language import Language
+
+from app import analysis, textanalyzer
+from app.analysis import analyze, analyze_cache_key, document_request, paragraphs
+from app.api_models import AnalyzeRequest, AnalyzeResponse, ExtractResponse
+from app.cache import ResultCache
+from app.textanalyzer import TextAnalyzer
+
+
+def test_paragraph_offsets():
+    text = "First paragraph,\nstill first.\n\n  \nSecond one.\n\nThird."
+    spans = paragraphs(text)
+    assert [text[start:end] for start, end in spans] == [
+        "First paragraph,\nstill first.",
+        "Second one.",
+        "Third.",
+    ]
+    # Offsets stay valid in the analyzed text, where newlines are replaced by spaces
+    analyzed = text.replace("\n", " ")
+    assert [analyzed[start:end] for start, end in spans][1] == "Second one."
+
+
+def test_document_requests_share_cache_key():
+    extracted = ExtractResponse.construct(text="Breast cancer is a cancer.", language="en")
+    # Prefetcher: just the extracted page
+    prefetched = document_request(extracted=extracted)
+    # /pipeline or a job for the same URL, with the request defaults
+    requested = document_request(None, None, None, 3, extracted=extracted)
+    assert prefetched.language == "en"
+    assert analyze_cache_key(prefetched) == analyze_cache_key(requested)
+
+
+class _Recorder(object):
+    def __init__(self) -> None:
+        self.parsed = []
+
+    def __call__(self, doc):
+        self.parsed.append(doc.text)
+        return doc
+
+
+@Language.factory("analysis_test_recorder")
+def _recorder(nlp, name):
+    return _Recorder()
+
+
+@pytest.fixture
+def analyzed(monkeypatch):
+    """
+    Runs analyses with a blank English pipeline (sentencizer, entity ruler) and a fake TA4H,
+    recording the parsed texts and the TA4H requests
+    """
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    nlp.add_pipe("entity_ruler").add_patterns(
+        [{"label": "ORG", "pattern": "Mayo Clinic"}, {"label": "GPE", "pattern": "Boston"}]
+    )
+    parsed = nlp.add_pipe("analysis_test_recorder", first=True).parsed
+    ta4h_requests = []
+
+    def ta4h(self, texts, language="en"):
+        ta4h_requests.append(texts)
+        return [
+            {
+                "id": f"{idx}.0",
+                "entities": [
+                    {"text": "cancer", "offset": match.start(), "length": 6, "category": "Diagnosis"}
+                    for match in re.finditer("cancer", text)
+                ],
+            }
+            for idx, text in enumerate(texts)
+        ]
+
+    monkeypatch.setattr(TextAnalyzer, "_getSpacyLanguage", lambda self, name: nlp)
+    monkeypatch.setattr(TextAnalyzer, "_azure_text_analytics_for_health", ta4h)
+    monkeypatch.setenv("AZURE_TEXT_ANALYTICS_ENDPOINT", "https://ta4h.invalid")
+    monkeypatch.setattr(textanalyzer, "HEALTH_ENTITY_SOURCES", ["ta4h"])
+    monkeypatch.setattr(analysis, "HEALTH_ENTITY_SOURCES", ["ta4h"])
+    monkeypatch.setattr(analysis, "PARAGRAPH_CACHE", ResultCache("paragraph", AnalyzeResponse))
+
+    def run(text: str, incremental: bool) -> AnalyzeResponse:
+        del parsed[:], ta4h_requests[:]
+        request = AnalyzeRequest(
+            text=text, language="en", summarizer="centroid", incremental=incremental
+        )
+        return analyze(request, use_cache=False)
+
+    run.parsed, run.ta4h_requests = parsed, ta4h_requests
+    return run
+
+
+def _spans(spans):
+    return [(span.text, span.start, span.end) for span in spans or []]
+
+
+def test_incremental_reanalyzes_changed_paragraphs(analyzed):
+    paragraphs_before = [
+        "Breast cancer is treated at the Mayo Clinic.",
+        "Screening finds cancer early.",
+        "Patients in Boston can get a second opinion.",
+    ]
+    first = analyzed("\n\n".join(paragraphs_before), incremental=True)
+    assert len(analyzed.parsed) == 3
+    assert analyzed.ta4h_requests == [paragraphs_before]
+
+    # Edit the second paragraph: the third moves
+    edited = "\n\n".join(
+        [paragraphs_before[0], "Regular screening finds most cancer early.", paragraphs_before[2]]
+    )
+    second = analyzed(edited, incremental=True)
+    # Only the changed paragraph is parsed, and sent to TA4H (in one request)
+    assert analyzed.parsed == ["Regular screening finds most cancer early."]
+    assert analyzed.ta4h_requests == [["Regular screening finds most cancer early."]]
+    assert _spans(second.entities) != _spans(first.entities)
+
+    full = analyzed(edited, incremental=False)
+    assert _spans(second.entities) == _spans(full.entities)
+    assert _spans(second.health_entities) == _spans(full.health_entities)
+    # The full parse starts sentences after a blank line with a whitespace token
+    assert [(s.text.strip(), s.end) for s in second.top_sentences] == [
+        (s.text.strip(), s.end) for s in full.top_sentences
+    ]
+    assert [(e.text, e.start) for e in second.entities] == [
+        ("Mayo Clinic", edited.index("Mayo")),
+        ("Boston", edited.index("Boston")),
+    ]
+
+
+def test_analyze_endpoint_serializes_without_validation(analyzed):
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.testclient import TestClient
+
+    from app.api import api
+
+    request = {
+        "text": "Breast cancer is treated at the Mayo Clinic in Boston.",
+        "language": "en",
+        "summarizer": "centroid",
+    }
+    response = TestClient(api).post("/analyze", json=request)
+    assert response.status_code == 200
+    # Same as FastAPI's validated serialization of the response_model
+    expected = analyze(AnalyzeRequest(**request))
+    assert response.json() == jsonable_encoder(AnalyzeResponse.parse_obj(expected.dict()))
+    assert response.json()["health_entities"][0]["text"] == "cancer"
@@ -0,0 +1,95 @@
+import gc, weakref
+
+import spacy
+from spacy.matcher import PhraseMatcher
+
+from app import gazetteer as gazetteer_module
+from app import model_registry
+from app.gazetteer import Gazetteer, compile_terms
+from app.api_models import NamedEntity
+from app.model_registry import ModelRegistry
+from app.textanalyzer import merge_entities
+
+
+def _gazetteer(tmp_path) -> Gazetteer:
+    terms = tmp_path / "terms.tsv"
+    terms.write_text(
+        "term\tlabel\tdefinition\n"
+        "breast\tBodyStructure\tBreast\n"
+        "breast cancer\tDiagnosis\tMalignant neoplasm of breast\n"
+        "mammogram\tExaminationName\tMammography\n",
+        encoding="utf-8",
+    )
+    assert compile_terms(str(terms), str(tmp_path / "compiled"), "en") == 3
+    return Gazetteer(str(tmp_path / "compiled"))
+
+
+def test_compile_load_and_match(tmp_path):
+    gazetteer = _gazetteer(tmp_path)
+    text = "A Mammogram can find Breast cancer early."
+    entities = gazetteer(spacy.blank("en")(text))
+
+    # Longest match wins, case is ignored
+    assert [(e.text, e.label) for e in entities] == [
+        ("Mammogram", "ExaminationName"),
+        ("Breast cancer", "Diagnosis"),
+    ]
+    assert all(text[e.start : e.end] == e.text for e in entities)
+    assert entities[1].definition == "Malignant neoplasm of breast"
+
+
+def test_matcher_released_with_model(tmp_path, monkeypatch):
+    class BlankSpacy(object):
+        @staticmethod
+        def load(target):
+            return spacy.blank("en")
+
+    monkeypatch.setattr(model_registry, "spacy", BlankSpacy)
+    monkeypatch.setattr(model_registry, "rss_mb", lambda: 0)
+    monkeypatch.setattr(model_registry, "_disk_mb", lambda target: 1)
+    registry = ModelRegistry(check_interval=0)
+    monkeypatch.setattr(gazetteer_module, "MODELS", registry)
+
+    gazetteer = _gazetteer(tmp_path)
+    nlp = registry.get("en_core_web_sm")
+    doc = nlp("A mammogram.")
+    assert len(gazetteer(doc)) == 1
+    # Built once per model
+    assert gazetteer.matcher(nlp.vocab) is gazetteer.matcher(nlp.vocab)
+
+    # Evicted: the gazetteer keeps neither the model nor its vocab (via the matcher) alive
+    model, vocab = weakref.ref(nlp), nlp.vocab
+    del nlp, doc
+    registry.evict("en_core_web_sm")
+    gc.collect()
+    assert model() is None
+    assert not [r for r in gc.get_referrers(vocab) if isinstance(r, PhraseMatcher)]
+
+
+def _entity(text: str, start: int, label: str) -> NamedEntity:
+    return NamedEntity.construct(text=text, start=start, end=start + len(text), label=label)
+
+
+def test_merge_with_nested_ta4h_entities():
+    text = "metastatic breast cancer of the left breast, treated with tamoxifen"
+    ta4h = [
+        # A long entity, and one nested in it (TA4H reports both)
+        _entity("metastatic breast cancer", 0, "Diagnosis"),
+        _entity("breast", 11, "BodyStructure"),
+        _entity("tamoxifen", text.index("tamoxifen"), "MedicationName"),
+    ]
+    gazetteer = [
+        # Overlaps the long TA4H entity, not the one starting last before it ends
+        _entity("cancer", 18, "Diagnosis"),
+        _entity("breast", text.index("breast,"), "BodyStructure"),
+        _entity("tamoxifen", text.index("tamoxifen"), "MedicationName"),
+    ]
+
+    merged = merge_entities(ta4h, gazetteer)
+    assert [(e.text, e.start) for e in merged] == [
+        ("metastatic breast cancer", 0),
+        ("breast", 11),
+        ("breast", text.index("breast,")),
+        ("tamoxifen", text.index("tamoxifen")),
+    ]
+    assert merged[3] is ta4h[2]
@@ -0,0 +1,125 @@
+import asyncio, zlib
+
+from app.http_cache import CompressionMiddleware, ConditionalRequestMiddleware, etag_matches
+
+
+def _request(middleware, body: bytes, headers=()):
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/analyze",
+        "query_string": b"",
+        "headers": list(headers),
+    }
+    received = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return received.pop(0) if received else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent[0]["status"], dict(sent[0]["headers"]), sent[1]["body"]
+
+
+def test_etag_and_not_modified():
+    calls = []
+
+    async def app(scope, receive, send):
+        message = await receive()
+        calls.append(message["body"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"result"})
+
+    middleware = ConditionalRequestMiddleware(app, paths=["/analyze"])
+
+    status, headers, body = _request(middleware, b'{"text": "a"}')
+    assert status == 200 and body == b"result"
+    assert calls == [b'{"text": "a"}']
+    etag = headers[b"etag"]
+
+    # Same request, client has the result already: not computed again
+    status, headers, body = _request(
+        middleware, b'{"text": "a"}', [(b"if-none-match", etag)]
+    )
+    assert status == 304 and body == b""
+    assert headers[b"etag"] == etag
+    assert len(calls) == 1
+
+    # Another request
+    status, headers, _ = _request(
+        middleware, b'{"text": "b"}', [(b"if-none-match", etag)]
+    )
+    assert status == 200 and headers[b"etag"] != etag
+    assert len(calls) == 2
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"x", W/"abc"')
+    assert etag_matches('"abc"', "*")
+    assert not etag_matches('"abc"', '"abcd"')
+
+
+def test_compression_of_streamed_chunks():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for chunk in (b"<p>one</p>", b"<p>two</p>"):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    scope = {"type": "http", "method": "GET", "path": "/render", "headers": [(b"accept-encoding", b"gzip")]}
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(CompressionMiddleware(app)(scope, None, send))
+    assert dict(sent[0]["headers"])[b"content-encoding"] == b"gzip"
+
+    # Every chunk can be decompressed as soon as it arrives
+    decompressor = zlib.decompressobj(31)
+    assert decompressor.decompress(sent[1]["body"]) == b"<p>one</p>"
+    assert decompressor.decompress(sent[2]["body"]) == b"<p>two</p>"
+    decompressor.decompress(sent[3]["body"])
+    assert decompressor.eof
+
+
+def test_compression_of_small_bodies_skipped():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"small"})
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", b"gzip")]}
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(CompressionMiddleware(app, minimum_size=100)(scope, None, send))
+    assert b"content-encoding" not in dict(sent[0]["headers"])
+    assert sent[1]["body"] == b"small"
+
+
+def test_no_etag_when_creating_a_session():
+    calls = []
+
+    async def app(scope, receive, send):
+        message = await receive()
+        calls.append(message["body"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"new session"})
+
+    middleware = ConditionalRequestMiddleware(app, paths=["/analyze"])
+    request = b'{"text": "a", "session": true}'
+
+    status, headers, _ = _request(middleware, request)
+    assert status == 200 and b"etag" not in headers
+    # Even if the client sends the ETag of another response
+    status, headers, body = _request(middleware, request, [(b"if-none-match", b"*")])
+    assert status == 200 and body == b"new session"
+    assert calls == [request, request]
+
+    status, headers, _ = _request(middleware, b'{"text": "a", "session": false}')
+    assert b"etag" in headers
@@ -0,0 +1,173 @@
+import time
+
+import pytest
+
+from app import jobs
+from app.api_models import AnalyzeJobRequest
+from app.jobs import (
+    DONE,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    JobStore,
+    JobWorkers,
+    check_callback_url,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, "time", lambda: now[0])
+    return now
+
+
+def _store(tmp_path, **kwargs) -> JobStore:
+    return JobStore(str(tmp_path / "jobs.sqlite"), **kwargs)
+
+
+def test_claim_oldest_and_lease(tmp_path, clock):
+    store = _store(tmp_path, lease_seconds=60)
+    first = store.submit(AnalyzeJobRequest(text="first"))
+    clock[0] += 1
+    second = store.submit(AnalyzeJobRequest(text="second"))
+
+    claimed = store.claim()
+    assert claimed["id"] == first.id
+    assert store.claim()["id"] == second.id
+    # Both leased
+    assert store.claim() is None
+    assert store.get(first.id).status == RUNNING
+
+    # Progress renews the lease of the first job only
+    clock[0] += 50
+    store.progress(first.id, claimed["lease"], "analyze", 0.4)
+    clock[0] += 20
+    row = store.claim()
+    # Attempts before this one
+    assert row["id"] == second.id and row["attempts"] == 1
+    assert store.claim() is None
+
+
+def test_retry_until_max_attempts(tmp_path, clock):
+    store = _store(tmp_path, max_attempts=2)
+    job = store.submit(AnalyzeJobRequest(text="text"))
+
+    row = store.claim()
+    store.fail(job.id, row["lease"], "boom", row["attempts"] + 1)
+    assert store.get(job.id).status == QUEUED
+    assert store.get(job.id).error is None
+
+    row = store.claim()
+    assert row["attempts"] == 1
+    store.fail(job.id, row["lease"], "boom", row["attempts"] + 1)
+    failed = store.get(job.id)
+    assert failed.status == FAILED and failed.error == "boom"
+    assert store.claim() is None
+
+
+def test_finish_and_purge(tmp_path, clock):
+    store = _store(tmp_path, retention_seconds=100)
+    done = store.submit(AnalyzeJobRequest(text="done"))
+    queued = store.submit(AnalyzeJobRequest(text="queued"))
+    row = store.claim()
+    store.finish(done.id, row["lease"], '{"text": "done"}')
+    assert store.get(done.id).status == DONE
+    assert store.result(done.id) == '{"text": "done"}'
+    assert store.result(queued.id) is None
+
+    clock[0] += 50
+    assert store.purge() == 0
+    clock[0] += 100
+    assert store.purge() == 1
+    assert store.get(done.id) is None
+    # Unfinished jobs are kept
+    assert store.get(queued.id).status == QUEUED
+
+
+def test_jobs_survive_restart(tmp_path, clock):
+    store = _store(tmp_path, lease_seconds=60)
+    job = store.submit(AnalyzeJobRequest(text="text"))
+    store.claim()
+
+    # Process crashed while running the job: another store on the same database
+    # picks it up once the lease expired
+    restarted = _store(tmp_path, lease_seconds=60)
+    assert restarted.claim() is None
+    clock[0] += 61
+    row = restarted.claim()
+    assert row["id"] == job.id and row["attempts"] == 1
+
+
+def test_expired_last_attempt_fails(tmp_path, clock):
+    store = _store(tmp_path, lease_seconds=60, max_attempts=2)
+    job = store.submit(AnalyzeJobRequest(text="poison"))
+
+    # The job takes its process down on every attempt: never reaches fail()
+    store.claim()
+    clock[0] += 61
+    assert store.claim()["id"] == job.id
+    clock[0] += 61
+    assert store.claim() is None
+    failed = store.get(job.id)
+    assert failed.status == FAILED and "Lease expired" in failed.error
+
+
+def test_updates_need_the_current_lease(tmp_path, clock):
+    store = _store(tmp_path, lease_seconds=60)
+    job = store.submit(AnalyzeJobRequest(text="text"))
+    first = store.claim()
+
+    # Renewed while running: not claimed again
+    clock[0] += 50
+    assert store.renew(job.id, first["lease"])
+    clock[0] += 50
+    assert store.claim() is None
+
+    # Lease expired and the job claimed again: the first claim can't update it anymore
+    clock[0] += 61
+    second = store.claim()
+    assert second["lease"] != first["lease"]
+    assert not store.renew(job.id, first["lease"])
+    assert not store.progress(job.id, first["lease"], "analyze", 0.4)
+    assert not store.finish(job.id, first["lease"], '{"text": "first"}')
+    assert not store.fail(job.id, first["lease"], "boom", 3)
+    assert store.get(job.id).status == RUNNING
+
+    assert store.finish(job.id, second["lease"], '{"text": "second"}')
+    assert store.result(job.id) == '{"text": "second"}'
+    # Not running anymore
+    assert not store.fail(job.id, second["lease"], "boom", 3)
+
+
+def test_heartbeat_renews_lease(tmp_path):
+    store = _store(tmp_path, lease_seconds=0.3)
+    job = store.submit(AnalyzeJobRequest(text="text"))
+    row = store.claim()
+
+    with JobWorkers(store)._heartbeat(job.id, row["lease"]):
+        # Waiting (e.g. for admission) longer than the lease
+        time.sleep(0.6)
+        assert store.claim() is None
+    assert store.finish(job.id, row["lease"], "{}")
+
+
+def test_callback_url_check(monkeypatch):
+    check_callback_url("http://93.184.216.34/hook")
+    for url in (
+        "file:///etc/passwd",
+        "http://127.0.0.1:5000/jobs",
+        "http://localhost/",
+        "http://10.0.0.7/hook",
+        "http://169.254.169.254/latest/meta-data/",
+        "http://[::1]/",
+    ):
+        with pytest.raises(ValueError):
+            check_callback_url(url)
+
+    monkeypatch.setattr(jobs, "JOBS_CALLBACK_HOSTS", ["hooks.example.com", ".example.org"])
+    check_callback_url("https://hooks.example.com/done")
+    check_callback_url("https://ci.example.org/done")
+    for url in ("https://example.com/", "http://93.184.216.34/hook", "ftp://hooks.example.com/"):
+        with pytest.raises(ValueError):
+            check_callback_url(url)
@@ -0,0 +1,45 @@
+from app import keywords
+from app.keywords import IdfTable, document_frequencies, idf_value, rank_keywords, write_table
+
+DOCUMENTS = [
+    "the patient was told about the risk of breast cancer",
+    "the study of the heart and the lungs",
+    "the weather of the week",
+    "the mammogram of the patient",
+]
+
+
+def test_idf_table_roundtrip(tmp_path):
+    frequencies, count = document_frequencies(DOCUMENTS)
+    path = str(tmp_path / "idf.bin")
+    slots = write_table(frequencies, count, path)
+    assert slots >= 2 * len(frequencies)
+
+    table = IdfTable(path)
+    try:
+        assert table.documents == 4
+        assert abs(table.idf("the") - idf_value(4, 4)) < 1e-6
+        assert abs(table.idf("mammogram") - idf_value(4, 1)) < 1e-6
+        # Unknown terms are the most specific
+        assert abs(table.idf("oncology") - idf_value(4, 0)) < 1e-6
+    finally:
+        table.close()
+
+
+def test_rank_keywords(tmp_path, monkeypatch):
+    frequencies, count = document_frequencies(DOCUMENTS * 3)
+    path = str(tmp_path / "idf.bin")
+    write_table(frequencies, count, path)
+    monkeypatch.setattr(keywords, "IDF_TABLE", path)
+    monkeypatch.setattr(keywords, "_TABLE", None)
+    monkeypatch.setattr(keywords, "_TABLE_LOADED", False)
+
+    ranked = rank_keywords(
+        ["the breast cancer", "breast cancer", "the patient", "breast", "the week"],
+        limit=3,
+        boost=["breast cancer"],
+    )
+    # Stopwords dropped, redundant "breast" skipped
+    assert ranked[0] == "breast cancer"
+    assert "breast" not in ranked
+    assert "the patient" not in ranked and "patient" in ranked
@@ -0,0 +1,31 @@
+import json, logging, sys
+
+from app.log_config import LOG_FORMAT, JsonFormatter, LocalQueueHandler
+
+
+def _queued_exception_record() -> logging.LogRecord:
+    handler = LocalQueueHandler(None)
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        record = logging.makeLogRecord(
+            {"name": "app.test", "msg": "failed %s", "args": ("job",), "request_id": "abc"}
+        )
+        record.exc_info = sys.exc_info()
+    return handler.prepare(record)
+
+
+def test_json_exception_survives_queue():
+    record = _queued_exception_record()
+    assert record.exc_info is None
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "failed job"
+    assert entry["request_id"] == "abc"
+    assert "ZeroDivisionError" in entry["exception"]
+
+
+def test_plain_exception_survives_queue():
+    formatted = logging.Formatter(LOG_FORMAT).format(_queued_exception_record())
+    assert "failed job" in formatted
+    assert "ZeroDivisionError" in formatted
@@ -0,0 +1,88 @@
+import itertools, json, os, threading, time
+
+from app import model_registry
+from app.model_registry import ModelRegistry, parse_sources
+
+
+class FakeSpacy(object):
+    loads = []
+
+    @classmethod
+    def load(cls, target):
+        cls.loads.append(target)
+        return object()
+
+
+def test_lru_eviction_within_budget(monkeypatch):
+    monkeypatch.setattr(model_registry, "spacy", FakeSpacy)
+    # Every model appears to take 50 MB
+    rss = itertools.count(step=50)
+    monkeypatch.setattr(model_registry, "rss_mb", lambda: next(rss))
+
+    registry = ModelRegistry(
+        sources={"custom": "/models/custom"}, memory_budget_mb=120, check_interval=0
+    )
+    first = registry.get("en_core_web_sm")
+    registry.get("custom")
+    assert registry.get("en_core_web_sm") is first
+
+    # Third model: the least recently used one ("custom") is evicted
+    registry.get("de_core_news_sm")
+    assert [m["name"] for m in registry.loaded()] == ["en_core_web_sm", "de_core_news_sm"]
+    assert FakeSpacy.loads[:2] == ["en_core_web_sm", "/models/custom"]
+
+
+def test_parse_sources():
+    assert parse_sources("a=/x, b = pkg ,broken") == {"a": "/x", "b": "pkg"}
+
+
+def test_hot_reload_in_background(tmp_path, monkeypatch):
+    release = threading.Event()
+
+    class SlowSpacy(object):
+        @staticmethod
+        def load(target):
+            if target == "/models/v2":
+                # A large model, loading takes a while
+                release.wait(5)
+            return target
+
+    monkeypatch.setattr(model_registry, "spacy", SlowSpacy)
+    monkeypatch.setattr(model_registry, "rss_mb", lambda: 0)
+    monkeypatch.setattr(model_registry, "_disk_mb", lambda target: 1)
+
+    registry_file = tmp_path / "models.json"
+    registry_file.write_text(json.dumps({"custom": "/models/v1"}))
+    registry = ModelRegistry(registry_file=str(registry_file), check_interval=3600)
+    assert registry.get("custom") == "/models/v1"
+
+    registry_file.write_text(json.dumps({"custom": "/models/v2"}))
+    os.utime(registry_file, (time.time() + 10, time.time() + 10))
+    registry._checked = time.monotonic() - 3600
+    thread = registry.check()
+    assert thread is not None
+
+    # Requests are served by the loaded version meanwhile, they don't wait for the reload
+    assert registry.get("custom") == "/models/v1"
+    release.set()
+    thread.join(5)
+    assert registry.get("custom") == "/models/v2"
+
+
+def test_check_not_due_on_creation():
+    registry = ModelRegistry(check_interval=3600)
+    assert registry.check() is None
+
+
+def test_forked_worker_can_check():
+    registry = ModelRegistry(check_interval=1)
+    # The parent is checking (e.g. in the middle of a reload) when the worker is forked
+    assert registry._checking.acquire(blocking=False)
+    try:
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if registry._checking.acquire(blocking=False) else 1)
+        _, status = os.waitpid(pid, 0)
+    finally:
+        registry._checking.release()
+    assert status == 0
@@ -0,0 +1,59 @@
+from app.api_models import AnalyzeResponse, CompactRenderRequest, NamedEntity
+from app.compact import to_compact
+from app.renderer import HTMLRenderer
+
+
+def _entity(text: str, full_text: str, label: str) -> NamedEntity:
+    start = full_text.index(text)
+    return NamedEntity(text=text, start=start, end=start + len(text), label=label)
+
+
+def test_render_overlapping_entities():
+    text = "Breast cancer is a cancer of the breast <tissue>."
+    analysis = AnalyzeResponse(
+        language="en",
+        model="core_web_sm",
+        text=text,
+        entities=[_entity("cancer", text, "ORG")],
+        health_entities=[_entity("Breast cancer", text, "Diagnosis")],
+    )
+
+    html = HTMLRenderer()(analysis)
+
+    # The longer health entity wins, the nested entity is not tagged again
+    assert "<span alt='Diagnosis' class='Diagnosis'>Breast cancer</span>" in html
+    assert html.count("<span") == 1
+    # Text outside of entities is escaped
+    assert "&lt;tissue&gt;" in html
+
+
+def test_render_stream_matches_render():
+    text = "Breast cancer is common. " * 400
+    entities = [
+        NamedEntity(text="cancer", start=i + 7, end=i + 13, label="Diagnosis")
+        for i in range(0, len(text), 25)
+    ]
+    analysis = AnalyzeResponse(
+        language="en", model="core_web_sm", text=text, health_entities=entities
+    )
+    renderer = HTMLRenderer()
+
+    segments = list(renderer.stream(analysis, segment_size=1000))
+
+    assert len(segments) > 3
+    assert "".join(segments) == renderer(analysis)
+
+
+def test_render_compact_matches_render():
+    text = "Breast cancer is cancer that develops from breast tissue."
+    analysis = AnalyzeResponse(
+        language="en",
+        model="core_web_sm",
+        text=text,
+        entities=[_entity("breast tissue", text, "BodyStructure")],
+        health_entities=[_entity("Breast cancer", text, "Diagnosis")],
+    )
+    compact = CompactRenderRequest(**to_compact(analysis))
+
+    assert compact.labels == ["BodyStructure", "Diagnosis"]
+    assert HTMLRenderer()(compact) == HTMLRenderer()(analysis)
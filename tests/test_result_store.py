@@ -0,0 +1,70 @@
+import asyncio, time
+from typing import Any
+
+import pytest
+from pydantic import BaseModel
+
+from app.cache import ResultCache
+from app.result_store import DiskStore, MemoryStore, RedisStore
+from benchmarks.stubs import KeyValueStandIn
+
+
+def _roundtrip(store):
+    assert store.get("missing") is None
+
+    store.set("key", b"value")
+    assert store.get("key") == b"value"
+
+    store.set("expiring", b"value", ttl=0.01)
+    time.sleep(0.05)
+    assert store.get("expiring") is None
+
+    store.delete("key")
+    assert store.get("key") is None
+
+
+def test_memory_store():
+    _roundtrip(MemoryStore(max_items=10))
+
+
+def test_disk_store(tmp_path):
+    _roundtrip(DiskStore(str(tmp_path)))
+
+
+def test_disk_store_evicts_oldest(tmp_path):
+    store = DiskStore(str(tmp_path), max_bytes=1000)
+    for i in range(20):
+        store.set(f"key{i}", b"x" * 200)
+        time.sleep(0.02)
+
+    assert store.get("key19") == b"x" * 200
+    assert store.get("key0") is None
+
+
+def test_redis_store_against_stand_in():
+    pytest.importorskip("redis")
+    with KeyValueStandIn() as stand_in:
+        _roundtrip(RedisStore(stand_in.url))
+
+
+class _Result(BaseModel):
+    value: Any
+
+
+class _FailingStore(MemoryStore):
+    def get(self, key):
+        raise ConnectionError("store down")
+
+    def set(self, key, value, ttl=None):
+        raise ConnectionError("store down")
+
+
+def test_result_cache_failures_are_misses():
+    cache = ResultCache("test", _Result, store=_FailingStore())
+    assert asyncio.run(cache.get_async("key")) is None
+
+    # Store down, or a value that can't be encoded: kept locally only
+    asyncio.run(cache.set_async("key", _Result(value=1)))
+    cache.set("other", _Result(value=object()))
+    assert cache.get("key").value == 1
+    assert cache.get("other") is not None
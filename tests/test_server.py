@@ -0,0 +1,60 @@
+from app import server as server_module
+from app.server import PreforkServer
+
+
+def test_restart_backoff():
+    server = PreforkServer(restart_backoff=1, max_restart_backoff=4, min_uptime=30)
+
+    # Failed starts: doubling, up to the maximum
+    assert [server._restart_delay(0, 256, 1.0) for _ in range(4)] == [1, 2, 4, 4]
+    # Other slots have their own count
+    assert server._restart_delay(1, 256, 1.0) == 1
+    # Recycled (clean exit): replaced at once, count reset
+    assert server._restart_delay(0, 0, 1.0) == 0
+    assert server._restart_delay(0, 256, 1.0) == 1
+    # Crashed after running a while: replaced at once
+    assert server._restart_delay(0, 256, 60.0) == 0
+    assert server._restart_delay(0, 256, 1.0) == 1
+
+
+def test_replacements_start_when_due(monkeypatch):
+    server = PreforkServer(workers=2)
+    now = [100.0]
+    spawned = []
+    monkeypatch.setattr(server_module.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(server, "_spawn", lambda api, slot: spawned.append(slot))
+
+    server._restarts = {0: 100.0, 1: 102.0}
+    server._spawn_due(None)
+    assert spawned == [0] and server._restarts == {1: 102.0}
+
+    now[0] = 102.0
+    server._spawn_due(None)
+    assert spawned == [0, 1] and not server._restarts
+
+    # No replacements once stopping
+    server._restarts = {0: 100.0}
+    server._handle_stop(None, None)
+    server._spawn_due(None)
+    assert spawned == [0, 1]
+
+
+def test_request_limit():
+    assert PreforkServer()._request_limit() is None
+    limits = {PreforkServer(max_requests=100)._request_limit() for _ in range(50)}
+    assert all(100 <= limit <= 110 for limit in limits)
+
+
+def test_recycle_on_rss(monkeypatch):
+    class UvicornServer(object):
+        should_exit = False
+
+    readings = iter([100.0, 150.0, 250.0, 100.0])
+    monkeypatch.setattr(server_module, "rss_mb", lambda: next(readings))
+    monkeypatch.setattr(server_module.time, "sleep", lambda seconds: None)
+
+    uvicorn_server = UvicornServer()
+    PreforkServer(max_rss_mb=200)._watch_rss(uvicorn_server)
+    assert uvicorn_server.should_exit
+    # Stopped watching at the first reading over the limit
+    assert next(readings) == 100.0
@@ -0,0 +1,54 @@
+import pytest
+from fastapi.exceptions import HTTPException
+
+from app.api_models import AnalyzeResponse, NamedEntity
+from app.result_store import MemoryStore
+from app.sessions import SessionStore
+
+
+def _analysis(text: str) -> AnalyzeResponse:
+    return AnalyzeResponse.construct(
+        language="en",
+        model="core_web_sm",
+        text=text,
+        health_entities=[
+            NamedEntity.construct(text="Cancer", start=0, end=6, label="Diagnosis"),
+            NamedEntity.construct(text="cancer", start=10, end=16, label="Diagnosis"),
+            NamedEntity.construct(text="biopsy", start=20, end=26, label="ExaminationName"),
+        ],
+    )
+
+
+def test_create_get_and_keywords():
+    sessions = SessionStore(max_bytes=1024 * 1024)
+    analysis = sessions.create(_analysis("x" * 100))
+    assert analysis.session_id
+
+    session = sessions.get(analysis.session_id)
+    assert session.analysis.text == "x" * 100
+    assert sessions.keywords(analysis.session_id) == ["cancer", "biopsy"]
+
+    sessions.delete(analysis.session_id)
+    with pytest.raises(HTTPException) as e:
+        sessions.get(analysis.session_id)
+    assert e.value.status_code == 404
+
+
+def test_evicts_oldest_over_memory_cap():
+    sessions = SessionStore(max_bytes=500)
+    first = sessions.create(_analysis("a" * 200)).session_id
+    second = sessions.create(_analysis("b" * 200)).session_id
+
+    sessions.get(second)
+    with pytest.raises(HTTPException):
+        sessions.get(first)
+
+
+def test_shared_store():
+    store = MemoryStore()
+    session_id = SessionStore(max_bytes=1024, store=store).create(_analysis("text")).session_id
+
+    # Another worker finds it in the shared store
+    session = SessionStore(max_bytes=1024, store=store).get(session_id)
+    assert session.analysis.health_entities[2].text == "biopsy"
+    assert session.doc_bytes is None
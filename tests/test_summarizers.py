@@ -0,0 +1,54 @@
+import pytest
+from pydantic import ValidationError
+
+from app.api_models import AnalyzeRequest, Sentence, SummarizerEngine
+from app import summarizers
+from app.summarizers import SUMMARIZERS, Summarizer, centroid_rank, choose_summarizer
+
+
+def _sentence(text: str) -> Sentence:
+    return Sentence.construct(text=text, lemmatized_text=text, start=0, end=len(text))
+
+
+def test_centroid_keeps_document_order():
+    sentences = [
+        _sentence("breast cancer screening find cancer early"),
+        _sentence("weather nice today"),
+        _sentence("cancer treatment depend stage cancer"),
+        _sentence("lunch sandwich"),
+    ]
+    ranked = centroid_rank(sentences, 2, "english")
+    assert ranked == [sentences[0], sentences[2]]
+    assert all(s.score is not None for s in ranked)
+
+
+def test_auto_choice_by_length(monkeypatch):
+    # Fresh cost models: the shared ones learn from every summarizer run before (observe)
+    fresh = {
+        s.name: Summarizer(s.name, s.rank, s.exponent, seconds_per_unit)
+        for s, seconds_per_unit in (
+            (SUMMARIZERS["lexrank"], 2e-6),
+            (SUMMARIZERS["textrank"], 2e-6),
+            (SUMMARIZERS["lsa"], 1e-6),
+            (SUMMARIZERS["centroid"], 5e-5),
+        )
+    }
+    monkeypatch.setattr(summarizers, "SUMMARIZERS", fresh)
+
+    assert choose_summarizer(20, "auto", budget_ms=250).name == "lexrank"
+    # Quadratic engines don't fit the budget for long documents
+    assert choose_summarizer(5000, "auto", budget_ms=250).name == "centroid"
+    # Explicit choice wins
+    assert choose_summarizer(5000, "textrank") is fresh["textrank"]
+
+    # Learns from measurements: lexrank turned out slower than estimated
+    for _ in range(10):
+        fresh["lexrank"].observe(100, 0.5)
+    assert choose_summarizer(100, "auto", budget_ms=250).name != "lexrank"
+
+
+def test_summarizer_validated_in_request():
+    assert set(SUMMARIZERS) | {"auto"} == {engine.value for engine in SummarizerEngine}
+    assert AnalyzeRequest(text="text", summarizer="centroid").summarizer == "centroid"
+    with pytest.raises(ValidationError):
+        AnalyzeRequest(text="text", summarizer="unknown")
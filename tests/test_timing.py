@@ -0,0 +1,72 @@
+import re
+
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from app.api import api
+from app.timing import MetricsRegistry, ServerTimingMiddleware, rss_mb, timed, upstream
+
+# A sample line of the Prometheus text exposition format: name{labels} value
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_]+="([^"\\]|\\.)*",?)*\})? [0-9.e+-]+$')
+
+
+def test_render_exposition_format():
+    metrics = MetricsRegistry()
+    metrics.observe("stage_seconds", 0.02, stage="nlp", model='en "x"')
+    metrics.observe("stage_seconds", 0.3, stage="nlp", model='en "x"')
+    metrics.increment("errors_total", upstream="bing")
+    metrics.increment("errors_total", 2, upstream="bing")
+
+    lines = metrics.render().splitlines()
+    assert lines[0] == "# TYPE stage_seconds histogram"
+    assert "# TYPE errors_total counter" in lines
+    for line in lines:
+        assert line.startswith("# TYPE ") or SAMPLE.match(line), line
+
+    labels = 'model="en \\"x\\"",stage="nlp"'
+    # Cumulative buckets
+    assert f'stage_seconds_bucket{{{labels},le="0.01"}} 0' in lines
+    assert f'stage_seconds_bucket{{{labels},le="0.025"}} 1' in lines
+    assert f'stage_seconds_bucket{{{labels},le="0.5"}} 2' in lines
+    assert f'stage_seconds_bucket{{{labels},le="+Inf"}} 2' in lines
+    assert f"stage_seconds_count{{{labels}}} 2" in lines
+    assert f"stage_seconds_sum{{{labels}}} 0.32" in lines
+    assert 'errors_total{upstream="bing"} 3' in lines
+
+
+def test_server_timing_header():
+    def endpoint(request):
+        with timed("nlp"):
+            pass
+        with upstream("bing search"):
+            pass
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[Route("/", endpoint)])
+    app.add_middleware(ServerTimingMiddleware)
+
+    response = TestClient(app).get("/")
+    entries = response.headers["server-timing"].split(", ")
+    assert [entry.split(";")[0] for entry in entries] == ["nlp", "bing_search", "total"]
+    assert all(re.match(r"^[\w.-]+;dur=\d+\.\d$", entry) for entry in entries)
+
+
+def test_metrics_endpoint():
+    client = TestClient(api)
+    assert "server-timing" in client.get("/metrics").headers
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE summed_request_duration_seconds histogram" in response.text
+    assert re.search(
+        r'^summed_request_duration_seconds_count\{endpoint="get_metrics",status="200"\} [1-9]',
+        response.text,
+        re.MULTILINE,
+    )
+
+
+def test_rss_mb():
+    assert rss_mb() > 0
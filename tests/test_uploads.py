@@ -0,0 +1,94 @@
+import asyncio, hashlib, importlib
+
+import pytest
+from fastapi.exceptions import HTTPException
+from fastapi.testclient import TestClient
+
+from app import uploads
+from app.api import api
+from app.api_models import ExtractResponse
+from app.cache import ResultCache
+from app.text_extract import Extractor
+
+# The app package exports the FastAPI app as `api`, shadowing the module
+api_module = importlib.import_module("app.api")
+client = TestClient(api)
+
+
+async def _stream(*parts):
+    for part in parts:
+        yield part
+
+
+def _spool(*parts, **kwargs):
+    return asyncio.run(uploads.spool_upload(_stream(*parts), **kwargs))
+
+
+def test_spool_upload_hashes_in_chunks():
+    parts = [b"abc", b"", b"defgh", b"ij"]
+    file, sha256, size = _spool(*parts, chunk_size=4)
+    try:
+        assert file.read() == b"abcdefghij"
+        assert sha256 == hashlib.sha256(b"abcdefghij").hexdigest()
+        assert size == 10
+    finally:
+        file.close()
+
+
+def test_spool_upload_rolls_over_to_disk(monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_SPOOL_MAX_SIZE", 8)
+    file, _, size = _spool(b"0123456789" * 3, chunk_size=4)
+    try:
+        assert size == 30
+        assert file._rolled
+        assert file.read() == b"0123456789" * 3
+    finally:
+        file.close()
+
+
+def test_spool_upload_size_limit():
+    with pytest.raises(HTTPException) as e:
+        _spool(b"0123456789", b"0123456789", max_size=15)
+    assert e.value.status_code == 413
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    monkeypatch.setattr(api_module, "UPLOAD_CACHE", ResultCache("upload", ExtractResponse))
+    extracted = []
+    extract_file_storage = Extractor.extract_file_storage
+
+    def counting(self, file, mediatype, options={}):
+        extracted.append(mediatype)
+        return extract_file_storage(self, file, mediatype, {**options, "classify": False})
+
+    monkeypatch.setattr(Extractor, "extract_file_storage", counting)
+    return extracted
+
+
+def test_extract_upload(extractions):
+    body = "Breast cancer is the most common cancer in women.".encode("utf-8")
+    headers = {"content-type": "text/plain; charset=utf-8"}
+
+    response = client.post("/extract/upload?filename=a.txt", data=body, headers=headers)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["text"] == body.decode("utf-8")
+    assert result["mediatype"] == "text/plain"
+    assert result["sourceUrl"] == f"upload://{hashlib.sha256(body).hexdigest()}"
+    assert result["metadata"]["filename"] == "a.txt"
+    assert result["metadata"]["size"] == len(body)
+
+    # Same content uploaded again: served from the cache, with the filename of this request
+    response = client.post("/extract/upload?filename=b.txt", data=body, headers=headers)
+    assert response.json()["metadata"]["filename"] == "b.txt"
+    assert response.json()["text"] == result["text"]
+    assert len(extractions) == 1
+
+
+def test_extract_upload_unsupported_media_type(extractions):
+    response = client.post(
+        "/extract/upload", data=b"%PDF-1.4", headers={"content-type": "application/pdf"}
+    )
+    assert response.status_code == 415
+    assert "application/pdf" in response.json()["detail"]